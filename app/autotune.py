@@ -0,0 +1,443 @@
+"""
+Auto-tuning of inference threads, batch size and batching window.
+
+    python -m app.autotune                  # calibrate now and cache the result
+    python -m app.autotune --p99-ms 150
+
+The same image runs on machines of very different sizes, and the thread count
+and batch size that serve best differ between them. A calibration benchmarks
+the INFERENCE_BACKEND model on random 224x224x3 inputs:
+
+- for each thread setting (intra-op threads from AUTOTUNE_THREADS, or powers
+  of two up to the cores available per inference worker; for keras also 1 or
+  2 inter-op threads) a child process loads the engine, because TensorFlow
+  fixes its thread pools when it starts
+- the child predicts full batches of each AUTOTUNE_BATCH_SIZES size from
+  INFERENCE_WORKERS threads at once, as BatchScheduler would, for
+  AUTOTUNE_MEASURE_SECONDS, and reports images/s and predict latencies
+
+The setting with the best throughput whose predict p99 plus batching window
+stays under AUTOTUNE_P99_MS wins (the fastest setting otherwise). Its batching
+window is a quarter of the batch's median predict time, cut down to fit the
+target: long enough for concurrent requests to join a batch, short enough not
+to dominate its latency.
+
+Results are cached in AUTOTUNE_CACHE_PATH per CPU model and core count, and
+re-measured when the backend, model file, inference workers or target change.
+With AUTOTUNE=startup the model loader uses the cached result (calibrating
+first if there is none) to create the engine, and the app applies its batch
+size and window to the schedulers. POST /autotune re-calibrates a running
+server: the batch size and window apply at once, the threads at the next start.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import (
+    AUTOTUNE,
+    AUTOTUNE_BATCH_SIZES,
+    AUTOTUNE_CACHE_PATH,
+    AUTOTUNE_MEASURE_SECONDS,
+    AUTOTUNE_P99_MS,
+    AUTOTUNE_THREADS,
+    BASE_DIR,
+    INFERENCE_BACKEND,
+    INFERENCE_WORKERS,
+    MOCK_FIXED_MS,
+    MOCK_PER_IMAGE_MS,
+    MOCK_RELEASE_GIL,
+    MODEL_PATH,
+    ONNX_MODEL_PATH,
+    TFLITE_MODEL_PATH,
+)
+from app.preprocessing import INPUT_SHAPE
+from app.result_cache import model_version_from_file
+
+MODE_OFF = "off"
+MODE_STARTUP = "startup"
+
+# INFERENCE_BACKEND value of the mock model (app/model_loader.py)
+MOCK_BACKEND = "mock"
+
+MODEL_PATHS = {"keras": MODEL_PATH, "tflite": TFLITE_MODEL_PATH, "onnx": ONNX_MODEL_PATH}
+
+# Timed predict calls per worker, however short AUTOTUNE_MEASURE_SECONDS is
+MIN_CALLS = 5
+# Settings within this share of the best throughput are ranked by p99 instead
+THROUGHPUT_TIE = 0.02
+# Batching window as a share of the batch's median predict time
+WINDOW_SHARE = 0.25
+
+
+def available_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine() or "unknown"
+
+
+def machine() -> Dict:
+    """What a calibration is cached by."""
+    return {"cpu_model": cpu_model(), "cores": available_cores()}
+
+
+def machine_key(info: Dict) -> str:
+    return f"{info['cpu_model']} x{info['cores']}"
+
+
+def model_version(backend: str) -> str:
+    if backend == MOCK_BACKEND:
+        # The mock's simulated cost is its "model"
+        return f"mock:{MOCK_FIXED_MS}:{MOCK_PER_IMAGE_MS}:{MOCK_RELEASE_GIL}"
+    return f"{backend}:{model_version_from_file(MODEL_PATHS.get(backend, ''))}"
+
+
+def thread_grid(backend: str, max_threads: int) -> List[Tuple[int, int]]:
+    """(intra-op threads, inter-op threads) settings to measure."""
+    if backend == MOCK_BACKEND:
+        # The mock model has no thread pool; 0 lets the runtime decide
+        return [(0, 1)]
+    if AUTOTUNE_THREADS:
+        counts = sorted({count for count in AUTOTUNE_THREADS if count > 0})
+    else:
+        counts = []
+        count = 1
+        while count < max_threads:
+            counts.append(count)
+            count *= 2
+        counts.append(max_threads)
+    inter_op = [1, 2] if backend == "keras" and max_threads >= 4 else [1]
+    return [(threads, inter) for threads in counts for inter in inter_op]
+
+
+def engine_options(backend: str, config: Dict) -> Dict:
+    """create_engine() options for a tuned config."""
+    if backend == MOCK_BACKEND:
+        return {}
+    options = {"num_threads": config["inference_threads"]}
+    if backend == "keras":
+        options["inter_op_threads"] = config["inter_op_threads"]
+    return options
+
+
+def load_model(backend: str, threads: int, inter_op: int):
+    if backend == MOCK_BACKEND:
+        from app.mock_model import load_mock_model
+        return load_mock_model()
+    from app.engines import create_engine
+    return create_engine(backend, **engine_options(backend, {"inference_threads": threads, "inter_op_threads": inter_op}))
+
+
+def measure_model(model, batch_sizes: List[int], workers: int, seconds: float) -> List[Dict]:
+    """Throughput and predict latencies of full batches from `workers` concurrent callers."""
+    rng = np.random.default_rng(0)
+    points = []
+    for size in batch_sizes:
+        images = rng.random((size,) + INPUT_SHAPE, dtype=np.float32)
+        # Untimed: tracing, kernel selection and buffer allocation
+        model.predict(images)
+
+        latencies: List[List[float]] = [[] for _ in range(workers)]
+        deadline = time.perf_counter() + seconds
+
+        def call(timings: List[float]) -> None:
+            while len(timings) < MIN_CALLS or time.perf_counter() < deadline:
+                started = time.perf_counter()
+                model.predict(images)
+                timings.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=call, args=(timings,)) for timings in latencies]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        all_latencies = np.array([latency for timings in latencies for latency in timings]) * 1000
+        points.append({
+            "batch_size": size,
+            "calls": int(len(all_latencies)),
+            "throughput_ips": round(len(all_latencies) * size / elapsed, 1),
+            "p50_ms": round(float(np.percentile(all_latencies, 50)), 2),
+            "p99_ms": round(float(np.percentile(all_latencies, 99)), 2),
+        })
+    return points
+
+
+def measure_in_child(backend: str, threads: int, inter_op: int, batch_sizes: List[int], workers: int, seconds: float) -> List[Dict]:
+    """Run measure_model in a fresh process with the given thread setting."""
+    command = [
+        sys.executable, "-m", "app.autotune", "--measure",
+        "--backend", backend,
+        "--threads", str(threads),
+        "--inter-op", str(inter_op),
+        "--batch-sizes", ",".join(str(size) for size in batch_sizes),
+        "--workers", str(workers),
+        "--seconds", str(seconds),
+    ]
+    # Loading TensorFlow and the model, plus every batch size at least twice over
+    timeout = 600 + seconds * len(batch_sizes) * 4
+    result = subprocess.run(
+        command, cwd=str(BASE_DIR), env=dict(os.environ, AUTOTUNE=MODE_OFF),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=timeout,
+    )
+    # The engine prints while loading; the measurements are the last line
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines or not lines[-1].startswith("["):
+        tail = "\n".join(lines[-10:])
+        raise RuntimeError(f"measuring {threads} threads failed (exit {result.returncode}):\n{tail}")
+    points = json.loads(lines[-1])
+    for point in points:
+        point["inference_threads"] = threads
+        point["inter_op_threads"] = inter_op
+    return points
+
+
+def choose(measurements: List[Dict], p99_target_ms: float) -> Dict:
+    """The serving config of the best measured setting (see the module docstring)."""
+    candidates = []
+    for point in measurements:
+        window = 0.0 if point["batch_size"] == 1 else WINDOW_SHARE * point["p50_ms"]
+        window = round(max(0.0, min(window, p99_target_ms - point["p99_ms"])), 1)
+        candidates.append((point, window, point["p99_ms"] + window <= p99_target_ms))
+
+    feasible = [candidate for candidate in candidates if candidate[2]]
+    if feasible:
+        best_throughput = max(point["throughput_ips"] for point, _, _ in feasible)
+        close = [c for c in feasible if c[0]["throughput_ips"] >= best_throughput * (1 - THROUGHPUT_TIE)]
+        point, window, met = min(close, key=lambda c: (c[0]["p99_ms"], c[0]["inference_threads"]))
+    else:
+        point, window, met = min(candidates, key=lambda c: c[0]["p99_ms"])
+    return {
+        "inference_threads": point["inference_threads"],
+        "inter_op_threads": point["inter_op_threads"],
+        "batch_max_size": point["batch_size"],
+        "batch_max_wait_ms": window,
+        "throughput_ips": point["throughput_ips"],
+        "predict_p99_ms": point["p99_ms"],
+        "met_target": met,
+    }
+
+
+def calibrate(
+    backend: str = INFERENCE_BACKEND,
+    max_threads: Optional[int] = None,
+    workers: int = INFERENCE_WORKERS,
+    p99_target_ms: float = AUTOTUNE_P99_MS,
+    batch_sizes: List[int] = AUTOTUNE_BATCH_SIZES,
+    seconds: float = AUTOTUNE_MEASURE_SECONDS,
+) -> Dict:
+    """Measure every thread setting and batch size, and pick the serving config."""
+    workers = max(1, int(workers))
+    info = machine()
+    if not max_threads:
+        max_threads = max(1, info["cores"] // workers)
+    started = time.monotonic()
+    measurements = []
+    for threads, inter_op in thread_grid(backend, max_threads):
+        try:
+            points = measure_in_child(backend, threads, inter_op, batch_sizes, workers, seconds)
+        except Exception as e:
+            print(f"WARNING: autotune: {e}")
+            continue
+        best = max(points, key=lambda point: point["throughput_ips"])
+        print(
+            f"autotune: {threads} threads ({inter_op} inter-op): best {best['throughput_ips']} images/s "
+            f"at batch {best['batch_size']} (p99 {best['p99_ms']} ms)"
+        )
+        measurements.extend(points)
+    if not measurements:
+        raise RuntimeError(f"autotune could not measure the {backend} model")
+
+    config = choose(measurements, p99_target_ms)
+    return {
+        "machine": info,
+        "backend": backend,
+        "model_version": model_version(backend),
+        "workers": workers,
+        "max_threads": max_threads,
+        "p99_target_ms": p99_target_ms,
+        "tuned_at": datetime.now().isoformat(),
+        "calibration_seconds": round(time.monotonic() - started, 1),
+        "config": config,
+        "measurements": measurements,
+    }
+
+
+def load_cache(path=AUTOTUNE_CACHE_PATH) -> Dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_result(result: Dict, path=AUTOTUNE_CACHE_PATH) -> None:
+    """Store a calibration under its machine's key, replacing the file atomically."""
+    cache = load_cache(path)
+    cache[machine_key(result["machine"])] = result
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    staging = f"{path}.tmp-{os.getpid()}"
+    with open(staging, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(staging, path)
+
+
+def cached_result(backend: str, max_threads: int, workers: int, p99_target_ms: float, path=AUTOTUNE_CACHE_PATH) -> Optional[Dict]:
+    """This machine's cached calibration, if it was made for the same model and settings."""
+    result = load_cache(path).get(machine_key(machine()))
+    if result is None:
+        return None
+    expected = {
+        "backend": backend,
+        "model_version": model_version(backend),
+        "workers": workers,
+        "max_threads": max_threads,
+        "p99_target_ms": p99_target_ms,
+    }
+    if any(result.get(field) != value for field, value in expected.items()):
+        return None
+    return result
+
+
+class Autotuner:
+    """Holds the calibration in use; runs calibrations at startup or on demand, one at a time"""
+
+    def __init__(self, backend: str = INFERENCE_BACKEND, mode: str = AUTOTUNE, workers: int = INFERENCE_WORKERS):
+        if mode not in (MODE_OFF, MODE_STARTUP):
+            raise ValueError(f"Unknown AUTOTUNE mode {mode!r}; expected {MODE_OFF} or {MODE_STARTUP}")
+        self.backend = backend
+        self.mode = mode
+        self.workers = max(1, int(workers))
+        # The calibration serving was started with (its threads are in the engine)
+        self.result: Optional[Dict] = None
+        # The newest calibration, possibly made on demand after startup
+        self.latest: Optional[Dict] = None
+        self.running = False
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def startup(self, max_threads: Optional[int] = None) -> Optional[Dict]:
+        """
+        With AUTOTUNE=startup, the calibration to serve with: the one already
+        chosen (e.g. by the prefork parent), the cached one, or a new one.
+        """
+        if self.mode != MODE_STARTUP:
+            return None
+        if self.result is not None:
+            return self.result
+        max_threads = max_threads or max(1, available_cores() // self.workers)
+        result = cached_result(self.backend, max_threads, self.workers, AUTOTUNE_P99_MS)
+        if result is not None:
+            print(f"autotune: using cached calibration from {result['tuned_at']}: {result['config']}")
+        else:
+            print(f"autotune: calibrating {self.backend} on {machine_key(machine())}, this takes a while")
+            try:
+                result = self._calibrate(max_threads)
+            except Exception as e:
+                self.error = str(e)
+                print(f"WARNING: {e}; serving with the configured settings")
+                return None
+        self.result = self.latest = result
+        return result
+
+    def start(self, on_done: Callable[[Dict], None], max_threads: Optional[int] = None) -> bool:
+        """Re-calibrate on a background thread; False if a calibration is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self.running = True
+            self.error = None
+
+        def run():
+            try:
+                result = self._calibrate(max_threads or max(1, available_cores() // self.workers))
+                self.latest = result
+                on_done(result)
+            except Exception as e:
+                self.error = str(e)
+                print(f"WARNING: autotune failed: {e}")
+            finally:
+                self.running = False
+
+        threading.Thread(target=run, name="autotune", daemon=True).start()
+        return True
+
+    def _calibrate(self, max_threads: int) -> Dict:
+        result = calibrate(self.backend, max_threads, self.workers)
+        try:
+            save_result(result)
+        except OSError as e:
+            print(f"WARNING: could not cache the calibration: {e}")
+        print(f"autotune: chose {result['config']} in {result['calibration_seconds']}s")
+        return result
+
+    def status(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "machine": machine(),
+            "running": self.running,
+            "error": self.error,
+            "serving": self.result["config"] if self.result else None,
+            "latest": {field: value for field, value in self.latest.items() if field != "measurements"} if self.latest else None,
+        }
+
+
+autotuner = Autotuner()
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default=INFERENCE_BACKEND)
+    parser.add_argument("--p99-ms", type=float, default=AUTOTUNE_P99_MS)
+    parser.add_argument("--batch-sizes", default=",".join(str(size) for size in AUTOTUNE_BATCH_SIZES))
+    parser.add_argument("--workers", type=int, default=INFERENCE_WORKERS)
+    parser.add_argument("--seconds", type=float, default=AUTOTUNE_MEASURE_SECONDS, help="Measuring time per batch size")
+    parser.add_argument("--max-threads", type=int, default=0, help="Default: available cores / workers")
+    # Internal: measure one thread setting in this process (see measure_in_child)
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--threads", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--inter-op", type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",") if size.strip()]
+
+    if args.measure:
+        model = load_model(args.backend, args.threads, args.inter_op)
+        print(json.dumps(measure_model(model, batch_sizes, max(1, args.workers), args.seconds)))
+        return 0
+
+    result = calibrate(args.backend, args.max_threads or None, args.workers, args.p99_ms, batch_sizes, args.seconds)
+    save_result(result)
+    print(f"{'threads':>7} {'inter':>5} {'batch':>5} {'images/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for point in result["measurements"]:
+        print(
+            f"{point['inference_threads']:>7} {point['inter_op_threads']:>5} {point['batch_size']:>5} "
+            f"{point['throughput_ips']:>9} {point['p50_ms']:>8} {point['p99_ms']:>8}"
+        )
+    print(f"Chose {result['config']} (cached in {AUTOTUNE_CACHE_PATH} for {machine_key(result['machine'])})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
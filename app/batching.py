@@ -0,0 +1,243 @@
+"""
+Cross-request micro-batching for model inference.
+
+Concurrent requests hand their preprocessed images to a shared scheduler,
+which groups them into one batch (bounded by BATCH_MAX_SIZE images and
+BATCH_MAX_WAIT_MS of waiting) and runs a single model.predict per batch.
+Each caller gets back exactly the prediction rows for the images it submitted.
+
+Batches run on the inference thread pool, at most `concurrency` at a time, and
+submissions are refused with ExecutorBusyError once `max_queue` images are
+waiting for a batch.
+
+Background submissions (bulk jobs) have lower priority: a batch only starts
+with background images when no interactive request is waiting, and they are
+not counted against `max_queue`. They are queued in chunks of at most
+`max_batch_size` images, so a large job never holds the model for longer than
+one batch.
+"""
+
+import asyncio
+import itertools
+from concurrent.futures import Executor
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app import metrics, profiling
+from app.config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, EXECUTOR_QUEUE_DEPTH
+from app.executors import ExecutorBusyError
+from app.preprocessing import ArenaPool
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# (priority, sequence, images, future)
+QueueItem = Tuple[int, int, np.ndarray, asyncio.Future]
+
+
+class BatchScheduler:
+    """Collects images from concurrent requests and predicts them together"""
+
+    def __init__(
+        self,
+        model,
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_wait_ms: float = BATCH_MAX_WAIT_MS,
+        executor: Optional[Executor] = None,
+        concurrency: int = 1,
+        max_queue: int = EXECUTOR_QUEUE_DEPTH,
+    ):
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.executor = executor
+        self.concurrency = max(1, int(concurrency))
+        self.max_queue = max(1, int(max_queue))
+        self._queued = 0
+        self._background_queued = 0
+        # Items are (priority, sequence, images, future): interactive requests
+        # first, then submission order
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count()
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._running: Set[asyncio.Task] = set()
+        # Futures of profiled requests: their batches are sampled for them
+        self._profiles: Dict[asyncio.Future, profiling.Profile] = {}
+        # Batches are assembled into recycled buffers rather than new arrays
+        self._arenas = ArenaPool(self.max_batch_size, max_free=self.concurrency)
+
+    def configure(self, max_batch_size: Optional[int] = None, max_wait_ms: Optional[float] = None) -> None:
+        """Change the batch size and window (e.g. to auto-tuned values); applies from the next batch."""
+        if max_batch_size is not None:
+            self.max_batch_size = max(1, int(max_batch_size))
+            # Batches in flight return their buffers to the old pool, which is then dropped
+            self._arenas = ArenaPool(self.max_batch_size, max_free=self.concurrency)
+        if max_wait_ms is not None:
+            self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+    @property
+    def queued(self) -> int:
+        """Number of interactive images waiting to be placed in a batch."""
+        return self._queued
+
+    @property
+    def background_queued(self) -> int:
+        """Number of background images waiting to be placed in a batch."""
+        return self._background_queued
+
+    def _ensure_started(self) -> None:
+        """Start the batching task on the running event loop if needed."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.PriorityQueue()
+            self._queued = 0
+            self._background_queued = 0
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._worker = loop.create_task(self._run())
+
+    async def predict(self, images: np.ndarray, background: bool = False) -> np.ndarray:
+        """
+        Queue images of shape (N, 224, 224, 3) for inference and wait for
+        their predictions, returned with shape (N, 2). Background images wait
+        until no interactive request is queued.
+        """
+        if images.ndim == 3:
+            images = images[np.newaxis]
+        if len(images) == 0:
+            return np.empty((0, 2), dtype=np.float32)
+
+        self._ensure_started()
+        if background:
+            # Queued in batch-sized chunks, so that an interactive request
+            # waits for at most one batch of background images
+            futures = []
+            for start in range(0, len(images), self.max_batch_size):
+                chunk = images[start:start + self.max_batch_size]
+                future = self._loop.create_future()
+                self._queue.put_nowait((PRIORITY_BACKGROUND, next(self._sequence), chunk, future))
+                self._background_queued += len(chunk)
+                futures.append(future)
+            results = await asyncio.gather(*(self._wait(future) for future in futures))
+            return results[0] if len(results) == 1 else np.concatenate(results, axis=0)
+
+        future = self._loop.create_future()
+
+        # A request larger than the queue on its own is still admitted when idle
+        if self._queued and self._queued + len(images) > self.max_queue:
+            raise ExecutorBusyError("inference")
+
+        self._queue.put_nowait((PRIORITY_INTERACTIVE, next(self._sequence), images, future))
+        self._queued += len(images)
+        return await self._wait(future)
+
+    async def _wait(self, future: asyncio.Future) -> np.ndarray:
+        profile = profiling.current()
+        if profile is None:
+            return await future
+        self._profiles[future] = profile
+        try:
+            return await future
+        finally:
+            del self._profiles[future]
+
+    async def _next_item(self, timeout: float) -> Optional[QueueItem]:
+        """Get the next queued request, waiting at most `timeout` seconds."""
+        if timeout <= 0:
+            try:
+                return self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return None
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _run(self) -> None:
+        """Form batches from the queue whenever an inference slot is free."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            first = await self._queue.get()
+
+            batch = [first]
+            size = len(first[2])
+            deadline = loop.time() + self.max_wait
+
+            while size < self.max_batch_size:
+                item = await self._next_item(deadline - loop.time())
+                if item is None:
+                    break
+                if size + len(item[2]) > self.max_batch_size:
+                    # Does not fit: back in the queue (at the front of its
+                    # priority, since its sequence number is unchanged), where
+                    # it opens the next batch
+                    self._queue.put_nowait(item)
+                    break
+                batch.append(item)
+                size += len(item[2])
+
+            for priority, _, images, _ in batch:
+                if priority == PRIORITY_BACKGROUND:
+                    self._background_queued -= len(images)
+                else:
+                    self._queued -= len(images)
+            task = loop.create_task(self._execute([(images, future) for _, _, images, future in batch]))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, batch: List[Tuple[np.ndarray, asyncio.Future]]) -> None:
+        """Run one predict over the whole batch and resolve each caller."""
+        try:
+            await self._predict_batch(batch)
+        finally:
+            self._slots.release()
+
+    async def _predict_batch(self, batch: List[Tuple[np.ndarray, asyncio.Future]]) -> None:
+        pending = [(images, future) for images, future in batch if not future.done()]
+        if not pending:
+            return
+
+        if len(pending) == 1:
+            # A lone request is predicted straight from the caller's buffer
+            predictions = await self._run_model(pending, pending[0][0])
+        else:
+            total = sum(len(images) for images, _ in pending)
+            with self._arenas.lease() as arena:
+                inputs = np.concatenate([images for images, _ in pending], axis=0, out=arena.batch[:total])
+                predictions = await self._run_model(pending, inputs)
+        if predictions is None:
+            return
+
+        offset = 0
+        for images, future in pending:
+            count = len(images)
+            if not future.done():
+                future.set_result(predictions[offset:offset + count])
+            offset += count
+
+    async def _run_model(self, pending, inputs: np.ndarray) -> Optional[np.ndarray]:
+        """Call model.predict on the inference pool; on failure, fail every caller."""
+        try:
+            loop = asyncio.get_running_loop()
+            call = metrics.timed_call
+            if self._profiles:
+                call = profiling.bind(call, [self._profiles[f] for _, f in pending if f in self._profiles])
+            predictions, seconds = await loop.run_in_executor(self.executor, call, self.model.predict, inputs)
+            metrics.MODEL_PREDICT_SECONDS.observe(seconds)
+            metrics.BATCH_SIZE.observe(len(inputs))
+            predictions = np.asarray(predictions)
+            if predictions.shape[0] != len(inputs):
+                raise ValueError(
+                    f"Model returned {predictions.shape[0]} predictions for a batch of {len(inputs)} images"
+                )
+            return predictions
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return None
@@ -0,0 +1,425 @@
+"""
+Load and latency benchmark for the verification endpoints.
+
+    python -m app.benchmark                                   # default matrix, in-process
+    python -m app.benchmark --concurrency 1 8 --requests 50 --output before.json
+    python -m app.benchmark --transport socket --compare before.json --output after.json
+
+Requests go to the app in this process, either straight through ASGI
+(--transport asgi, the default: no network stack) or over HTTP to a uvicorn
+server started on a free local port (--transport socket). Both need httpx.
+
+Every endpoint is driven with synthetic signature images (ink strokes on a
+white page) of each requested variant, <format>-<size>:
+- formats: png, jpeg
+- sizes: small (400x200), medium (1600x800), large (4032x3024, a phone photo)
+
+For each endpoint, image variant and concurrency level, `concurrency` clients
+send --requests requests back to back (after --warmup unmeasured ones) and the
+run reports throughput, p50/p95/p99 latency, status codes and the process RSS.
+The client shares the process (and, for asgi, the event loop) with the server,
+so absolute numbers are a lower bound; compare runs made the same way.
+
+Results are written as JSON. With --compare, the run is checked against an
+earlier result file: a row whose p95 latency grew, or whose throughput fell,
+by more than --tolerance is reported as a regression and the exit status is 1.
+
+Records and uploads go to a temporary directory (or --data-dir). The
+prediction cache, and reuse of predictions for duplicate uploads, are off
+unless --result-cache is given, so repeated images still reach the model
+(duplicates are still looked up, so the lookup cost is measured).
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+ENDPOINTS = (
+    "/verify-signature",
+    "/verify-signature-set",
+    "/verify-student-signatures",
+    "/verify-student-signatures/upload",
+    "/verify-single-signature",
+    "/verify-single-signature/upload",
+)
+IMAGE_SIZES = {
+    "small": (400, 200),
+    "medium": (1600, 800),
+    "large": (4032, 3024),
+}
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+DEFAULT_VARIANTS = ("png-small", "jpeg-medium", "jpeg-large")
+
+# A signature set is exactly 7 images
+SET_SIZE = 7
+
+
+class ImagePool(NamedTuple):
+    variant: str
+    extension: str
+    content_type: str
+    images: List[bytes]
+    encoded: List[str]  # base64 of each image, for the JSON endpoints
+
+
+def synthetic_signature(width: int, height: int, image_format: str, seed: int) -> bytes:
+    """A signature-like image: a few dark pen strokes across a white page."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    pen = max(2, min(width, height) // 80)
+    ink = (rng.randint(0, 40), rng.randint(0, 40), rng.randint(60, 120))
+    for _ in range(rng.randint(2, 4)):
+        x, y = rng.uniform(0.05, 0.3) * width, rng.uniform(0.3, 0.7) * height
+        points = [(x, y)]
+        for _ in range(rng.randint(15, 40)):
+            x = min(width * 0.95, x + rng.uniform(0, 0.04) * width)
+            y = min(height * 0.9, max(height * 0.1, y + rng.uniform(-0.15, 0.15) * height))
+            points.append((x, y))
+        draw.line(points, fill=ink, width=pen, joint="curve")
+
+    out = io.BytesIO()
+    options = {"quality": 90} if image_format == "JPEG" else {}
+    img.save(out, image_format, **options)
+    return out.getvalue()
+
+
+def image_pool(variant: str, count: int, seed: int) -> ImagePool:
+    """`count` distinct synthetic images of a <format>-<size> variant."""
+    try:
+        format_name, size_name = variant.split("-", 1)
+        image_format, content_type = IMAGE_FORMATS[format_name]
+        width, height = IMAGE_SIZES[size_name]
+    except (ValueError, KeyError):
+        raise ValueError(
+            f"Unknown image variant {variant!r}; expected <{'|'.join(IMAGE_FORMATS)}>-<{'|'.join(IMAGE_SIZES)}>"
+        )
+    images = [synthetic_signature(width, height, image_format, seed + i) for i in range(count)]
+    encoded = [base64.b64encode(image).decode("ascii") for image in images]
+    return ImagePool(variant, format_name, content_type, images, encoded)
+
+
+def request_kwargs(endpoint: str, pool: ImagePool, index: int, student_signatures: int) -> Dict:
+    """httpx.post keyword arguments for request number `index` of a run."""
+    count = len(pool.images)
+    if endpoint == "/verify-signature":
+        image = pool.images[index % count]
+        return {"files": {"file": (f"signature.{pool.extension}", image, pool.content_type)}}
+    if endpoint == "/verify-signature-set":
+        return {"files": [
+            ("files", (f"signature_{i + 1}.{pool.extension}", pool.images[(index + i) % count], pool.content_type))
+            for i in range(SET_SIZE)
+        ]}
+    if endpoint == "/verify-student-signatures":
+        return {"json": {
+            "signatures": [pool.encoded[(index + i) % count] for i in range(student_signatures)],
+            "user_id": "benchmark",
+            "signature_type": "student",
+        }}
+    if endpoint == "/verify-student-signatures/upload":
+        return {
+            "files": [
+                ("signatures", (f"signature_{i + 1}.{pool.extension}", pool.images[(index + i) % count], pool.content_type))
+                for i in range(student_signatures)
+            ],
+            "data": {"user_id": "benchmark", "signature_type": "student"},
+        }
+    if endpoint == "/verify-single-signature":
+        return {"json": {"signature": pool.encoded[index % count], "threshold": 0.9}}
+    if endpoint == "/verify-single-signature/upload":
+        return {
+            "files": {"signature": (f"signature.{pool.extension}", pool.images[index % count], pool.content_type)},
+            "data": {"threshold": "0.9"},
+        }
+    raise ValueError(f"Unknown endpoint {endpoint!r}")
+
+
+def rss_bytes() -> Dict[str, int]:
+    """Current and peak resident memory of this process."""
+    from app.prefork import memory_usage
+
+    rss = memory_usage(os.getpid()).get("rss", 0)
+    # ru_maxrss is in kilobytes on Linux, and may lag the current figure slightly
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {"rss": rss, "peak_rss": max(rss, peak)}
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """Latency percentiles in milliseconds."""
+    if not latencies:
+        return {}
+    ms = np.asarray(latencies) * 1000
+    return {
+        "mean": round(float(ms.mean()), 3),
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "max": round(float(ms.max()), 3),
+    }
+
+
+async def run_level(client, endpoint: str, pool: ImagePool, concurrency: int, requests: int, warmup: int, student_signatures: int) -> Dict:
+    """Send `requests` requests from `concurrency` concurrent clients and summarize them."""
+    for i in range(warmup):
+        await client.post(endpoint, **request_kwargs(endpoint, pool, i, student_signatures))
+
+    counter = itertools.count()
+    latencies: List[float] = []
+    status_codes: Dict[str, int] = {}
+
+    async def worker():
+        while True:
+            index = next(counter)
+            if index >= requests:
+                return
+            kwargs = request_kwargs(endpoint, pool, warmup + index, student_signatures)
+            started = time.perf_counter()
+            response = await client.post(endpoint, **kwargs)
+            elapsed = time.perf_counter() - started
+            key = str(response.status_code)
+            status_codes[key] = status_codes.get(key, 0) + 1
+            if response.status_code == 200:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    memory = rss_bytes()
+    return {
+        "endpoint": endpoint,
+        "image": pool.variant,
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": len(latencies),
+        "errors": requests - len(latencies),
+        "status_codes": status_codes,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": summarize(latencies),
+        "rss_mb": round(memory["rss"] / 2**20, 1),
+        "peak_rss_mb": round(memory["peak_rss"] / 2**20, 1),
+    }
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_socket_server(app):
+    """Serve the app with uvicorn on a background thread; returns (server, base_url)."""
+    import uvicorn
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="benchmark-server", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The benchmark server failed to start")
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+async def run_benchmark(args, pools: List[ImagePool]) -> Dict:
+    import httpx
+    from app import config
+    from app.main import app, inference_scheduler, model_loader
+
+    server = thread = None
+    if args.transport == "socket":
+        server, thread, base_url = start_socket_server(app)
+        client = httpx.AsyncClient(base_url=base_url, timeout=args.timeout)
+    else:
+        await app.router.startup()
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        client = httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=args.timeout)
+
+    try:
+        if not await asyncio.get_running_loop().run_in_executor(None, model_loader.wait, args.timeout):
+            raise RuntimeError(f"The model was not ready after {args.timeout}s: {model_loader.status()}")
+        model = model_loader.status()
+        print(f"Model: {model['backend']} ({model['model_version']}), transport: {args.transport}")
+
+        results = []
+        # The endpoints log every request; keep that out of the report unless asked for
+        report_out = sys.stdout
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(report_out if args.show_app_output else devnull):
+                for endpoint, pool, concurrency in itertools.product(args.endpoints, pools, args.concurrency):
+                    row = await run_level(
+                        client, endpoint, pool, concurrency, args.requests, args.warmup, args.student_signatures
+                    )
+                    results.append(row)
+                    latency = row["latency_ms"]
+                    print(
+                        f"{endpoint:<34} {pool.variant:<12} c={concurrency:<4} "
+                        f"{row['throughput_rps']:>9.1f} req/s  p50 {latency.get('p50', 0):>8.1f} ms  "
+                        f"p95 {latency.get('p95', 0):>8.1f} ms  p99 {latency.get('p99', 0):>8.1f} ms  "
+                        f"errors {row['errors']:<4} rss {row['rss_mb']:.0f} MB",
+                        file=report_out
+                    )
+    finally:
+        await client.aclose()
+        if server is not None:
+            server.should_exit = True
+            thread.join()
+        else:
+            await app.router.shutdown()
+
+    return {
+        "created_at": datetime.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "git_commit": git_commit(),
+        },
+        "model": {key: model[key] for key in ("backend", "model_version", "is_mock")},
+        "settings": {
+            "transport": args.transport,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "student_signatures": args.student_signatures,
+            "pool_size": args.pool_size,
+            "result_cache": args.result_cache,
+            "db_engine": config.DB_ENGINE,
+            "write_behind": config.WRITE_BEHIND,
+            # As served: AUTOTUNE may have replaced BATCH_MAX_SIZE and BATCH_MAX_WAIT_MS
+            "autotune": config.AUTOTUNE,
+            "batch_max_size": inference_scheduler.max_batch_size,
+            "batch_max_wait_ms": round(inference_scheduler.max_wait * 1000, 3),
+            "inference_workers": config.INFERENCE_WORKERS,
+            "decode_workers": config.DECODE_WORKERS,
+            "decode_use_processes": config.DECODE_USE_PROCESSES,
+            "mock_fixed_ms": config.MOCK_FIXED_MS,
+            "mock_per_image_ms": config.MOCK_PER_IMAGE_MS,
+            "mock_release_gil": config.MOCK_RELEASE_GIL,
+        },
+        "results": results,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float) -> List[str]:
+    """Rows that got slower or handle less load than the baseline, as messages."""
+    previous = {(row["endpoint"], row["image"], row["concurrency"]): row for row in baseline["results"]}
+    regressions = []
+    for row in current["results"]:
+        key = (row["endpoint"], row["image"], row["concurrency"])
+        before = previous.get(key)
+        if before is None or not before["latency_ms"] or not row["latency_ms"]:
+            continue
+        label = f"{row['endpoint']} {row['image']} c={row['concurrency']}"
+        p95_before, p95_now = before["latency_ms"]["p95"], row["latency_ms"]["p95"]
+        if p95_now > p95_before * (1 + tolerance):
+            regressions.append(f"{label}: p95 {p95_before:.1f} -> {p95_now:.1f} ms")
+        rps_before, rps_now = before["throughput_rps"], row["throughput_rps"]
+        if rps_now < rps_before * (1 - tolerance):
+            regressions.append(f"{label}: throughput {rps_before:.1f} -> {rps_now:.1f} req/s")
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--images", nargs="+", default=list(DEFAULT_VARIANTS), help="Image variants, <format>-<size>")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="Measured requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests before each level")
+    parser.add_argument("--student-signatures", type=int, default=SET_SIZE, help="Signatures per student portal request")
+    parser.add_argument("--pool-size", type=int, default=32, help="Distinct images per variant")
+    parser.add_argument("--transport", choices=("asgi", "socket"), default="asgi")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for the model or a response")
+    parser.add_argument("--result-cache", action="store_true", help="Leave the prediction cache and duplicate reuse on")
+    parser.add_argument("--show-app-output", action="store_true", help="Keep the API's own log lines")
+    parser.add_argument("--data-dir", help="Where records and uploads go (default: a temporary directory)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json")
+    parser.add_argument("--compare", help="Earlier result file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed p95/throughput change for --compare")
+    args = parser.parse_args(argv)
+
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        print("The benchmark needs httpx: pip install httpx")
+        return 1
+
+    pools = []
+    for variant in args.images:
+        pool = image_pool(variant, args.pool_size, args.seed)
+        pools.append(pool)
+        print(f"{variant}: {args.pool_size} images, {np.mean([len(image) for image in pool.images]) / 1024:.0f} KB on average")
+
+    # The app reads its settings at import, so these must be set before it is loaded
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="signature-benchmark-")
+    os.environ["UPLOAD_DIR"] = os.path.join(data_dir, "uploads")
+    os.environ["DB_DIR"] = os.path.join(data_dir, "database")
+    os.environ["JOBS_DIR"] = os.path.join(data_dir, "jobs")
+    os.environ["EMBEDDINGS_DIR"] = os.path.join(data_dir, "embeddings")
+    if not args.result_cache:
+        os.environ["RESULT_CACHE_SIZE"] = "0"
+        os.environ["PHASH_REUSE_PREDICTIONS"] = "False"
+    try:
+        report = asyncio.run(run_benchmark(args, pools))
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for setting in ("transport", "requests", "result_cache"):
+            if baseline["settings"].get(setting) != report["settings"][setting]:
+                print(f"WARNING: {args.compare} was run with a different {setting} ({baseline['settings'].get(setting)!r})")
+        regressions = compare(baseline, report, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -31,12 +31,175 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 
 # Paths
 BASE_DIR = Path(__file__).parent.parent
-UPLOAD_DIR = BASE_DIR / "uploads"
-DB_DIR = BASE_DIR / "database"
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", str(BASE_DIR / "uploads")))
+DB_DIR = Path(os.getenv("DB_DIR", str(BASE_DIR / "database")))
 
 # Model Settings
 MODEL_PATH = os.getenv("MODEL_PATH", str(BASE_DIR / "cnn_sign_model.h5"))
 CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.75"))
+# Identifies the weights in cache keys; derived from the model file when empty
+MODEL_VERSION = os.getenv("MODEL_VERSION", "")
+
+# Inference engine: "keras" (the .h5 under TensorFlow), "tflite", "onnx" or
+# "mock" (the development mock model, also used when the engine cannot load).
+# The .tflite/.onnx files are created with `python -m app.convert_model`
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras").lower()
+# Quantized TFLite variant to serve: "" (float32), "int8" or "float16". Variants
+# are published by `python -m app.quantize` only if they pass the accuracy gate
+TFLITE_VARIANT = os.getenv("TFLITE_VARIANT", "").lower()
+TFLITE_MODEL_PATH = os.getenv(
+    "TFLITE_MODEL_PATH",
+    str(BASE_DIR / (f"cnn_sign_model.{TFLITE_VARIANT}.tflite" if TFLITE_VARIANT else "cnn_sign_model.tflite"))
+)
+# Max share of images whose authentic/forged decision may flip after quantization
+QUANTIZATION_MAX_DISAGREEMENT = float(os.getenv("QUANTIZATION_MAX_DISAGREEMENT", "0.01"))
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", str(BASE_DIR / "cnn_sign_model.onnx"))
+# CPU threads per inference call (0 lets the runtime decide)
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))
+# Simulated cost of a mock model predict: a fixed part per call plus a part per
+# image, spent sleeping (releasing the GIL) or spinning in Python (holding it)
+MOCK_FIXED_MS = float(os.getenv("MOCK_FIXED_MS", "0"))
+MOCK_PER_IMAGE_MS = float(os.getenv("MOCK_PER_IMAGE_MS", "0"))
+MOCK_RELEASE_GIL = os.getenv("MOCK_RELEASE_GIL", "True").lower() in ('true', '1', 't')
+
+# Model startup: "background" accepts connections immediately and loads the
+# model on a thread (/ready reports when it can serve); "eager" loads it at import
+MODEL_LOAD_MODE = os.getenv("MODEL_LOAD_MODE", "background").lower()
+# The traced inference graph is saved here so restarts skip tracing ("" disables)
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", str(BASE_DIR / "model_cache"))
+
+# Prediction cache (set RESULT_CACHE_SIZE=0 to disable)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+
+# Inference batching (images from concurrent requests are predicted together)
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+# Batch sizes run through the model once at startup, before reporting ready
+WARMUP_BATCH_SIZES = [int(size) for size in os.getenv("WARMUP_BATCH_SIZES", f"1,7,{BATCH_MAX_SIZE}").split(',') if size.strip()]
+
+# Auto-tuning (see app/autotune.py): "startup" benchmarks the model over a grid
+# of thread counts and batch sizes the first time it runs on a machine (the
+# result is cached per CPU model and core count in AUTOTUNE_CACHE_PATH) and
+# serves with the fastest setting whose predict p99 plus batching window stays
+# under AUTOTUNE_P99_MS; it then overrides INFERENCE_THREADS, BATCH_MAX_SIZE and
+# BATCH_MAX_WAIT_MS. "off" serves with the configured values
+AUTOTUNE = os.getenv("AUTOTUNE", "off").lower()
+AUTOTUNE_P99_MS = float(os.getenv("AUTOTUNE_P99_MS", "250"))
+AUTOTUNE_BATCH_SIZES = [int(size) for size in os.getenv("AUTOTUNE_BATCH_SIZES", "1,2,4,8,16,32").split(',') if size.strip()]
+# Intra-op thread counts to try (empty: powers of two up to the available cores)
+AUTOTUNE_THREADS = [int(count) for count in os.getenv("AUTOTUNE_THREADS", "").split(',') if count.strip()]
+AUTOTUNE_MEASURE_SECONDS = float(os.getenv("AUTOTUNE_MEASURE_SECONDS", "1"))
+AUTOTUNE_CACHE_PATH = Path(os.getenv("AUTOTUNE_CACHE_PATH", str(BASE_DIR / "model_cache" / "autotune.json")))
+
+# Upload limits, enforced from the image header before decoding
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "40000000"))
+# Decode large JPEGs at reduced resolution (they are shrunk to 224x224 anyway)
+DECODE_DOWNSCALE = os.getenv("DECODE_DOWNSCALE", "True").lower() in ('true', '1', 't')
+
+# Blank-image pre-check: images that clearly hold no signature (e.g. an empty
+# signature pad canvas) get a "no signature" verdict without running the model.
+# Measured at decoded resolution on a grid of up to 224 cells per side, each
+# keeping its darkest and lightest pixel, as 0-1 fractions: an image is blank
+# when its darkest and lightest levels differ by less than PRECHECK_MIN_CONTRAST,
+# or fewer than PRECHECK_MIN_INK of the cells differ from the background by that
+# much, or the box around those cells covers less than PRECHECK_MIN_BBOX of it.
+# The defaults only catch images with nothing but a speck or two on them
+PRECHECK = os.getenv("PRECHECK", "True").lower() in ('true', '1', 't')
+PRECHECK_MIN_CONTRAST = float(os.getenv("PRECHECK_MIN_CONTRAST", "0.1"))
+PRECHECK_MIN_INK = float(os.getenv("PRECHECK_MIN_INK", "0.0005"))
+PRECHECK_MIN_BBOX = float(os.getenv("PRECHECK_MIN_BBOX", "0.0005"))
+
+# Save uploaded signature sets under UPLOAD_DIR; turn off for verification-only
+# traffic (results are still recorded in the database)
+PERSIST_UPLOADS = os.getenv("PERSIST_UPLOADS", "True").lower() in ('true', '1', 't')
+
+# Worker pools for blocking work (inference, image decoding, disk I/O)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+DECODE_USE_PROCESSES = os.getenv("DECODE_USE_PROCESSES", "False").lower() in ('true', '1', 't')
+IO_WORKERS = int(os.getenv("IO_WORKERS", "2"))
+# Pending jobs (or queued images, for inference) accepted before answering 503
+EXECUTOR_QUEUE_DEPTH = int(os.getenv("EXECUTOR_QUEUE_DEPTH", "64"))
+EXECUTOR_RETRY_AFTER = int(os.getenv("EXECUTOR_RETRY_AFTER", "1"))
+
+# Database storage engine: "json" (rewrite the whole file per change),
+# "log" (append-only JSONL with group commit and background compaction) or
+# "sqlite" (indexed table; listing endpoints page through it in bounded time)
+DB_ENGINE = os.getenv("DB_ENGINE", "json").lower()
+DB_GROUP_COMMIT_MS = float(os.getenv("DB_GROUP_COMMIT_MS", "2"))
+DB_COMPACT_MIN_RECORDS = int(os.getenv("DB_COMPACT_MIN_RECORDS", "1000"))
+DB_COMPACT_RATIO = float(os.getenv("DB_COMPACT_RATIO", "2.0"))
+
+# Write-behind persistence: records and uploads are queued and written in
+# background batches (WRITE_BEHIND=True). Off by default: queued writes are
+# lost if the process dies before they are flushed
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "False").lower() in ('true', '1', 't')
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "64"))
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "50"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "1000"))
+
+# Listing endpoint page sizes
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "100"))
+LIST_MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", "500"))
+
+# Bulk verification jobs: uploaded archives, progress and results are kept under
+# JOBS_DIR; each step reads and predicts about JOB_BATCH_SIZE images
+JOBS_DIR = Path(os.getenv("JOBS_DIR", str(BASE_DIR / "jobs")))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "64"))
+JOB_MAX_UPLOAD_BYTES = int(os.getenv("JOB_MAX_UPLOAD_BYTES", str(4 * 1024 ** 3)))
+
+# Replay / near-duplicate detection (see app/phash.py): images of stored sets
+# and verifications are indexed by perceptual hash (next to the database), and
+# an image within PHASH_MAX_DISTANCE of its 256 bits of an earlier one is
+# reported as a duplicate (`python -m app.phash DIR` measures distances on real
+# signatures). With PHASH_REUSE_PREDICTIONS, byte-identical replays are not
+# predicted again
+PHASH_INDEX = os.getenv("PHASH_INDEX", "True").lower() in ('true', '1', 't')
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "8"))
+PHASH_REUSE_PREDICTIONS = os.getenv("PHASH_REUSE_PREDICTIONS", "True").lower() in ('true', '1', 't')
+
+# Per-user reference embeddings (see app/embeddings.py): the CNN features of
+# enrolled reference signatures are kept under EMBEDDINGS_DIR as EMBEDDING_DTYPE
+# ("float16" or "float32"). Student portal verifications report each signature's
+# similarity to the user's references, and flag it when below
+# REFERENCE_MIN_SIMILARITY (0 only reports it)
+EMBEDDINGS_DIR = Path(os.getenv("EMBEDDINGS_DIR", str(BASE_DIR / "embeddings")))
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float16").lower()
+REFERENCE_MIN_SIMILARITY = float(os.getenv("REFERENCE_MIN_SIMILARITY", "0"))
+
+# Per-request profiling (see app/profiling.py): requests with the header
+# X-Profile-Token: <PROFILE_TOKEN> (empty disables it), and a PROFILE_SAMPLE_RATE
+# share of all requests, are sampled every PROFILE_INTERVAL_MS and saved under
+# PROFILE_DIR as "speedscope" or "collapsed" stack files (the newest PROFILE_KEEP)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+PROFILE_FORMAT = os.getenv("PROFILE_FORMAT", "speedscope").lower()
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(BASE_DIR / "profiles")))
+PROFILE_MAX_ACTIVE = int(os.getenv("PROFILE_MAX_ACTIVE", "4"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))
+
+# Retention: delete uploads and records older than a TTL (days) or beyond a
+# maximum count, oldest first. 0 disables a limit.
+RETENTION_UPLOADS_TTL_DAYS = float(os.getenv("RETENTION_UPLOADS_TTL_DAYS", "0"))
+RETENTION_UPLOADS_MAX_COUNT = int(os.getenv("RETENTION_UPLOADS_MAX_COUNT", "0"))
+RETENTION_SETS_TTL_DAYS = float(os.getenv("RETENTION_SETS_TTL_DAYS", "0"))
+RETENTION_SETS_MAX_COUNT = int(os.getenv("RETENTION_SETS_MAX_COUNT", "0"))
+RETENTION_VERIFICATIONS_TTL_DAYS = float(os.getenv("RETENTION_VERIFICATIONS_TTL_DAYS", "0"))
+RETENTION_VERIFICATIONS_MAX_COUNT = int(os.getenv("RETENTION_VERIFICATIONS_MAX_COUNT", "0"))
+# How often the sweeper runs, and how it shares the process with requests
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "300"))
+RETENTION_SLICE_MS = float(os.getenv("RETENTION_SLICE_MS", "10"))
+RETENTION_PAUSE_MS = float(os.getenv("RETENTION_PAUSE_MS", "50"))
+
+# Serving: "dev" runs one uvicorn process (auto-reload when DEBUG); "prefork"
+# loads the model once, then forks WEB_WORKERS processes that share its weights
+SERVE_MODE = os.getenv("SERVE_MODE", "dev").lower()
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "2"))
+# Pin each prefork worker to its own share of the CPUs
+PREFORK_PIN_CPUS = os.getenv("PREFORK_PIN_CPUS", "False").lower() in ('true', '1', 't')
 
 # Supabase Configuration (for temporary signature storage)
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
@@ -44,5 +207,7 @@ SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY", "")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
 
 # Create directories if they don't exist
-UPLOAD_DIR.mkdir(exist_ok=True)
-DB_DIR.mkdir(exist_ok=True) 
\ No newline at end of file
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+DB_DIR.mkdir(parents=True, exist_ok=True)
+JOBS_DIR.mkdir(parents=True, exist_ok=True)
+EMBEDDINGS_DIR.mkdir(parents=True, exist_ok=True) 
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+Convert the Keras model to TFLite and ONNX and check that they agree with it.
+
+    python -m app.convert_model                      # both formats, then parity check
+    python -m app.convert_model --formats tflite
+    python -m app.convert_model --check-only --images uploads/some-set
+
+Conversion needs full TensorFlow (and tf2onnx for ONNX); the serving container
+then only needs the runtime of the chosen INFERENCE_BACKEND. The parity check
+runs the same batch through every engine and fails (exit code 1) if any
+prediction differs from the Keras model by more than --atol.
+"""
+
+import argparse
+import os
+import sys
+from typing import Dict, List
+
+import numpy as np
+
+from app.config import MODEL_PATH, ONNX_MODEL_PATH, TFLITE_MODEL_PATH
+from app.preprocessing import INPUT_SHAPE, preprocess_image
+
+FORMATS = ("tflite", "onnx")
+
+# Float32 conversions normally agree to ~1e-5; confidences are compared to 0.75
+DEFAULT_ATOL = 1e-4
+
+
+def convert_to_tflite(keras_model, output_path: str = TFLITE_MODEL_PATH) -> str:
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+    return output_path
+
+
+def convert_to_onnx(keras_model, output_path: str = ONNX_MODEL_PATH, opset: int = 13) -> str:
+    import tensorflow as tf
+    import tf2onnx
+
+    # Keep the batch dimension dynamic so one session serves any batch size
+    signature = (tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32, name="images"),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=signature, opset=opset, output_path=output_path)
+    return output_path
+
+
+def list_images(image_dir: str) -> List[str]:
+    """Paths of every file under image_dir, in a stable order."""
+    return sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(image_dir)
+        for name in files
+    )
+
+
+def load_batch(paths: List[str]) -> np.ndarray:
+    """Preprocess image files into one (N, 224, 224, 3) batch, skipping unreadable ones."""
+    images = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                images.append(preprocess_image(f.read())[0])
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+    return np.stack(images) if images else np.empty((0,) + INPUT_SHAPE, dtype=np.float32)
+
+
+def sample_batch(image_dir: str = None, count: int = 8, seed: int = 0) -> np.ndarray:
+    """Preprocessed images from image_dir, or seeded random inputs if none is given."""
+    if image_dir:
+        images = load_batch(list_images(image_dir)[:count])
+        if len(images):
+            return images
+        print(f"No images found in {image_dir}; using random inputs")
+    rng = np.random.default_rng(seed)
+    return rng.random((count,) + INPUT_SHAPE, dtype=np.float32)
+
+
+def check_parity(reference, engines: Dict[str, object], images: np.ndarray, atol: float = DEFAULT_ATOL) -> Dict[str, float]:
+    """
+    Max absolute difference between each engine's predictions and the
+    reference engine's on the same batch. Printed per engine.
+    """
+    expected = np.asarray(reference.predict(images))
+    differences = {}
+    for name, engine in engines.items():
+        actual = np.asarray(engine.predict(images))
+        if actual.shape != expected.shape:
+            raise ValueError(f"{name} returned shape {actual.shape}, expected {expected.shape}")
+        differences[name] = float(np.max(np.abs(actual - expected)))
+        status = "OK" if differences[name] <= atol else "MISMATCH"
+        print(f"{name}: max abs difference {differences[name]:.2e} (atol {atol:.0e}) {status}")
+    return differences
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=MODEL_PATH, help="Keras .h5 model to convert")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--tflite-path", default=TFLITE_MODEL_PATH)
+    parser.add_argument("--onnx-path", default=ONNX_MODEL_PATH)
+    parser.add_argument("--opset", type=int, default=13, help="ONNX opset version")
+    parser.add_argument("--check-only", action="store_true", help="Skip conversion, only run the parity check")
+    parser.add_argument("--images", help="Directory of sample images for the parity check")
+    parser.add_argument("--count", type=int, default=8, help="Number of images in the parity batch")
+    parser.add_argument("--atol", type=float, default=DEFAULT_ATOL)
+    args = parser.parse_args(argv)
+
+    from app.engines import KerasEngine, OnnxEngine, TFLiteEngine
+
+    # No traced-graph cache: conversion needs the Keras model itself
+    reference = KerasEngine(args.model, cache_dir="")
+
+    if not args.check_only:
+        if "tflite" in args.formats:
+            print(f"Wrote {convert_to_tflite(reference.keras_model, args.tflite_path)}")
+        if "onnx" in args.formats:
+            print(f"Wrote {convert_to_onnx(reference.keras_model, args.onnx_path, args.opset)}")
+
+    engines = {}
+    if "tflite" in args.formats:
+        engines["tflite"] = TFLiteEngine(args.tflite_path)
+    if "onnx" in args.formats:
+        engines["onnx"] = OnnxEngine(args.onnx_path)
+
+    images = sample_batch(args.images, args.count)
+    differences = check_parity(reference, engines, images, args.atol)
+    return 0 if all(diff <= args.atol for diff in differences.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
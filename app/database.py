@@ -1,19 +1,126 @@
+import base64
 import json
 import os
-from typing import Dict, List, Optional, Any
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime
 from pathlib import Path
 
-from app.config import DB_DIR
+from app.config import DB_DIR, DB_ENGINE, DB_GROUP_COMMIT_MS, DB_COMPACT_MIN_RECORDS, DB_COMPACT_RATIO
 
-class JsonDatabase:
+# Record kinds stored in a collection
+KIND_SIGNATURE_SET = "signature_set"
+KIND_VERIFICATION = "verification"
+
+def record_kind(item_id: str, item_data: Dict[str, Any]) -> str:
+    """Classify a stored record as a signature set or a portal verification."""
+    if item_id.startswith("verification_") or "date_verified" in item_data:
+        return KIND_VERIFICATION
+    return KIND_SIGNATURE_SET
+
+def record_date(item_data: Dict[str, Any]) -> str:
+    """ISO timestamp a record is ordered by (upload or verification time)."""
+    return item_data.get("date_uploaded") or item_data.get("date_verified") or ""
+
+def record_matches(
+    item_id: str,
+    item_data: Dict[str, Any],
+    kind: Optional[str] = None,
+    user_id: Optional[str] = None,
+    signature_type: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    after: Optional[Tuple[str, str]] = None,
+    oldest_first: bool = False,
+) -> bool:
+    """Whether a record passes query() filters and lies past the decoded cursor `after`."""
+    date = record_date(item_data)
+    if kind is not None and record_kind(item_id, item_data) != kind:
+        return False
+    if user_id is not None and item_data.get("user_id") != user_id:
+        return False
+    if signature_type is not None and item_data.get("signature_type") != signature_type:
+        return False
+    if date_from is not None and date < date_from:
+        return False
+    if date_to is not None and date >= date_to:
+        return False
+    if after is not None:
+        position = (date, item_id)
+        if (position <= after) if oldest_first else (position >= after):
+            return False
+    return True
+
+def encode_cursor(date: str, item_id: str) -> str:
+    """Opaque pagination cursor pointing just past (date, item_id)."""
+    return base64.urlsafe_b64encode(json.dumps([date, item_id]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        date, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(date), str(item_id)
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+class ScanQueryMixin:
+    """
+    query() for the file-based engines, which keep every record in memory.
+    This scans the whole collection; use the sqlite engine for large tables.
+    """
+    
+    def query(
+        self,
+        kind: Optional[str] = None,
+        user_id: Optional[str] = None,
+        signature_type: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        oldest_first: bool = False,
+    ) -> Tuple[List[Tuple[str, Dict[str, Any]]], Optional[str]]:
+        """
+        Newest-first (or oldest-first) page of (item_id, item_data) matching
+        the filters, plus a cursor for the next page (None on the last page).
+        date_from is inclusive, date_to exclusive.
+        """
+        after = decode_cursor(cursor) if cursor else None
+        matches = []
+        for item_id, item_data in self.get_all().items():
+            if record_matches(
+                item_id, item_data, kind, user_id, signature_type, date_from, date_to, after, oldest_first
+            ):
+                matches.append((record_date(item_data), item_id, item_data))
+        
+        matches.sort(key=lambda match: (match[0], match[1]), reverse=not oldest_first)
+        page = matches[:limit]
+        next_cursor = None
+        if len(matches) > limit:
+            next_cursor = encode_cursor(page[-1][0], page[-1][1])
+        return [(item_id, item_data) for _, item_id, item_data in page], next_cursor
+    
+    def count(self, kind: Optional[str] = None) -> int:
+        """Number of records, optionally of one kind."""
+        items = self.get_all()
+        if kind is None:
+            return len(items)
+        return sum(1 for item_id, item_data in items.items() if record_kind(item_id, item_data) == kind)
+
+class JsonDatabase(ScanQueryMixin):
     """Simple JSON file-based database."""
     
+    # Every write rewrites the whole file, so bulk deletes should be one batch
+    full_rewrite = True
+    
     def __init__(self, collection_name: str):
         """Initialize the database with a collection name."""
         self.collection_name = collection_name
         self.db_file = DB_DIR / f"{collection_name}.json"
         self.data = self._load_data()
+        # Writes run on worker threads; serialize mutations and saves
+        self._lock = threading.RLock()
     
     def _load_data(self) -> Dict[str, Any]:
         """Load data from the JSON file."""
@@ -33,7 +140,8 @@ class JsonDatabase:
     
     def get_all(self) -> Dict[str, Any]:
         """Get all items in the collection."""
-        return self.data
+        with self._lock:
+            return dict(self.data)
     
     def get(self, item_id: str) -> Optional[Dict[str, Any]]:
         """Get an item by ID."""
@@ -41,27 +149,525 @@ class JsonDatabase:
     
     def create(self, item_id: str, item_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new item."""
-        self.data[item_id] = item_data
-        self._save_data()
+        with self._lock:
+            self.data[item_id] = item_data
+            self._save_data()
         return item_data
     
+    def create_many(self, items: Dict[str, Dict[str, Any]]) -> None:
+        """Create or replace several items with a single save."""
+        with self._lock:
+            self.data.update(items)
+            self._save_data()
+    
     def update(self, item_id: str, item_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Update an existing item."""
-        if item_id not in self.data:
-            return None
-        
-        self.data[item_id] = item_data
-        self._save_data()
+        with self._lock:
+            if item_id not in self.data:
+                return None
+            
+            self.data[item_id] = item_data
+            self._save_data()
         return item_data
     
     def delete(self, item_id: str) -> bool:
         """Delete an item."""
-        if item_id not in self.data:
-            return False
+        with self._lock:
+            if item_id not in self.data:
+                return False
+            
+            del self.data[item_id]
+            self._save_data()
+        return True
+    
+    def delete_many(self, item_ids: List[str]) -> int:
+        """Delete several items with a single save. Returns how many existed."""
+        with self._lock:
+            deleted = 0
+            for item_id in item_ids:
+                if self.data.pop(item_id, None) is not None:
+                    deleted += 1
+            if deleted:
+                self._save_data()
+        return deleted
+    
+    def close(self) -> None:
+        """Nothing to flush; every write is saved immediately."""
+
+class LogDatabase(ScanQueryMixin):
+    """
+    Append-only JSONL log database with the same interface as JsonDatabase.
+    
+    Every mutation appends one record ({"op": "put"|"del", ...}) to
+    <collection>.jsonl, so write cost does not depend on how many records are
+    stored. A background writer thread group-commits pending records with a
+    single write + fsync, and writers return once their record is durable.
+    
+    State is rebuilt by replaying the log at startup (a torn final line from a
+    crash is discarded). When the log holds DB_COMPACT_RATIO times more records
+    than are live, it is compacted in the background: a snapshot is written to
+    a temporary file, records appended meanwhile are copied after it, and the
+    result atomically replaces the log with os.replace.
+    """
+    
+    def __init__(self, collection_name: str):
+        """Initialize the database with a collection name."""
+        self.collection_name = collection_name
+        self.db_file = DB_DIR / f"{collection_name}.jsonl"
+        self.legacy_file = DB_DIR / f"{collection_name}.json"
+        
+        # _lock guards in-memory state and the pending queue; _io_lock the log file
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._io_lock = threading.Lock()
+        
+        self._pending: List[bytes] = []
+        self._next_seq = 0
+        self._durable_seq = 0
+        self._closing = False
+        self._compacting = False
+        self._write_error: Optional[BaseException] = None
+        
+        self.data, self._log_records = self._replay()
+        self._fh = open(self.db_file, "ab")
+        self._log_bytes = self._fh.tell()
+        
+        self._writer = threading.Thread(
+            target=self._writer_loop, name=f"{collection_name}-log-writer", daemon=True
+        )
+        self._writer.start()
+    
+    @staticmethod
+    def _encode(record: Dict[str, Any]) -> bytes:
+        return (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+    
+    def _replay(self):
+        """Rebuild the collection from the log (or migrate the legacy JSON file)."""
+        if not self.db_file.exists():
+            data = {}
+            if self.legacy_file.exists():
+                try:
+                    with open(self.legacy_file, 'r') as f:
+                        data = json.load(f)
+                except json.JSONDecodeError:
+                    data = {}
+            self._write_snapshot(self.db_file, data)
+            return data, len(data)
+        
+        data: Dict[str, Any] = {}
+        records = 0
+        valid_bytes = 0
+        with open(self.db_file, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn write from a crash: everything after it is discarded
+                    break
+                if record.get("op") == "del":
+                    data.pop(record["id"], None)
+                else:
+                    data[record["id"]] = record["data"]
+                records += 1
+                valid_bytes += len(line)
         
-        del self.data[item_id]
-        self._save_data()
+        if valid_bytes < self.db_file.stat().st_size:
+            with open(self.db_file, "r+b") as f:
+                f.truncate(valid_bytes)
+        return data, records
+    
+    def _write_snapshot(self, path: Path, data: Dict[str, Any]) -> None:
+        """Write the whole collection as a log of puts, atomically."""
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "wb") as f:
+            for item_id, item_data in data.items():
+                f.write(self._encode({"op": "put", "id": item_id, "data": item_data}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    
+    def _append(self, record: Dict[str, Any]) -> int:
+        """Queue a record for the writer (caller holds _lock). Returns its sequence number."""
+        self._pending.append(self._encode(record))
+        self._next_seq += 1
+        self._cond.notify_all()
+        return self._next_seq
+    
+    def _wait_durable(self, seq: int) -> None:
+        """Block until the record with this sequence number has been fsynced."""
+        with self._cond:
+            while self._durable_seq < seq and self._write_error is None:
+                self._cond.wait()
+            if self._durable_seq < seq:
+                raise IOError(f"Failed to write {self.db_file}: {self._write_error}")
+    
+    def _writer_loop(self) -> None:
+        """Group commit: write and fsync everything queued since the last flush."""
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if not self._pending and self._closing:
+                    return
+            
+            if DB_GROUP_COMMIT_MS > 0:
+                # Give concurrent writers a moment to join this commit
+                time.sleep(DB_GROUP_COMMIT_MS / 1000.0)
+            
+            with self._cond:
+                batch, self._pending = self._pending, []
+                seq = self._next_seq
+            
+            payload = b"".join(batch)
+            try:
+                with self._io_lock:
+                    self._fh.write(payload)
+                    self._fh.flush()
+                    os.fsync(self._fh.fileno())
+                    self._log_bytes += len(payload)
+                    # Counted along with the bytes, under _io_lock, so that a
+                    # compaction sees both or neither
+                    with self._lock:
+                        self._log_records += len(batch)
+            except Exception as e:
+                print(f"ERROR writing {self.db_file}: {e}")
+                with self._cond:
+                    self._write_error = e
+                    self._cond.notify_all()
+                return
+            
+            with self._cond:
+                self._durable_seq = seq
+                self._cond.notify_all()
+                self._maybe_compact()
+    
+    def _maybe_compact(self) -> None:
+        """Start a background compaction if the log is mostly dead records (caller holds _lock)."""
+        if self._compacting or self._closing:
+            return
+        if self._log_records < DB_COMPACT_MIN_RECORDS:
+            return
+        if self._log_records <= DB_COMPACT_RATIO * max(len(self.data), 1):
+            return
+        self._compacting = True
+        threading.Thread(
+            target=self._compact, name=f"{self.collection_name}-log-compactor", daemon=True
+        ).start()
+    
+    def _compact(self) -> None:
+        """Rewrite the log as a snapshot plus whatever was appended while writing it."""
+        tmp_path = self.db_file.with_suffix(".jsonl.compact")
+        try:
+            # Take the offset before the snapshot: every record before the offset
+            # is already reflected in the snapshot, later ones are copied as a tail
+            with self._io_lock:
+                offset = self._log_bytes
+            with self._lock:
+                snapshot = dict(self.data)
+            
+            with open(tmp_path, "wb") as out:
+                for item_id, item_data in snapshot.items():
+                    out.write(self._encode({"op": "put", "id": item_id, "data": item_data}))
+                
+                with self._io_lock:
+                    tail_records = 0
+                    with open(self.db_file, "rb") as log:
+                        log.seek(offset)
+                        for line in log:
+                            out.write(line)
+                            tail_records += 1
+                    out.flush()
+                    os.fsync(out.fileno())
+                    
+                    self._fh.close()
+                    os.replace(tmp_path, self.db_file)
+                    self._fh = open(self.db_file, "ab")
+                    self._log_bytes = self._fh.tell()
+                    with self._lock:
+                        self._log_records = len(snapshot) + tail_records
+        except Exception as e:
+            print(f"ERROR compacting {self.db_file}: {e}")
+            if self._fh.closed:
+                self._fh = open(self.db_file, "ab")
+        finally:
+            with self._cond:
+                self._compacting = False
+                self._cond.notify_all()
+    
+    def get_all(self) -> Dict[str, Any]:
+        """Get all items in the collection."""
+        with self._lock:
+            return dict(self.data)
+    
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        """Get an item by ID."""
+        return self.data.get(item_id)
+    
+    def create(self, item_id: str, item_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Create a new item."""
+        with self._lock:
+            self.data[item_id] = item_data
+            seq = self._append({"op": "put", "id": item_id, "data": item_data})
+        self._wait_durable(seq)
+        return item_data
+    
+    def create_many(self, items: Dict[str, Dict[str, Any]]) -> None:
+        """Create or replace several items in one group commit."""
+        if not items:
+            return
+        with self._lock:
+            for item_id, item_data in items.items():
+                self.data[item_id] = item_data
+                seq = self._append({"op": "put", "id": item_id, "data": item_data})
+        self._wait_durable(seq)
+    
+    def update(self, item_id: str, item_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Update an existing item."""
+        with self._lock:
+            if item_id not in self.data:
+                return None
+            
+            self.data[item_id] = item_data
+            seq = self._append({"op": "put", "id": item_id, "data": item_data})
+        self._wait_durable(seq)
+        return item_data
+    
+    def delete(self, item_id: str) -> bool:
+        """Delete an item."""
+        with self._lock:
+            if item_id not in self.data:
+                return False
+            
+            del self.data[item_id]
+            seq = self._append({"op": "del", "id": item_id})
+        self._wait_durable(seq)
         return True
+    
+    def delete_many(self, item_ids: List[str]) -> int:
+        """Delete several items in one group commit. Returns how many existed."""
+        seq = 0
+        deleted = 0
+        with self._lock:
+            for item_id in item_ids:
+                if self.data.pop(item_id, None) is not None:
+                    seq = self._append({"op": "del", "id": item_id})
+                    deleted += 1
+        if deleted:
+            self._wait_durable(seq)
+        return deleted
+    
+    def close(self) -> None:
+        """Flush pending records and stop the writer thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._writer.join()
+        with self._cond:
+            while self._compacting:
+                self._cond.wait()
+        with self._io_lock:
+            self._fh.close()
+
+class SqliteDatabase:
+    """
+    SQLite-backed database with the same interface as JsonDatabase, plus an
+    indexed query() for listing. Records are stored as JSON alongside the
+    columns they are filtered and ordered by (kind, user_id, signature_type,
+    created_at), so a page costs an index range scan whatever the table size.
+    """
+    
+    def __init__(self, collection_name: str):
+        """Initialize the database with a collection name."""
+        self.collection_name = collection_name
+        self.db_file = DB_DIR / f"{collection_name}.sqlite3"
+        self.legacy_file = DB_DIR / f"{collection_name}.json"
+        
+        # One connection shared by the I/O workers and the event loop
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_file), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+    
+    def _create_schema(self) -> None:
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS records (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    user_id TEXT,
+                    signature_type TEXT,
+                    created_at TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_records_kind_date ON records (kind, created_at, id);
+                CREATE INDEX IF NOT EXISTS idx_records_user_date ON records (user_id, kind, created_at, id);
+                CREATE INDEX IF NOT EXISTS idx_records_type_date ON records (signature_type, kind, created_at, id);
+                CREATE INDEX IF NOT EXISTS idx_records_date ON records (created_at, id);
+            """)
+            empty = self._conn.execute("SELECT 1 FROM records LIMIT 1").fetchone() is None
+        
+        if empty and self.legacy_file.exists():
+            # First start on SQLite: import the existing JSON collection
+            try:
+                with open(self.legacy_file, 'r') as f:
+                    legacy = json.load(f)
+            except json.JSONDecodeError:
+                legacy = {}
+            with self._lock:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                    [self._row(item_id, item_data) for item_id, item_data in legacy.items()],
+                )
+                self._conn.execute("COMMIT")
+    
+    @staticmethod
+    def _row(item_id: str, item_data: Dict[str, Any]) -> tuple:
+        return (
+            item_id,
+            record_kind(item_id, item_data),
+            item_data.get("user_id"),
+            item_data.get("signature_type"),
+            record_date(item_data),
+            json.dumps(item_data),
+        )
+    
+    def get_all(self) -> Dict[str, Any]:
+        """Get all items in the collection (loads the whole table; prefer query())."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, data FROM records").fetchall()
+        return {item_id: json.loads(data) for item_id, data in rows}
+    
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        """Get an item by ID."""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM records WHERE id = ?", (item_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def create(self, item_id: str, item_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Create a new item."""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)", self._row(item_id, item_data))
+        return item_data
+    
+    def create_many(self, items: Dict[str, Dict[str, Any]]) -> None:
+        """Create or replace several items in one transaction."""
+        rows = [self._row(item_id, item_data) for item_id, item_data in items.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def update(self, item_id: str, item_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Update an existing item."""
+        item_id, kind, user_id, signature_type, created_at, data = self._row(item_id, item_data)
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE records SET kind = ?, user_id = ?, signature_type = ?, created_at = ?, data = ? WHERE id = ?",
+                (kind, user_id, signature_type, created_at, data, item_id),
+            )
+        return item_data if cursor.rowcount else None
+    
+    def delete(self, item_id: str) -> bool:
+        """Delete an item."""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM records WHERE id = ?", (item_id,))
+        return cursor.rowcount > 0
+    
+    def delete_many(self, item_ids: List[str]) -> int:
+        """Delete several items in one transaction. Returns how many existed."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                deleted = sum(
+                    self._conn.execute("DELETE FROM records WHERE id = ?", (item_id,)).rowcount
+                    for item_id in item_ids
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return deleted
+    
+    def count(self, kind: Optional[str] = None) -> int:
+        """Number of records, optionally of one kind."""
+        with self._lock:
+            if kind is None:
+                return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM records WHERE kind = ?", (kind,)).fetchone()[0]
+    
+    def query(
+        self,
+        kind: Optional[str] = None,
+        user_id: Optional[str] = None,
+        signature_type: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        oldest_first: bool = False,
+    ) -> Tuple[List[Tuple[str, Dict[str, Any]]], Optional[str]]:
+        """
+        Newest-first (or oldest-first) page of (item_id, item_data) matching
+        the filters, plus a cursor for the next page (None on the last page).
+        date_from is inclusive, date_to exclusive.
+        """
+        clauses = []
+        params: List[Any] = []
+        for column, value in (("kind", kind), ("user_id", user_id), ("signature_type", signature_type)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if date_from is not None:
+            clauses.append("created_at >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            clauses.append("created_at < ?")
+            params.append(date_to)
+        if cursor:
+            # Keyset pagination: resume strictly after the last row returned
+            clauses.append("(created_at, id) > (?, ?)" if oldest_first else "(created_at, id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        
+        order = "ASC" if oldest_first else "DESC"
+        sql = "SELECT id, created_at, data FROM records"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY created_at {order}, id {order} LIMIT ?"
+        params.append(limit + 1)
+        
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        
+        page = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(page[-1][1], page[-1][0])
+        return [(item_id, json.loads(data)) for item_id, _, data in page], next_cursor
+    
+    def close(self) -> None:
+        """Close the SQLite connection."""
+        with self._lock:
+            self._conn.close()
+
+DATABASE_ENGINES = {
+    "json": JsonDatabase,
+    "log": LogDatabase,
+    "sqlite": SqliteDatabase,
+}
+
+def create_database(collection_name: str, engine: str = DB_ENGINE):
+    """Open a collection with the storage engine selected by DB_ENGINE."""
+    try:
+        database_class = DATABASE_ENGINES[engine]
+    except KeyError:
+        raise ValueError(f"Unknown DB_ENGINE '{engine}', expected one of {sorted(DATABASE_ENGINES)}")
+    return database_class(collection_name)
 
 # Create signature sets database
-signature_sets_db = JsonDatabase("signature_sets") 
\ No newline at end of file
+signature_sets_db = create_database("signature_sets") 
\ No newline at end of file
@@ -0,0 +1,377 @@
+"""
+Per-user reference embeddings: compare new signatures with the ones a user
+enrolled earlier.
+
+Enrolling runs a user's reference signatures through the CNN once and keeps
+their penultimate-layer features (embeddings). A student portal verification
+for that user takes the new signatures' embeddings from the same forward pass
+that predicts them and scores them against every reference with one matrix
+product, so references are never sent through the CNN again. Each signature
+gets the cosine similarity of its closest reference.
+
+Storage under EMBEDDINGS_DIR (one generation of files at a time):
+- meta.json: embedding size, dtype, model version and the current generation.
+  Embeddings from other weights are not comparable, so a store written by
+  another model version is discarded when it is opened.
+- vectors.<generation>.bin: L2-normalised embeddings as EMBEDDING_DTYPE rows,
+  memory-mapped. A user's references are one contiguous block of rows, so
+  fetching them is a slice of the map: no copy, and only the pages of users
+  who are actually verified stay resident.
+- index.<generation>.jsonl: append-only log of (user_id, signature_type) ->
+  block entries, replayed at startup; the last entry for a key wins and a
+  count of 0 deletes it.
+
+Re-enrolling leaves the old block behind as dead rows; when opened, the store
+is compacted into a new generation once dead rows outnumber live ones.
+
+Writes take a file lock, and lookups pick up entries appended by other
+processes (SERVE_MODE=prefork) by checking the index log's size, so every
+worker sees every enrollment.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.config import EMBEDDING_DTYPE, EMBEDDINGS_DIR
+from app.filelock import FileLock
+
+# Rows reserved when the vectors file is created or full (it then doubles)
+MIN_CAPACITY_ROWS = 1024
+# Dead rows tolerated before opening the store compacts it
+COMPACT_MIN_DEAD_ROWS = 1024
+
+ReferenceKey = Tuple[str, str]  # (user_id, signature_type)
+# (real, fake) confidences ahead of the embedding in each Embedder row
+PREDICTION_COLUMNS = 2
+
+
+class ReferenceBlock(NamedTuple):
+    start: int  # first row in the vectors file
+    count: int
+    enrolled_at: str
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    """Float32 rows scaled to unit length (all-zero rows stay zero)."""
+    vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class Embedder:
+    """
+    predict() over a model's predict_and_embed(), so a BatchScheduler can
+    batch embedding requests. Each row is the image's PREDICTION_COLUMNS
+    prediction values followed by its embedding (see split_rows()).
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, images: np.ndarray) -> np.ndarray:
+        predictions, features = self.model.predict_and_embed(images)
+        return np.hstack([
+            np.asarray(predictions, dtype=np.float32),
+            np.asarray(features, dtype=np.float32).reshape(len(features), -1),
+        ])
+
+
+def split_rows(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(N, 2) predictions and (N, D) embeddings of Embedder rows."""
+    return rows[:, :PREDICTION_COLUMNS], rows[:, PREDICTION_COLUMNS:]
+
+
+class EmbeddingStore:
+    """Reference embeddings of every enrolled user in one memory-mapped matrix"""
+
+    def __init__(self, directory=EMBEDDINGS_DIR, dtype: str = EMBEDDING_DTYPE):
+        self.directory = Path(directory)
+        self.dtype = np.dtype(dtype)
+        self.dim: Optional[int] = None
+        self.model_version: Optional[str] = None
+        self.generation = 0
+        self._index: Dict[ReferenceKey, ReferenceBlock] = {}
+        self._vectors: Optional[np.memmap] = None
+        self._rows = 0  # rows allocated so far, live or dead
+        self._live_rows = 0
+        self._log_offset = 0
+        self._meta_mtime = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.dim is not None
+
+    @property
+    def _meta_path(self) -> Path:
+        return self.directory / "meta.json"
+
+    def _vectors_path(self, generation: int) -> Path:
+        return self.directory / f"vectors.{generation}.bin"
+
+    def _index_path(self, generation: int) -> Path:
+        return self.directory / f"index.{generation}.jsonl"
+
+    def open(self, model_version: str, dim: int) -> None:
+        """
+        Load the store for `dim`-value embeddings of `model_version`, starting
+        a new, empty one if the files on disk were written for other weights.
+        """
+        with self._lock, self._file_lock():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            meta = self._read_meta()
+            expected = {"dim": int(dim), "dtype": self.dtype.name, "model_version": model_version}
+            if meta is None or any(meta.get(key) != value for key, value in expected.items()):
+                old_generation = (meta or {}).get("generation", 0)
+                self._write_meta(dict(expected, generation=old_generation + 1))
+                if meta is not None:
+                    print(f"Reference embeddings were made by {meta.get('model_version')}; starting a new store")
+                    self._remove_generation(old_generation)
+                meta = self._read_meta()
+            self._load(meta)
+            dead_rows = self._rows - self._live_rows
+            if dead_rows >= COMPACT_MIN_DEAD_ROWS and dead_rows > self._live_rows:
+                self._compact()
+        print(f"Reference embeddings: {len(self._index)} enrolled, {self._live_rows} rows of {self.dim} ({self.dtype.name})")
+
+    def references(self, user_id: str, signature_type: str) -> Optional[np.ndarray]:
+        """The (k, dim) reference rows of a user (a view of the map), or None if not enrolled."""
+        if not self.is_open:
+            return None
+        self._refresh()
+        block = self._index.get((user_id, signature_type))
+        if block is None:
+            return None
+        return self._vectors[block.start:block.start + block.count]
+
+    def block(self, user_id: str, signature_type: str) -> Optional[ReferenceBlock]:
+        if not self.is_open:
+            return None
+        self._refresh()
+        return self._index.get((user_id, signature_type))
+
+    def similarity(self, user_id: str, signature_type: str, embeddings: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Cosine similarity of each of N embeddings to its closest reference of
+        the user, as an (N,) array; None if the user has no references.
+        """
+        references = self.references(user_id, signature_type)
+        if references is None:
+            return None
+        # One (N, dim) x (dim, k) product; k is a handful of rows, so widening
+        # them to float32 first costs less than a float16 matmul would
+        scores = normalize(embeddings) @ references.astype(np.float32).T
+        return scores.max(axis=1)
+
+    def enroll(self, user_id: str, signature_type: str, embeddings: np.ndarray) -> ReferenceBlock:
+        """Replace a user's references with these embeddings (runs on the I/O worker pool)."""
+        vectors = normalize(embeddings)
+        if not self.is_open:
+            raise RuntimeError("The reference store is not open yet")
+        if len(vectors) == 0:
+            raise ValueError("At least one reference embedding is required")
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Embeddings have {vectors.shape[1]} values, the store holds {self.dim}")
+
+        with self._lock, self._file_lock():
+            self._refresh_locked()
+            start = self._rows
+            self._ensure_capacity(start + len(vectors))
+            self._vectors[start:start + len(vectors)] = vectors
+            self._vectors.flush()
+            block = ReferenceBlock(start, len(vectors), datetime.now().isoformat())
+            self._append((user_id, signature_type), block)
+        return block
+
+    def delete(self, user_id: str, signature_type: str) -> bool:
+        """Forget a user's references; returns whether there were any."""
+        if not self.is_open:
+            return False
+        with self._lock, self._file_lock():
+            self._refresh_locked()
+            if (user_id, signature_type) not in self._index:
+                return False
+            self._append((user_id, signature_type), ReferenceBlock(0, 0, datetime.now().isoformat()))
+        return True
+
+    def stats(self) -> Dict:
+        if self.is_open:
+            self._refresh()
+        return {
+            "open": self.is_open,
+            "enrolled": len(self._index),
+            "rows": self._live_rows,
+            "dead_rows": self._rows - self._live_rows,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "model_version": self.model_version,
+            "bytes": 0 if self._vectors is None else int(self._vectors.nbytes),
+        }
+
+    def _read_meta(self) -> Optional[Dict]:
+        try:
+            with open(self._meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta: Dict) -> None:
+        staging = self._meta_path.with_suffix(f".tmp-{os.getpid()}")
+        with open(staging, "w") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(staging, self._meta_path)
+
+    def _load(self, meta: Dict) -> None:
+        """
+        Map the vectors of meta's generation and replay its index log. Lookups
+        read the index without the lock, so it is rebuilt aside and swapped
+        in whole; meta's mtime is recorded last, so until then they see a
+        change and wait for the lock.
+        """
+        self.dim = meta["dim"]
+        self.model_version = meta["model_version"]
+        self.generation = meta["generation"]
+        self._rows = 0
+        self._live_rows = 0
+        self._log_offset = 0
+        self._map()
+        index: Dict[ReferenceKey, ReferenceBlock] = {}
+        self._replay(index)
+        self._index = index
+        self._meta_mtime = os.stat(self._meta_path).st_mtime_ns
+
+    def _map(self) -> None:
+        """(Re)map the whole vectors file, creating it if needed."""
+        path = self._vectors_path(self.generation)
+        row_bytes = self.dim * self.dtype.itemsize
+        if not path.exists() or path.stat().st_size < row_bytes:
+            with open(path, "ab") as f:
+                f.truncate(MIN_CAPACITY_ROWS * row_bytes)
+        capacity = path.stat().st_size // row_bytes
+        self._vectors = np.memmap(path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+
+    def _ensure_capacity(self, rows: int) -> None:
+        if rows <= len(self._vectors):
+            return
+        capacity = max(rows, 2 * len(self._vectors))
+        with open(self._vectors_path(self.generation), "r+b") as f:
+            f.truncate(capacity * self.dim * self.dtype.itemsize)
+        # Lookups still holding the old map keep a valid view of their rows
+        self._map()
+
+    def _replay(self, index: Optional[Dict[ReferenceKey, ReferenceBlock]] = None) -> None:
+        """Apply index entries appended since the last replay (by any process) to `index`, or the live index."""
+        try:
+            with open(self._index_path(self.generation), "rb") as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line still being written by another process is left for next time
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].splitlines():
+            entry = json.loads(line)
+            self._apply((entry["user_id"], entry["signature_type"]),
+                        ReferenceBlock(entry["start"], entry["count"], entry["enrolled_at"]), index)
+        self._log_offset += complete
+        if self._rows > len(self._vectors):
+            self._map()
+
+    def _apply(
+        self, key: ReferenceKey, block: ReferenceBlock, index: Optional[Dict[ReferenceKey, ReferenceBlock]] = None
+    ) -> None:
+        if index is None:
+            index = self._index
+        previous = index.get(key)
+        if previous is not None:
+            self._live_rows -= previous.count
+        # Replaced in place, never popped first: a lookup always finds one of the two blocks
+        if block.count:
+            index[key] = block
+            self._live_rows += block.count
+            self._rows = max(self._rows, block.start + block.count)
+        elif previous is not None:
+            del index[key]
+
+    def _append(self, key: ReferenceKey, block: ReferenceBlock) -> None:
+        """Log an index entry durably, then apply it."""
+        entry = {"user_id": key[0], "signature_type": key[1], **block._asdict()}
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        with open(self._index_path(self.generation), "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._apply(key, block)
+        self._log_offset += len(line)
+
+    def _refresh(self) -> None:
+        """Pick up changes made by other processes (two stat calls when there are none)."""
+        try:
+            changed = (
+                os.stat(self._meta_path).st_mtime_ns != self._meta_mtime
+                or os.stat(self._index_path(self.generation)).st_size != self._log_offset
+            )
+        except FileNotFoundError:
+            changed = False
+        if changed:
+            with self._lock:
+                self._refresh_locked()
+
+    def _refresh_locked(self) -> None:
+        meta = self._read_meta()
+        if meta is not None and meta.get("generation") != self.generation:
+            # Another process compacted or reset the store
+            self._load(meta)
+        else:
+            self._replay()
+
+    def _compact(self) -> None:
+        """Copy the live blocks into a new generation, dropping dead rows."""
+        generation = self.generation + 1
+        live = sorted(self._index.items(), key=lambda item: item[1].start)
+        row_bytes = self.dim * self.dtype.itemsize
+        capacity = max(MIN_CAPACITY_ROWS, self._live_rows)
+        with open(self._vectors_path(generation), "wb") as f:
+            f.truncate(capacity * row_bytes)
+        vectors = np.memmap(self._vectors_path(generation), dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+        offset = 0
+        with open(self._index_path(generation), "wb") as log:
+            for (user_id, signature_type), block in live:
+                vectors[offset:offset + block.count] = self._vectors[block.start:block.start + block.count]
+                entry = {"user_id": user_id, "signature_type": signature_type,
+                         **block._replace(start=offset)._asdict()}
+                log.write((json.dumps(entry) + "\n").encode("utf-8"))
+                offset += block.count
+            vectors.flush()
+            log.flush()
+            os.fsync(log.fileno())
+        del vectors
+
+        old = self.generation
+        # Switching meta.json over is the commit point
+        self._write_meta({"dim": self.dim, "dtype": self.dtype.name,
+                          "model_version": self.model_version, "generation": generation})
+        self._load(self._read_meta())
+        self._remove_generation(old)
+        print(f"Compacted reference embeddings to {self._live_rows} rows")
+
+    def _remove_generation(self, generation: int) -> None:
+        # Processes that still map the old vectors keep them until they reload
+        for path in (self._vectors_path(generation), self._index_path(generation)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _file_lock(self) -> FileLock:
+        """Exclusive lock on the store across processes."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return FileLock(self.directory / "lock")
@@ -0,0 +1,303 @@
+"""
+Inference engines: one batched predict() interface over several runtimes.
+
+- keras: the .h5 model under full TensorFlow, traced once into a tf.function
+  (the traced graph is cached as a SavedModel under MODEL_CACHE_DIR)
+- tflite: a .tflite conversion run by tflite_runtime (or tf.lite if only full
+  TensorFlow is installed); much smaller to install and cheaper per call
+- onnx: an .onnx conversion run by ONNX Runtime
+
+Every engine takes a float32 batch of shape (N, 224, 224, 3) and returns
+(N, 2) rows of (real, fake) confidences, so BatchScheduler does not care
+which one is in use. Engines with supports_embeddings also return the
+penultimate-layer features of a batch from embed(), or both outputs of one
+forward pass from predict_and_embed() (see app/embeddings.py).
+
+INFERENCE_BACKEND picks the engine; the .tflite and .onnx artifacts are
+produced by `python -m app.convert_model`.
+
+Runtimes are imported only when their engine is created.
+"""
+
+import os
+import shutil
+import threading
+from typing import Dict, Optional, Tuple, Type
+
+import numpy as np
+
+from app.config import (
+    INFERENCE_THREADS,
+    MODEL_CACHE_DIR,
+    MODEL_PATH,
+    ONNX_MODEL_PATH,
+    TFLITE_MODEL_PATH,
+)
+from app.preprocessing import INPUT_SHAPE
+from app.result_cache import model_version_from_file
+
+
+class InferenceEngine:
+    """Base class: a loaded model with a batched predict()"""
+
+    name = "base"
+    # Whether a loaded engine keeps working in a process forked from its loader
+    # (runtimes with their own thread pools do not survive fork)
+    fork_safe = False
+    # Whether embed() is available
+    supports_embeddings = False
+
+    def __init__(self, model_path: str):
+        self.model_path = str(model_path)
+        # Includes the backend, since conversions do not match bit-for-bit
+        self.version = f"{self.name}:{model_version_from_file(self.model_path)}"
+
+    def predict(self, images: np.ndarray) -> np.ndarray:
+        """Predict a float32 (N, 224, 224, 3) batch; returns (N, 2)."""
+        raise NotImplementedError
+
+    def embed(self, images: np.ndarray) -> np.ndarray:
+        """Penultimate-layer features of a float32 (N, 224, 224, 3) batch; returns (N, D)."""
+        raise NotImplementedError(f"The {self.name} engine does not produce embeddings")
+
+    def predict_and_embed(self, images: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """predict() and embed() of one batch; engines override this to share the forward pass."""
+        return self.predict(images), self.embed(images)
+
+    @staticmethod
+    def import_runtime() -> None:
+        """Import the runtime library without loading any weights."""
+
+    def after_ready(self) -> None:
+        """Slow, optional work to do once the server is already serving."""
+
+    def after_fork(self) -> None:
+        """Drop per-process state in a forked worker (fork-safe engines only)."""
+
+
+class KerasEngine(InferenceEngine):
+    """The Keras .h5 model, run as a traced tf.function"""
+
+    name = "keras"
+
+    def __init__(
+        self,
+        model_path: str = MODEL_PATH,
+        cache_dir: str = MODEL_CACHE_DIR,
+        num_threads: int = INFERENCE_THREADS,
+        inter_op_threads: int = 1,
+    ):
+        super().__init__(model_path)
+        import tensorflow as tf
+
+        self._tf = tf
+        if num_threads:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+                tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+            except RuntimeError:
+                # TensorFlow has already started its thread pools
+                print("WARNING: INFERENCE_THREADS ignored; TensorFlow is already initialized")
+        self.keras_model = None
+        self.from_cache = False
+        self._cache_path = self._traced_cache_path(cache_dir)
+
+        print(f"Attempting to load model from: {self.model_path}")
+        print(f"Model file exists: {os.path.exists(self.model_path)}")
+
+        if self._cache_path and os.path.isdir(self._cache_path):
+            try:
+                cached = tf.saved_model.load(self._cache_path)
+                self._serve = cached.serve
+                # Caches saved before embeddings were added have no embed()
+                self._embed = getattr(cached, "embed", None)
+                self._serve_and_embed = getattr(cached, "serve_and_embed", None)
+                self.supports_embeddings = self._embed is not None
+                self.from_cache = True
+                print(f"Loaded traced model from cache: {self._cache_path}")
+                return
+            except Exception as e:
+                print(f"WARNING: ignoring unusable model cache {self._cache_path}: {e}")
+
+        # compile=False: inference needs no optimizer, loss or metrics
+        keras_model = tf.keras.models.load_model(self.model_path, compile=False)
+        self.keras_model = keras_model
+        self._serve = tf.function(
+            lambda images: keras_model(images, training=False),
+            input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32)],
+        )
+        # The layer before the classifier, flattened to one vector per image
+        embedder = tf.keras.Model(keras_model.inputs, keras_model.layers[-2].output)
+        self._embed = tf.function(
+            lambda images: tf.reshape(embedder(images, training=False), (tf.shape(images)[0], -1)),
+            input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32)],
+        )
+        # Both outputs from one pass, for verifications that are also matched against references
+        both = tf.keras.Model(keras_model.inputs, [keras_model.output, keras_model.layers[-2].output])
+
+        def serve_and_embed(images):
+            predictions, features = both(images, training=False)
+            return predictions, tf.reshape(features, (tf.shape(images)[0], -1))
+
+        self._serve_and_embed = tf.function(
+            serve_and_embed,
+            input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32)],
+        )
+        self.supports_embeddings = True
+        print(f"Model loaded successfully from {self.model_path}")
+
+    @staticmethod
+    def import_runtime() -> None:
+        import tensorflow  # noqa: F401
+
+    def _traced_cache_path(self, cache_dir: str) -> Optional[str]:
+        if not cache_dir:
+            return None
+        key = f"{self.version}-tf{self._tf.__version__}"
+        safe_key = "".join(c if c.isalnum() or c in "-._" else "_" for c in key)
+        return os.path.join(cache_dir, safe_key)
+
+    def predict(self, images: np.ndarray) -> np.ndarray:
+        return self._serve(self._tf.convert_to_tensor(images, dtype=self._tf.float32)).numpy()
+
+    def embed(self, images: np.ndarray) -> np.ndarray:
+        if self._embed is None:
+            return super().embed(images)
+        return self._embed(self._tf.convert_to_tensor(images, dtype=self._tf.float32)).numpy()
+
+    def predict_and_embed(self, images: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self._serve_and_embed is None:
+            # Caches saved before the combined function was added
+            return super().predict_and_embed(images)
+        predictions, features = self._serve_and_embed(self._tf.convert_to_tensor(images, dtype=self._tf.float32))
+        return predictions.numpy(), features.numpy()
+
+    def after_ready(self) -> None:
+        """Export the traced graph so the next start can skip tracing."""
+        if self.from_cache or not self._cache_path:
+            return
+        tf = self._tf
+        module = tf.Module()
+        module.model = self.keras_model
+        module.serve = self._serve
+        module.embed = self._embed
+        module.serve_and_embed = self._serve_and_embed
+        staging = f"{self._cache_path}.tmp-{os.getpid()}"
+        try:
+            tf.saved_model.save(module, staging)
+            os.replace(staging, self._cache_path)
+            print(f"Saved traced model to cache: {self._cache_path}")
+        except Exception as e:
+            print(f"WARNING: could not save traced model cache: {e}")
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+def _tflite_interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteEngine(InferenceEngine):
+    """A .tflite model; each inference thread gets its own interpreter"""
+
+    name = "tflite"
+    # Interpreters memory-map the model file, so forked workers share its pages
+    fork_safe = True
+
+    def __init__(self, model_path: str = TFLITE_MODEL_PATH, num_threads: int = INFERENCE_THREADS):
+        super().__init__(model_path)
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(
+                f"{self.model_path} not found; create it with `python -m app.convert_model --formats tflite`"
+            )
+        self._interpreter_class = _tflite_interpreter_class()
+        self.num_threads = num_threads or None
+        self._local = threading.local()
+        # Load once up front so a broken file fails at startup, not on a request
+        self._interpreter()
+        print(f"TFLite model loaded from {self.model_path}")
+
+    @staticmethod
+    def import_runtime() -> None:
+        _tflite_interpreter_class()
+
+    def after_fork(self) -> None:
+        # Interpreters created before the fork belong to the parent
+        self._local = threading.local()
+
+    def _interpreter(self):
+        interpreter = getattr(self._local, "interpreter", None)
+        if interpreter is None:
+            # Interpreters are not thread-safe
+            interpreter = self._interpreter_class(model_path=self.model_path, num_threads=self.num_threads)
+            interpreter.allocate_tensors()
+            self._local.interpreter = interpreter
+            self._local.batch_size = interpreter.get_input_details()[0]["shape"][0]
+        return interpreter
+
+    def predict(self, images: np.ndarray) -> np.ndarray:
+        interpreter = self._interpreter()
+        input_index = interpreter.get_input_details()[0]["index"]
+        if self._local.batch_size != len(images):
+            # Reallocating is cheap next to inference, and keeps one arena per thread
+            interpreter.resize_tensor_input(input_index, (len(images),) + INPUT_SHAPE)
+            interpreter.allocate_tensors()
+            self._local.batch_size = len(images)
+        interpreter.set_tensor(input_index, np.ascontiguousarray(images, dtype=np.float32))
+        interpreter.invoke()
+        return interpreter.get_tensor(interpreter.get_output_details()[0]["index"]).copy()
+
+
+class OnnxEngine(InferenceEngine):
+    """An .onnx model run by an ONNX Runtime CPU session"""
+
+    name = "onnx"
+
+    def __init__(self, model_path: str = ONNX_MODEL_PATH, num_threads: int = INFERENCE_THREADS):
+        super().__init__(model_path)
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(
+                f"{self.model_path} not found; create it with `python -m app.convert_model --formats onnx`"
+            )
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        # session.run is thread-safe, so one session serves every inference thread
+        self._session = ort.InferenceSession(
+            self.model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._input_name = self._session.get_inputs()[0].name
+        print(f"ONNX model loaded from {self.model_path}")
+
+    @staticmethod
+    def import_runtime() -> None:
+        import onnxruntime  # noqa: F401
+
+    def predict(self, images: np.ndarray) -> np.ndarray:
+        inputs = {self._input_name: np.ascontiguousarray(images, dtype=np.float32)}
+        return self._session.run(None, inputs)[0]
+
+
+ENGINES: Dict[str, Type[InferenceEngine]] = {
+    KerasEngine.name: KerasEngine,
+    TFLiteEngine.name: TFLiteEngine,
+    OnnxEngine.name: OnnxEngine,
+}
+
+
+def create_engine(backend: str, **options) -> InferenceEngine:
+    """
+    Create the engine registered under `backend`. Options (e.g. num_threads)
+    override its configured defaults.
+    """
+    try:
+        engine_class = ENGINES[backend]
+    except KeyError:
+        raise ValueError(f"Unknown INFERENCE_BACKEND {backend!r}; expected one of {', '.join(ENGINES)}")
+    return engine_class(**options)
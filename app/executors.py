@@ -0,0 +1,104 @@
+"""
+Worker pools for blocking work done on behalf of async request handlers.
+
+Image decoding, model inference and database writes all block, so handlers
+hand them to dedicated pools instead of running them on the event loop:
+
+- inference_pool: threads that run model.predict (driven by BatchScheduler)
+- decode_executor: threads, or processes when DECODE_USE_PROCESSES is set
+- io_executor: threads for database and upload file writes
+
+Bounded executors admit at most EXECUTOR_QUEUE_DEPTH pending jobs and raise
+ExecutorBusyError beyond that, which the API turns into a 503 response.
+"""
+
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.config import (
+    DECODE_USE_PROCESSES,
+    DECODE_WORKERS,
+    EXECUTOR_QUEUE_DEPTH,
+    EXECUTOR_RETRY_AFTER,
+    INFERENCE_WORKERS,
+    IO_WORKERS,
+)
+from app import profiling
+
+
+class ExecutorBusyError(Exception):
+    """Raised when a worker queue is full and new work must be refused."""
+
+    def __init__(self, name: str, retry_after: int = EXECUTOR_RETRY_AFTER):
+        super().__init__(f"The {name} queue is full, please retry shortly")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """Wraps an Executor with a cap on the number of pending jobs"""
+
+    def __init__(self, name: str, executor: Executor, max_pending: int = EXECUTOR_QUEUE_DEPTH):
+        self.name = name
+        self.executor = executor
+        # Jobs of profiled requests are sampled in the worker thread; processes can't be
+        self._threads = not isinstance(executor, ProcessPoolExecutor)
+        self.max_pending = max(1, int(max_pending))
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs submitted and not yet finished."""
+        return self._pending
+
+    def _release(self, _future=None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool, or raise ExecutorBusyError if it is full."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ExecutorBusyError(self.name)
+            self._pending += 1
+
+        if self._threads:
+            fn = profiling.bind(fn)
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Release the slot when the job finishes, even if the caller gave up on it
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Stop the pool; queued jobs are dropped unless wait is set."""
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _create_decode_pool() -> Executor:
+    if DECODE_USE_PROCESSES:
+        # Spawn rather than fork: the parent may hold TensorFlow threads and locks
+        return ProcessPoolExecutor(
+            max_workers=DECODE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+
+
+inference_pool = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+decode_executor = BoundedExecutor("decode", _create_decode_pool())
+io_executor = BoundedExecutor("io", ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io"))
+
+
+def shutdown_executors() -> None:
+    """Stop all worker pools (called on application shutdown)."""
+    decode_executor.shutdown()
+    # Let pending database and upload writes finish
+    io_executor.shutdown(wait=True)
+    inference_pool.shutdown(wait=False, cancel_futures=True)
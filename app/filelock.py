@@ -0,0 +1,58 @@
+"""
+Exclusive file locks between worker processes (SERVE_MODE=prefork).
+
+The reference store, the perceptual hash index and bulk jobs all coordinate
+processes with flock() on a lock file next to their data. The lock belongs to
+the open file, so it is released when the file is closed, including when the
+process dies. Without fcntl (Windows) the locks are no-ops: running several
+processes there is for development only.
+"""
+
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development only
+    fcntl = None
+
+
+class FileLock:
+    """flock() on a lock file, usable as a (blocking) context manager"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._fh = None
+
+    @property
+    def locked(self) -> bool:
+        return self._fh is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Open the lock file (its directory must exist) and lock it. Without
+        `blocking`, returns False at once if another process holds it.
+        """
+        fh = open(self.path, "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                fh.close()
+                if blocking:
+                    raise
+                return False
+        self._fh = fh
+        return True
+
+    def release(self) -> None:
+        if self._fh is not None:
+            # Closing the file drops the lock
+            self._fh.close()
+            self._fh = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,66 @@
+"""
+Single-pass ingest of uploaded image files.
+
+Each upload is read once, in chunks, and every chunk is written to disk (when
+the upload is persisted), fed to the SHA-256 used as the prediction cache key
+and appended to the buffer the image is decoded from. Uploads over
+MAX_IMAGE_BYTES are rejected as soon as the limit is crossed, and the partial
+file is removed.
+
+ingest_upload blocks, so handlers run it on the I/O worker pool.
+"""
+
+import hashlib
+import os
+from typing import BinaryIO, NamedTuple, Optional
+
+from app.config import MAX_IMAGE_BYTES
+from app.preprocessing import ImageTooLargeError
+
+INGEST_CHUNK_SIZE = 1024 * 1024
+
+
+class IngestedUpload(NamedTuple):
+    filename: str
+    data: bytearray  # raw image bytes, ready for decoding
+    digest: str  # SHA-256 hex digest of data
+    path: Optional[str]  # where the upload was written, if persisted
+
+
+def safe_filename(filename: Optional[str], default: str) -> str:
+    """The client's file name without any directory components."""
+    name = os.path.basename((filename or "").replace("\\", "/"))
+    return name if name not in ("", ".", "..") else default
+
+
+def ingest_upload(
+    file_obj: BinaryIO,
+    filename: str,
+    dest_dir: Optional[str] = None,
+    max_bytes: int = MAX_IMAGE_BYTES,
+) -> IngestedUpload:
+    """Read an upload once: persist it to dest_dir (if given), hash it and buffer it."""
+    file_obj.seek(0)
+    hasher = hashlib.sha256()
+    data = bytearray()
+    path = os.path.join(dest_dir, filename) if dest_dir else None
+    out = open(path, "wb") if path else None
+    try:
+        while True:
+            chunk = file_obj.read(INGEST_CHUNK_SIZE)
+            if not chunk:
+                break
+            if len(data) + len(chunk) > max_bytes:
+                raise ImageTooLargeError(f"{filename} is over the {max_bytes} byte limit")
+            hasher.update(chunk)
+            data += chunk
+            if out is not None:
+                out.write(chunk)
+    except BaseException:
+        if out is not None:
+            out.close()
+            os.remove(path)
+        raise
+    if out is not None:
+        out.close()
+    return IngestedUpload(filename, data, hasher.hexdigest(), path)
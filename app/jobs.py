@@ -0,0 +1,555 @@
+"""
+Bulk verification jobs: re-verify an archive of signatures in the background.
+
+    POST   /jobs                  upload an archive; returns the job id
+    GET    /jobs/{job_id}         progress
+    GET    /jobs/{job_id}/results page through results as they are produced
+    DELETE /jobs/{job_id}         cancel the job and delete its files
+
+An archive is either
+- JSONL: one JSON object per line in the /verify-student-signatures shape
+  ({"signatures": [base64, ...], "user_id": ..., "signature_type": ...}, or a
+  single "signature"), with an optional "id"; or
+- zip: image files, each verified as an item on its own.
+
+The upload is copied to JOBS_DIR/<job_id>/ and read back one step at a time.
+Each step reads about JOB_BATCH_SIZE images, decodes them into a buffer that
+is reused across steps, and predicts them as a single background batch. The
+step's results are then appended to results.jsonl, so memory stays the same
+however large the archive is. Jobs run one at a time and yield to interactive
+traffic: their batches only reach the model when no request is waiting (see
+BatchScheduler), and they use at most one decode worker. A full pool makes the
+job wait instead of failing.
+
+Progress is saved to job.json after every step. A job that was interrupted by
+a restart resumes where it stopped. Each job directory carries a lock file, so
+with several worker processes every job is processed by exactly one of them.
+Results bypass the prediction cache and the database. Images the blank
+pre-check finds empty (PRECHECK) get a no_signature result without the model.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+import zipfile
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app import metrics, preprocessing
+from app.config import (
+    CONFIDENCE_THRESHOLD,
+    DECODE_USE_PROCESSES,
+    JOB_BATCH_SIZE,
+    JOB_MAX_UPLOAD_BYTES,
+    JOBS_DIR,
+    MAX_IMAGE_BYTES,
+    PRECHECK,
+)
+from app.executors import ExecutorBusyError, decode_executor, io_executor
+from app.filelock import FileLock
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+UNFINISHED_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+FORMAT_JSONL = "jsonl"
+FORMAT_ZIP = "zip"
+
+# Same limit as /verify-student-signatures
+MAX_SIGNATURES_PER_ITEM = 7
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".tif", ".tiff")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Seconds to wait before retrying when a worker pool is full or the model is loading
+BUSY_RETRY_DELAY = 0.2
+MODEL_WAIT_DELAY = 1.0
+
+# Endpoint label for job verdicts in /metrics
+METRICS_ENDPOINT = "/jobs"
+
+
+class JobUploadError(ValueError):
+    """Raised when an uploaded archive cannot be used for a job."""
+
+
+class JobItem(NamedTuple):
+    index: int  # position in the archive
+    item_id: str
+    meta: Dict  # copied into the result (user_id, signature_type)
+    filenames: List[str]
+    images: List[bytes]
+    error: Optional[str]
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def public_view(job: Dict) -> Dict:
+    """A job without its internal bookkeeping."""
+    return {key: value for key, value in job.items() if key != "results_bytes"}
+
+
+def _error_item(index: int, item_id: str, error: str) -> JobItem:
+    return JobItem(index, item_id, {}, [], [], error)
+
+
+def jsonl_items(path: str) -> Iterator[JobItem]:
+    """Items of a JSONL archive, one per non-blank line."""
+    index = 0
+    with open(path, "rb") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item_id = f"line-{line_number}"
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("Each line must be a JSON object")
+                item_id = str(record.get("id", item_id))
+                signatures = record.get("signatures")
+                if signatures is None and "signature" in record:
+                    signatures = [record["signature"]]
+                if not isinstance(signatures, list) or not signatures:
+                    raise ValueError("At least one signature is required")
+                if len(signatures) > MAX_SIGNATURES_PER_ITEM:
+                    raise ValueError(f"Maximum {MAX_SIGNATURES_PER_ITEM} signatures allowed")
+                images = [preprocessing.decode_base64_image(signature) for signature in signatures]
+            except (ValueError, TypeError) as e:
+                yield _error_item(index, item_id, str(e))
+            else:
+                meta = {key: record[key] for key in ("user_id", "signature_type") if key in record}
+                filenames = [f"signature_{i + 1}" for i in range(len(images))]
+                yield JobItem(index, item_id, meta, filenames, images, None)
+            index += 1
+
+
+def zip_image_entries(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    return [
+        info for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def zip_items(path: str) -> Iterator[JobItem]:
+    """Items of a zip archive, one per image file."""
+    with zipfile.ZipFile(path) as archive:
+        for index, info in enumerate(zip_image_entries(archive)):
+            if info.file_size > MAX_IMAGE_BYTES:
+                yield _error_item(
+                    index, info.filename, f"Image is {info.file_size} bytes; the limit is {MAX_IMAGE_BYTES} bytes"
+                )
+                continue
+            try:
+                data = archive.read(info)
+            except (zipfile.BadZipFile, OSError, RuntimeError) as e:
+                yield _error_item(index, info.filename, str(e))
+                continue
+            yield JobItem(index, info.filename, {}, [os.path.basename(info.filename)], [data], None)
+
+
+class JobReader:
+    """Reads an archive a step at a time, skipping items already processed"""
+
+    def __init__(self, path: str, archive_format: str, skip: int = 0):
+        self._source = zip_items(path) if archive_format == FORMAT_ZIP else jsonl_items(path)
+        self._items = (item for item in self._source if item.index >= skip)
+
+    def read(self, max_images: int) -> List[JobItem]:
+        """The next items, stopping once they hold max_images images (blocks)."""
+        batch = []
+        images = 0
+        for item in self._items:
+            batch.append(item)
+            # Items that failed to read count as one, so a step stays bounded
+            images += max(1, len(item.images))
+            if images >= max_images:
+                break
+        return batch
+
+    def close(self) -> None:
+        self._items.close()
+        self._source.close()
+
+
+class JobManager:
+    """Accepts bulk verification jobs and runs them one at a time in the background"""
+
+    def __init__(self, scheduler, model_loader, jobs_dir=JOBS_DIR, batch_size: int = JOB_BATCH_SIZE):
+        self.scheduler = scheduler
+        self.model_loader = model_loader
+        self.jobs_dir = str(jobs_dir)
+        self.batch_size = max(1, int(batch_size))
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._cancelled = set()
+        # Decoded inputs of one step; allocated when the first job runs
+        self._inputs: Optional[np.ndarray] = None
+
+    def _job_dir(self, job_id: str) -> str:
+        # Job ids are generated uuids; anything else cannot name a job
+        try:
+            uuid.UUID(job_id)
+        except ValueError:
+            raise KeyError(job_id)
+        return os.path.join(self.jobs_dir, job_id)
+
+    def _load(self, job_id: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self._job_dir(job_id), "job.json")) as f:
+                return json.load(f)
+        except (KeyError, OSError, ValueError):
+            return None
+
+    def _save(self, job: Dict) -> None:
+        path = os.path.join(self._job_dir(job["job_id"]), "job.json")
+        staging = f"{path}.tmp"
+        with open(staging, "w") as f:
+            json.dump(job, f)
+        os.replace(staging, path)
+
+    def start(self) -> None:
+        """Start the job runner and queue jobs left unfinished by a restart (call on the event loop)."""
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+        unfinished = []
+        for job_id in os.listdir(self.jobs_dir):
+            job = self._load(job_id)
+            if job is not None and job["status"] in UNFINISHED_STATES:
+                unfinished.append(job)
+        for job in sorted(unfinished, key=lambda job: job["created_at"]):
+            self._queue.put_nowait(job["job_id"])
+        if unfinished:
+            print(f"Resuming {len(unfinished)} unfinished verification jobs")
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def create(self, file_obj: BinaryIO, filename: str, threshold: float = CONFIDENCE_THRESHOLD) -> Dict:
+        """Store an uploaded archive as a new job (blocks). Call submit() to queue it."""
+        job_id = str(uuid.uuid4())
+        job_dir = self._job_dir(job_id)
+        os.makedirs(job_dir)
+        try:
+            input_path = os.path.join(job_dir, "input")
+            size = 0
+            file_obj.seek(0)
+            with open(input_path, "wb") as out:
+                while True:
+                    chunk = file_obj.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > JOB_MAX_UPLOAD_BYTES:
+                        raise JobUploadError(f"The archive is over the {JOB_MAX_UPLOAD_BYTES} byte limit")
+                    out.write(chunk)
+            if size == 0:
+                raise JobUploadError("The archive is empty")
+
+            total_items = None
+            if zipfile.is_zipfile(input_path):
+                archive_format = FORMAT_ZIP
+                with zipfile.ZipFile(input_path) as archive:
+                    total_items = len(zip_image_entries(archive))
+                if not total_items:
+                    raise JobUploadError("The zip archive contains no images")
+            else:
+                archive_format = FORMAT_JSONL
+
+            job = {
+                "job_id": job_id,
+                "status": JOB_QUEUED,
+                "filename": filename,
+                "format": archive_format,
+                "threshold": threshold,
+                "created_at": _now(),
+                "started_at": None,
+                "finished_at": None,
+                "total_items": total_items,
+                "items_done": 0,
+                "images_done": 0,
+                "item_errors": 0,
+                "authentic": 0,
+                "flagged": 0,
+                "results_bytes": 0,
+                "error": None,
+            }
+            self._save(job)
+        except BaseException:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        return job
+
+    def submit(self, job_id: str) -> None:
+        """Queue a created job for processing."""
+        self._queue.put_nowait(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """Progress of a job (from disk, so any worker process can answer), or None."""
+        job = self._load(job_id)
+        return public_view(job) if job is not None else None
+
+    def results(self, job_id: str, cursor: Optional[str], limit: int) -> Optional[Dict]:
+        """
+        A page of results (blocks), or None if there is no such job. The
+        cursor is a byte offset into the results file. While the job is
+        unfinished a next_cursor is always returned, so clients can keep
+        polling; it is None once everything has been read.
+        """
+        job = self._load(job_id)
+        if job is None:
+            return None
+        try:
+            offset = int(cursor) if cursor else 0
+        except ValueError:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        # Only lines recorded in job.json are complete
+        end = job["results_bytes"]
+        if offset < 0 or offset > end:
+            raise ValueError(f"Invalid cursor: {cursor}")
+
+        items = []
+        path = os.path.join(self._job_dir(job_id), "results.jsonl")
+        if offset < end:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                while len(items) < limit and offset < end:
+                    line = f.readline()
+                    offset += len(line)
+                    items.append(json.loads(line))
+        finished = offset >= end and job["status"] not in UNFINISHED_STATES
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "items": items,
+            "next_cursor": None if finished else str(offset),
+        }
+
+    def delete(self, job_id: str) -> bool:
+        """Cancel a job and delete its files (blocks). Returns whether it existed."""
+        try:
+            job_dir = self._job_dir(job_id)
+        except KeyError:
+            return False
+        if not os.path.isdir(job_dir):
+            return False
+        # A runner in this process stops at its next step; one in another
+        # process stops when it finds the directory gone
+        self._cancelled.add(job_id)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self._stopped(job_id):
+                    # Deleted while a step was being written
+                    continue
+                print(f"ERROR running verification job {job_id}: {e}")
+                job = self._load(job_id)
+                if job is not None:
+                    job.update(status=JOB_FAILED, error=str(e), finished_at=_now())
+                    await self._io(self._save, job)
+            finally:
+                self._cancelled.discard(job_id)
+
+    async def _io(self, fn, *args):
+        """Run blocking file work on the I/O pool, waiting while it is full."""
+        while True:
+            try:
+                return await io_executor.run(fn, *args)
+            except ExecutorBusyError:
+                await asyncio.sleep(BUSY_RETRY_DELAY)
+
+    def _claim(self, job_id: str):
+        """Lock a job for this process; None if another process holds it or it is gone."""
+        lock = FileLock(os.path.join(self._job_dir(job_id), "lock"))
+        try:
+            if not lock.acquire(blocking=False):
+                return None
+        except OSError:
+            return None
+        return lock
+
+    def _stopped(self, job_id: str) -> bool:
+        return job_id in self._cancelled or not os.path.isdir(os.path.join(self.jobs_dir, job_id))
+
+    async def _process(self, job_id: str) -> None:
+        lock = await self._io(self._claim, job_id)
+        if lock is None:
+            return
+        try:
+            # Re-read after locking: another process may have finished it
+            job = self._load(job_id)
+            if job is None or job["status"] not in UNFINISHED_STATES:
+                return
+
+            while not self.model_loader.ready:
+                if self.model_loader.failed:
+                    raise RuntimeError("The model failed to load")
+                await asyncio.sleep(MODEL_WAIT_DELAY)
+
+            if self._inputs is None:
+                # Room for a full step plus one item that overflows it
+                capacity = self.batch_size + MAX_SIGNATURES_PER_ITEM - 1
+                self._inputs = np.empty((capacity,) + preprocessing.INPUT_SHAPE, dtype=np.float32)
+
+            job["status"] = JOB_RUNNING
+            job["started_at"] = job["started_at"] or _now()
+            await self._io(self._save, job)
+            print(f"Verification job {job_id} started ({job['items_done']} items already done)")
+
+            input_path = os.path.join(self._job_dir(job_id), "input")
+            reader = JobReader(input_path, job["format"], skip=job["items_done"])
+            results = await self._io(self._open_results, job)
+            try:
+                while not self._stopped(job_id):
+                    items = await self._io(reader.read, self.batch_size)
+                    if not items:
+                        break
+                    lines = await self._verify(items, job["threshold"])
+                    await self._io(self._commit, job, results, lines)
+            finally:
+                reader.close()
+                results.close()
+
+            if self._stopped(job_id):
+                print(f"Verification job {job_id} cancelled")
+                return
+            job.update(status=JOB_COMPLETED, finished_at=_now())
+            await self._io(self._save, job)
+            print(f"Verification job {job_id} completed: {job['items_done']} items, {job['images_done']} images")
+        finally:
+            lock.release()
+
+    def _open_results(self, job: Dict) -> BinaryIO:
+        """Open the results file at the end of the saved progress, dropping any lines after it."""
+        path = os.path.join(self._job_dir(job["job_id"]), "results.jsonl")
+        results = open(path, "r+b" if os.path.exists(path) else "wb")
+        results.truncate(job["results_bytes"])
+        results.seek(job["results_bytes"])
+        return results
+
+    def _commit(self, job: Dict, results: BinaryIO, lines: List[Dict]) -> None:
+        """Append a step's results and record the progress (runs on the I/O pool)."""
+        results.write(b"".join(json.dumps(line).encode() + b"\n" for line in lines))
+        results.flush()
+        for line in lines:
+            if "error" in line:
+                job["item_errors"] += 1
+                continue
+            job["images_done"] += len(line["results"])
+            job["flagged"] += len(line["flagged_indices"])
+            job["authentic"] += len(line["results"]) - len(line["flagged_indices"])
+        job["items_done"] += len(lines)
+        job["results_bytes"] = results.tell()
+        self._save(job)
+
+    async def _decode(self, image_bytes, out: np.ndarray) -> bool:
+        """Decode an image into `out`; True when the blank pre-check finds no signature in it."""
+        while True:
+            try:
+                if DECODE_USE_PROCESSES:
+                    tensor, _, ink, _, _ = await decode_executor.run(
+                        preprocessing.preprocess_hashed, image_bytes, None, PRECHECK
+                    )
+                    out[...] = tensor
+                else:
+                    _, _, ink, _, _ = await decode_executor.run(
+                        preprocessing.preprocess_hashed, image_bytes, out, PRECHECK
+                    )
+                break
+            except ExecutorBusyError:
+                await asyncio.sleep(BUSY_RETRY_DELAY)
+        blank = None if ink is None else preprocessing.blank_reason(ink)
+        if blank is not None:
+            metrics.PRECHECK_REJECTED.inc(blank)
+        return blank is not None
+
+    async def _verify(self, items: List[JobItem], threshold: float) -> List[Dict]:
+        """Decode and predict a step's items; returns one result line per item."""
+        started = time.perf_counter()
+        slots: Dict[int, Tuple[int, int]] = {}  # item position -> images of the step
+        errors: Dict[int, str] = {}
+        images = 0
+        # Image of the step in each input row; blank images take no row
+        predicted: List[int] = []
+        for position, item in enumerate(items):
+            if item.error:
+                errors[position] = item.error
+                continue
+            first = images
+            try:
+                for image_bytes in item.images:
+                    if not await self._decode(image_bytes, self._inputs[len(predicted)]):
+                        predicted.append(images)
+                    images += 1
+            except Exception as e:
+                # The item's rows are reused by the next one
+                images = first
+                predicted = [image for image in predicted if image < first]
+                errors[position] = f"Error processing image: {e}"
+                continue
+            slots[position] = (first, images)
+
+        if images:
+            # Blank images keep the no-signature row (0, 0), as in the API
+            predictions = np.zeros((images, 2), dtype=np.float32)
+            if predicted:
+                predictions[predicted] = await self.scheduler.predict(self._inputs[:len(predicted)], background=True)
+            real_confidence = predictions[:, 0].astype(np.float64)
+            is_authentic = real_confidence >= threshold
+            confidence = np.where(is_authentic, real_confidence, 1.0 - real_confidence)
+            no_signature = ~predictions.any(axis=1)
+
+        lines = []
+        authentic_total = 0
+        for position, item in enumerate(items):
+            if position in errors:
+                lines.append({"id": item.item_id, "error": errors[position]})
+                continue
+            first, last = slots[position]
+            results = [
+                {"filename": filename, "is_authentic": bool(authentic), "confidence": float(conf), "no_signature": bool(blank)}
+                for filename, authentic, conf, blank in zip(
+                    item.filenames, is_authentic[first:last], confidence[first:last], no_signature[first:last]
+                )
+            ]
+            flagged_indices = [i for i, result in enumerate(results) if not result["is_authentic"]]
+            authentic_total += len(results) - len(flagged_indices)
+            lines.append({
+                "id": item.item_id,
+                **item.meta,
+                "results": results,
+                "all_authentic": not flagged_indices,
+                "flagged_indices": flagged_indices,
+            })
+
+        if images:
+            blank_total = int(np.count_nonzero(no_signature))
+            metrics.VERDICTS.inc(METRICS_ENDPOINT, "authentic", amount=authentic_total)
+            metrics.VERDICTS.inc(METRICS_ENDPOINT, "flagged", amount=images - authentic_total - blank_total)
+            if blank_total:
+                metrics.VERDICTS.inc(METRICS_ENDPOINT, "no_signature", amount=blank_total)
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, METRICS_ENDPOINT, "job_step")
+        return lines
@@ -1,11 +1,8 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, status
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from typing import List, Dict, Optional, cast, Any
 import numpy as np
-import cv2
-import io
-from PIL import Image
 import os
 import uuid
 import sys
@@ -13,21 +10,33 @@ import traceback
 from datetime import datetime
 from pydantic import BaseModel
 import shutil
-import base64
-
-# Try to import TensorFlow, use mock if not available
-try:
-    import tensorflow as tf
-    TENSORFLOW_AVAILABLE = True
-except ImportError:
-    print("WARNING: TensorFlow not available, using mock model for development")
-    tf = None
-    TENSORFLOW_AVAILABLE = False
+import functools
+import asyncio
 
 # Import config and database
-from app.config import ALLOWED_ORIGINS, MODEL_PATH, UPLOAD_DIR, DB_DIR, CONFIDENCE_THRESHOLD
+from app.config import (
+    ALLOWED_ORIGINS, MODEL_PATH, UPLOAD_DIR, DB_DIR, CONFIDENCE_THRESHOLD, MODEL_VERSION,
+    INFERENCE_WORKERS, DECODE_USE_PROCESSES, MAX_IMAGE_BYTES, LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE,
+    MODEL_LOAD_MODE, PERSIST_UPLOADS, WRITE_BEHIND, REFERENCE_MIN_SIMILARITY, PHASH_INDEX,
+    PRECHECK, PRECHECK_MIN_CONTRAST, PRECHECK_MIN_INK, PRECHECK_MIN_BBOX
+)
 
-from app.database import signature_sets_db
+from app import metrics, profiling
+from app.database import signature_sets_db, KIND_SIGNATURE_SET, KIND_VERIFICATION
+from app.batching import BatchScheduler
+from app.model_loader import ModelLoader, ModelNotReadyError
+from app.executors import ExecutorBusyError, decode_executor, inference_pool, io_executor, shutdown_executors
+from app import preprocessing
+from app.preprocessing import ImageTooLargeError
+from app.result_cache import PredictionCache, image_digest
+from app.ingest import ingest_upload, safe_filename
+from app.write_behind import WriteBehindQueue
+from app.jobs import JobManager, JobUploadError, public_view
+from app.embeddings import Embedder, EmbeddingStore, split_rows
+from app.phash import PHashIndex, Screening
+from app.retention import RetentionSweeper
+from app.autotune import autotuner
+from app.prefork import memory_usage
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -45,55 +54,126 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load the CNN model
-model = None
-use_mock_model = False
+# Request latency, stage timings and verdict counts for GET /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Per-request profiles for requests that opt in (see app/profiling.py); outside
+# the metrics middleware so saving a profile is not counted as request latency
+app.add_middleware(profiling.ProfilingMiddleware)
+
+# Prediction cache keyed by image content, model version and threshold
+result_cache = PredictionCache()
+
+# Enrolled reference embeddings per user (see EMBEDDINGS_DIR); opened once the
+# model is loaded, since they are only valid for the weights that made them
+reference_store = EmbeddingStore()
 
-if TENSORFLOW_AVAILABLE:
+# Perceptual hashes of stored images, for replay and near-duplicate detection
+phash_index = PHashIndex() if PHASH_INDEX else None
+if phash_index is not None:
+    phash_index.open()
+
+# The event loop serving requests, once started; the batch schedulers belong to it
+server_loop = None
+
+def apply_tuning(config):
+    """Serve with an auto-tuned batch size and batching window (on the event loop)."""
     try:
-        print(f"Attempting to load model from: {MODEL_PATH}")
-        print(f"Current working directory: {os.getcwd()}")
-        print(f"Model file exists: {os.path.exists(MODEL_PATH)}")
-        
-        # Load the model with TensorFlow
-        model = tf.keras.models.load_model(MODEL_PATH, compile=False)
-        
-        # Compile the model
-        if model is not None:
-            optimizer = tf.keras.optimizers.Adam(learning_rate=0.001)
-            model.compile(optimizer=optimizer, loss='categorical_crossentropy', metrics=['accuracy'])
-            
-            print(f"Model loaded successfully from {MODEL_PATH}")
-            
-            # Print model summary
-            if hasattr(model, 'summary'):
-                model.summary()
+        for scheduler in (inference_scheduler, embedding_scheduler):
+            scheduler.configure(max_batch_size=config["batch_max_size"], max_wait_ms=config["batch_max_wait_ms"])
     except Exception as e:
-        print(f"ERROR loading TensorFlow model: {e}")
+        print(f"ERROR applying auto-tuned batching: {e}")
         print(f"Traceback: {traceback.format_exc()}")
-        model = None
-        use_mock_model = False
-else:
-    print("TensorFlow not available, loading mock model...")
-    model = None
-
-# If no real model loaded, try mock model
-if model is None:
-    try:
-        from app.mock_model import load_mock_model
-        model = load_mock_model()
-        use_mock_model = True
-        print("SUCCESS: Mock model loaded for development/testing")
-        print("WARNING: This is not the real CNN model. Install TensorFlow for production use.")
-    except Exception as mock_error:
-        print(f"ERROR loading mock model: {mock_error}")
-        model = None
+        return
+    print(f"Batching: up to {config['batch_max_size']} images, {config['batch_max_wait_ms']} ms window (auto-tuned)")
+
+def schedule_tuning(config):
+    """Apply auto-tuned batching from any thread: on the event loop once it runs, else right away."""
+    if server_loop is None:
+        apply_tuning(config)
+    else:
+        server_loop.call_soon_threadsafe(apply_tuning, config)
+
+def on_model_ready(loader):
+    """Key cached predictions and reference embeddings by the weights that were actually loaded."""
+    if loader.tuning is not None:
+        schedule_tuning(loader.tuning["config"])
+    result_cache.model_version = MODEL_VERSION or loader.version
+    if phash_index is not None:
+        phash_index.model_version = MODEL_VERSION or loader.version
+    if loader.embedding_dim:
+        try:
+            reference_store.open(MODEL_VERSION or loader.version, loader.embedding_dim)
+        except Exception as e:
+            print(f"WARNING: reference embeddings unavailable: {e}")
+            print(f"Traceback: {traceback.format_exc()}")
+
+# The CNN model (or the mock model when the INFERENCE_BACKEND engine cannot load). In
+# background mode it loads on a thread started at app startup
+model_loader = ModelLoader(on_ready=on_model_ready)
+
+# Shared scheduler that batches model.predict calls across concurrent requests
+inference_scheduler = BatchScheduler(
+    model_loader,
+    executor=inference_pool,
+    concurrency=INFERENCE_WORKERS
+)
+
+# Batches requests for embeddings (reference enrollment, and verifications of
+# users with references, which get predictions from the same forward pass)
+embedding_scheduler = BatchScheduler(
+    Embedder(model_loader),
+    executor=inference_pool,
+    concurrency=INFERENCE_WORKERS
+)
+
+# Runs bulk verification jobs in the background, below interactive requests
+job_manager = JobManager(inference_scheduler, model_loader)
+
+# After the schedulers exist: loading applies auto-tuned batching to them
+if MODEL_LOAD_MODE == "eager":
+    model_loader.load()
+
+# Reusable input batches; the largest request carries 7 signatures
+input_arenas = preprocessing.ArenaPool(capacity=7)
+
+# Queues records and uploads for the background writer (see WRITE_BEHIND settings)
+persistence = WriteBehindQueue(signature_sets_db) if WRITE_BEHIND else None
+
+# Deletes expired uploads and records in the background (see RETENTION_* settings)
+retention_sweeper = RetentionSweeper(
+    signature_sets_db,
+    UPLOAD_DIR,
+    on_evict=phash_index.delete_records if phash_index is not None else None
+)
+
+# Images up to this size are hashed on the event loop; larger ones on the decode pool
+INLINE_HASH_LIMIT = 256 * 1024
+
+# Prediction row of an image the blank pre-check answered: no model outputs
+# (0, 0), so it stays recognisable through the result cache and duplicate index
+NO_SIGNATURE_ROW = np.zeros(2, dtype=np.float32)
+
+if PRECHECK:
+    metrics.PRECHECK_THRESHOLD.set(PRECHECK_MIN_CONTRAST, "contrast")
+    metrics.PRECHECK_THRESHOLD.set(PRECHECK_MIN_INK, "ink_density")
+    metrics.PRECHECK_THRESHOLD.set(PRECHECK_MIN_BBOX, "bbox_area")
+
+# Errors that already carry the right HTTP response and must not become a 500
+PASSTHROUGH_ERRORS = (HTTPException, ExecutorBusyError, ImageTooLargeError, ModelNotReadyError)
 
 # Pydantic models for request/response
+class DuplicateMatch(BaseModel):
+    record_id: str  # Signature set or verification the image was seen in
+    signature_index: int
+    distance: int  # Differing perceptual hash bits (0: byte-identical)
+
 class SignatureVerificationResult(BaseModel):
     filename: str
     is_authentic: bool
     confidence: float
+    no_signature: bool = False  # Blank or ink-free image, answered without the model
+    duplicate_of: Optional[DuplicateMatch] = None  # Earlier upload of the same image, if any
 
 class SignatureSetResult(BaseModel):
     id: str
@@ -107,6 +187,9 @@ class SignatureSetResponse(BaseModel):
     all_authentic: bool
     signature_count: int
 
+class StudentSignatureResult(SignatureVerificationResult):
+    reference_similarity: Optional[float] = None  # Closest enrolled reference, if the user has any
+
 class Base64SignatureRequest(BaseModel):
     signatures: List[str]  # Base64 encoded images
     user_id: str
@@ -114,68 +197,367 @@ class Base64SignatureRequest(BaseModel):
 
 class SignatureVerificationResponse(BaseModel):
     verification_id: str
-    results: List[SignatureVerificationResult]
+    results: List[StudentSignatureResult]
     all_authentic: bool
     flagged_indices: List[int]  # Indices of signatures that are flagged as forge
 
-def preprocess_image(image_bytes):
+class ReferenceEnrollment(BaseModel):
+    user_id: str
+    signature_type: str
+    reference_count: int
+    enrolled_at: str
+
+class VerificationSummary(BaseModel):
+    verification_id: str
+    user_id: str
+    signature_type: str
+    date_verified: str
+    all_authentic: bool
+    flagged_indices: List[int]
+    signature_count: int
+
+class VerificationPage(BaseModel):
+    items: List[VerificationSummary]
+    next_cursor: Optional[str]  # Pass back as `cursor` to get the next page
+
+async def preprocess_image(image_bytes, out):
     """
-    Preprocess the image for the CNN model using the approach from main.py.
+    Preprocess the image for the CNN model on the decode worker pool, writing
+    the tensor into `out` (a slot of a leased TensorArena). Returns the
+    image's perceptual hash and, when the blank pre-check finds no signature
+    in it, the reason (else None), both computed from the same decode.
     """
     try:
-        # Open image from bytes
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert PIL image to numpy array
-        cur_img = np.array(img)
-        
-        # Preprocess the image for the model
-        cur_img = cv2.cvtColor(cur_img, cv2.COLOR_BGR2RGB)
-        cur_img = cv2.resize(cur_img, (224, 224))
-        cur_img = cur_img.astype('float32') / 255.0
-        cur_img = cur_img.reshape((1, 224, 224, 3))
-        
-        return cur_img
+        if DECODE_USE_PROCESSES:
+            # Worker processes cannot write into our arena; copy their result in
+            tensor, phash, ink, decode_seconds, resize_seconds = await decode_executor.run(
+                preprocessing.preprocess_hashed, image_bytes, None, PRECHECK
+            )
+            out[...] = tensor
+        else:
+            _, phash, ink, decode_seconds, resize_seconds = await decode_executor.run(
+                preprocessing.preprocess_hashed, image_bytes, out, PRECHECK
+            )
+        metrics.observe_stage("image_decode", decode_seconds)
+        metrics.observe_stage("resize_normalize", resize_seconds)
+        return phash, None if ink is None else preprocessing.blank_reason(ink)
     
+    except (ExecutorBusyError, ImageTooLargeError):
+        raise
     except Exception as e:
         print(f"Error preprocessing image: {e}")
         print(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
 
-def preprocess_base64_image(base64_string):
+async def decode_base64_signature(base64_string):
     """
-    Preprocess a base64 encoded image for the CNN model.
+    Decode a base64 encoded signature to raw image bytes on the decode worker pool.
     """
     try:
-        # Remove data URL prefix if present
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        # Decode base64 to bytes
-        image_bytes = base64.b64decode(base64_string)
-        
-        # Use existing preprocess_image function
-        return preprocess_image(image_bytes)
+        image_bytes, seconds = await decode_executor.run(
+            metrics.timed_call, preprocessing.decode_base64_image, base64_string
+        )
+        metrics.observe_stage("base64_decode", seconds)
+        return image_bytes
     
+    except (ExecutorBusyError, ImageTooLargeError):
+        raise
     except Exception as e:
         print(f"Error preprocessing base64 image: {e}")
         print(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=400, detail=f"Error processing base64 image: {str(e)}")
 
+async def image_digests(images, digests=None):
+    """SHA-256 of each raw image. Digests already computed during upload ingest are reused."""
+    if digests is not None:
+        return list(digests)
+    
+    computed = []
+    for image_bytes in images:
+        if len(image_bytes) > INLINE_HASH_LIMIT:
+            computed.append(await decode_executor.run(image_digest, image_bytes))
+        else:
+            computed.append(image_digest(image_bytes))
+    return computed
+
+async def cache_keys(images, threshold, digests=None):
+    """
+    Result cache keys for raw image bytes (None for every image when caching
+    is off).
+    """
+    if not result_cache.enabled:
+        return [None] * len(images)
+    
+    digests = await image_digests(images, digests)
+    return [result_cache.make_key(digest, threshold) for digest in digests]
+
+async def screen_images(images, digests=None):
+    """
+    Look a request's images up in the perceptual hash index (byte-identical
+    replays right away, near duplicates once run_predictions has decoded
+    them). Returns a Screening to pass to run_predictions, or None when the
+    index is off.
+    """
+    if phash_index is None:
+        return None
+    screening = Screening(phash_index, await image_digests(images, digests))
+    await screen(screening.find_identical)
+    return screening
+
+async def screen(lookup):
+    """Run a Screening lookup on the I/O pool; when the pool is full, the images go unscreened."""
+    try:
+        await io_executor.run(lookup)
+    except ExecutorBusyError:
+        print("WARNING: I/O pool busy, skipping a perceptual hash index lookup")
+
+async def run_predictions(images, threshold=CONFIDENCE_THRESHOLD, digests=None, screening=None, embeddings=None):
+    """
+    Get the (N, 2) prediction matrix for a list of raw image bytes. Cached
+    results are reused, images already being predicted by another request are
+    shared, and only the rest are decoded and sent through the batch scheduler.
+    With a `screening`, byte-identical replays of an earlier upload reuse its
+    prediction instead of running the model, and the decoded images are
+    looked up for near duplicates (reported, not reused). Images the blank pre-check finds
+    empty get NO_SIGNATURE_ROW; a batch of only those never reaches the model.
+    With an `embeddings` dict, the images sent to the model also get their
+    embeddings from the same forward pass, stored in it by image index.
+    """
+    if screening is not None:
+        digests = screening.digests
+    keys = await cache_keys(images, threshold, digests)
+    
+    async def predict_missing(indices):
+        rows = np.empty((len(indices), 2), dtype=np.float32)
+        to_predict = []
+        with input_arenas.lease() as arena:
+            for row, i in enumerate(indices):
+                reused = screening.reusable(i) if screening is not None else None
+                if reused is None:
+                    # Decoded into the next free slot; a blank image leaves it free again
+                    phash, blank = await preprocess_image(images[i], arena.batch[len(to_predict)])
+                    if screening is not None:
+                        screening.hashed(i, phash)
+                    if blank is not None:
+                        metrics.PRECHECK_REJECTED.inc(blank)
+                        reused = NO_SIGNATURE_ROW
+                if reused is None:
+                    to_predict.append(row)
+                else:
+                    rows[row] = reused
+            if to_predict:
+                batch = arena.batch[:len(to_predict)]
+                with metrics.timed_stage("model_predict"):
+                    if embeddings is None:
+                        rows[to_predict] = await inference_scheduler.predict(batch)
+                    else:
+                        rows[to_predict], features = split_rows(await embedding_scheduler.predict(batch))
+                        for row, vector in zip(to_predict, features):
+                            embeddings[indices[row]] = vector
+        return rows
+    
+    predictions = await result_cache.resolve(keys, predict_missing)
+    if screening is not None:
+        await screen(screening.find_near)
+    return predictions
+
+def duplicate_matches(screening, count):
+    """The DuplicateMatch (or None) of each of `count` screened images."""
+    if screening is None:
+        return [None] * count
+    return [
+        None if match is None else DuplicateMatch(
+            record_id=match.record_id,
+            signature_index=match.position,
+            distance=match.distance
+        )
+        for match in screening.matches
+    ]
+
+async def index_images(screening, record_id, predictions):
+    """Add a stored record's images to the perceptual hash index."""
+    if screening is None:
+        return
+    try:
+        await io_executor.run(screening.record, record_id, predictions)
+    except ExecutorBusyError:
+        # The record is already stored; it just goes unindexed
+        print(f"WARNING: I/O pool busy, {record_id} not added to the perceptual hash index")
+
+async def embed_images(images):
+    """Get the (N, D) embedding matrix for a list of raw image bytes, batched across requests."""
+    with input_arenas.lease() as arena:
+        for slot, image_bytes in enumerate(images):
+            await preprocess_image(image_bytes, arena.batch[slot])
+        with metrics.timed_stage("embed"):
+            _, embeddings = split_rows(await embedding_scheduler.predict(arena.batch[:len(images)]))
+            return embeddings
+
+async def has_references(user_id, signature_type):
+    """Whether the user has enrolled references (on the I/O pool: the lookup may replay the index log)."""
+    return await io_executor.run(reference_store.block, user_id, signature_type) is not None
+
+async def reference_similarity(images, user_id, signature_type, embeddings):
+    """
+    Each image's cosine similarity to the closest enrolled reference of the
+    user, or None when the user has none. `embeddings` ({index: vector}) are
+    those run_predictions already produced; only the other images (cached or
+    duplicate predictions) are embedded here.
+    """
+    missing = [i for i in range(len(images)) if i not in embeddings]
+    if missing:
+        embeddings.update(zip(missing, await embed_images([images[i] for i in missing])))
+    matrix = np.stack([embeddings[i] for i in range(len(images))])
+    with metrics.timed_stage("reference_match"):
+        return await io_executor.run(reference_store.similarity, user_id, signature_type, matrix)
+
+async def persist_record(item_id, item_data, files=None):
+    """
+    Store a record and its files ({path: contents}): queued for the background
+    writer, or written before returning when write-behind is off.
+    """
+    with metrics.timed_stage("db_persist"):
+        if persistence is not None:
+            persistence.create(item_id, item_data, files)
+            return
+        await io_executor.run(signature_sets_db.create, item_id, item_data)
+
+def get_record(item_id):
+    """Get a record, including one still queued for writing."""
+    if persistence is not None:
+        return persistence.get(item_id)
+    return signature_sets_db.get(item_id)
+
+def delete_record(item_id):
+    """Delete a record, including one still queued (runs on the I/O worker pool)."""
+    if phash_index is not None:
+        phash_index.delete_records([item_id])
+    if persistence is not None:
+        return persistence.delete(item_id)
+    return signature_sets_db.delete(item_id)
+
+def delete_signature_set_files(set_id):
+    """Remove the uploaded files of a signature set (runs on the I/O worker pool)."""
+    set_dir = os.path.join(UPLOAD_DIR, set_id)
+    if persistence is not None:
+        persistence.discard_files(set_dir)
+    if os.path.exists(set_dir):
+        shutil.rmtree(set_dir)
+
+@app.exception_handler(ExecutorBusyError)
+async def executor_busy_handler(request: Request, exc: ExecutorBusyError):
+    """Shed load quickly when a worker queue is full."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(ImageTooLargeError)
+async def image_too_large_handler(request: Request, exc: ImageTooLargeError):
+    """Reject oversized uploads before they are decoded."""
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
+
+def check_upload_size(file: UploadFile):
+    """Reject an uploaded file over MAX_IMAGE_BYTES without reading it."""
+    size = getattr(file, "size", None)
+    if size is not None and size > MAX_IMAGE_BYTES:
+        raise ImageTooLargeError(
+            f"{file.filename or 'Image'} is {size} bytes; the limit is {MAX_IMAGE_BYTES} bytes"
+        )
+
+def require_model():
+    """Refuse a prediction request until the model has finished loading."""
+    if model_loader.failed:
+        raise HTTPException(
+            status_code=500, 
+            detail="Model not loaded. Please check server logs for details."
+        )
+    if not model_loader.ready:
+        raise ModelNotReadyError(model_loader.state)
+
+@app.exception_handler(ModelNotReadyError)
+async def model_not_ready_handler(request: Request, exc: ModelNotReadyError):
+    """Ask clients to retry while the model is still loading."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.on_event("startup")
+async def start_model_loading():
+    """Load and warm up the model in the background so startup is not blocked."""
+    global server_loop
+    server_loop = asyncio.get_running_loop()
+    model_loader.start()
+
+@app.on_event("startup")
+async def start_retention():
+    """Start the retention sweeper if any retention limit is configured."""
+    retention_sweeper.start()
+
+@app.on_event("startup")
+async def start_jobs():
+    """Start the bulk job runner, resuming jobs a restart interrupted."""
+    job_manager.start()
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    """Drain pending writes and stop the worker pools."""
+    await job_manager.stop()
+    retention_sweeper.stop()
+    shutdown_executors()
+    if persistence is not None:
+        persistence.close()
+    signature_sets_db.close()
+
+def no_signature_rows(predictions):
+    """Which rows of an (N, 2) prediction matrix are NO_SIGNATURE_ROW (blank images)."""
+    return ~np.asarray(predictions).any(axis=1)
+
+def score_predictions(predictions, threshold=CONFIDENCE_THRESHOLD, similarity=None):
+    """
+    Apply the authenticity threshold to an (N, 2) prediction matrix.
+    Returns (is_authentic, confidence) arrays of length N, where confidence is
+    the real-signature score for authentic rows and its complement otherwise.
+    With `similarity` to the user's references, rows below
+    REFERENCE_MIN_SIMILARITY are flagged as well (confidence stays the model's).
+    Blank images come out not authentic with confidence 1.
+    """
+    # Index 0 is the confidence for a real signature
+    real_confidence = np.asarray(predictions)[:, 0].astype(np.float64)
+    is_authentic = real_confidence >= threshold
+    confidence = np.where(is_authentic, real_confidence, 1.0 - real_confidence)
+    if similarity is not None and REFERENCE_MIN_SIMILARITY > 0:
+        is_authentic &= similarity >= REFERENCE_MIN_SIMILARITY
+    authentic_count = int(np.count_nonzero(is_authentic))
+    blank_count = int(np.count_nonzero(no_signature_rows(predictions)))
+    metrics.count_verdicts(authentic_count, len(is_authentic) - authentic_count - blank_count, blank_count)
+    return is_authentic, confidence
+
 @app.get("/")
 async def root():
     """Health check endpoint for Railway deployment."""
     try:
-        if model is None:
+        if model_loader.failed:
             return {
                 "message": "Signature Verification API is running",
                 "model_status": "NOT LOADED - Check server logs",
                 "model_path": MODEL_PATH,
                 "model_exists": os.path.exists(MODEL_PATH),
-                "error": "No model available",
+                "error": model_loader.error or "No model available",
                 "status": "unhealthy"
             }
         
+        if not model_loader.ready:
+            return {
+                "message": "Signature Verification API is running",
+                "model_status": f"Loading ({model_loader.state})",
+                "status": "starting"
+            }
+        
+        use_mock_model = model_loader.is_mock
         model_type = "Mock CNN Model (Development)" if use_mock_model else "Real CNN Signature Verification Model"
         
         return {
@@ -199,42 +581,144 @@ async def health_check():
     """Simple health check endpoint for Railway."""
     return {"status": "healthy", "message": "Service is running"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 before."""
+    status_code = 200 if model_loader.ready else 503
+    return JSONResponse(status_code=status_code, content=model_loader.status())
+
+@app.get("/reference-stats")
+async def reference_stats():
+    """Enrolled users and the size of the reference embedding store."""
+    return reference_store.stats()
+
+@app.get("/phash-stats")
+async def phash_stats():
+    """Images in the perceptual hash index and how often uploads matched one."""
+    if phash_index is None:
+        return {"enabled": False}
+    return {"enabled": True, **phash_index.stats()}
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """Prediction cache size and hit/miss counters."""
+    return result_cache.stats()
+
+@app.get("/worker-memory")
+async def worker_memory():
+    """Memory of the worker serving this request, split into shared and private bytes."""
+    pid = os.getpid()
+    return {"pid": pid, "parent_pid": os.getppid(), **memory_usage(pid)}
+
+@app.get("/persistence-stats")
+async def persistence_stats():
+    """Write-behind queue depth and flush counters."""
+    if persistence is None:
+        return {"enabled": False}
+    return {"enabled": True, "pending": persistence.pending, **persistence.stats}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Latency histograms, queue depths and verdict counts in the Prometheus text format."""
+    metrics.QUEUE_DEPTH.set(inference_scheduler.queued, "inference")
+    metrics.QUEUE_DEPTH.set(inference_scheduler.background_queued, "inference_background")
+    metrics.QUEUE_DEPTH.set(embedding_scheduler.queued, "embedding")
+    metrics.QUEUE_DEPTH.set(decode_executor.pending, "decode")
+    metrics.QUEUE_DEPTH.set(io_executor.pending, "io")
+    metrics.QUEUE_DEPTH.set(persistence.pending if persistence is not None else 0, "persistence")
+    
+    status = model_loader.status()
+    metrics.MODEL_INFO.clear()
+    metrics.MODEL_INFO.set(
+        1,
+        status["backend"],
+        status["model_version"] or "",
+        status["state"],
+        str(status["is_mock"]).lower()
+    )
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+class ProfilingSettings(BaseModel):
+    sample_rate: float
+
+def require_profile_token(request: Request):
+    """Profiling endpoints need the X-Profile-Token header, and are off without PROFILE_TOKEN."""
+    if not profiling.profiler.token:
+        raise HTTPException(status_code=501, detail="Profiling is disabled (PROFILE_TOKEN is not set)")
+    if not profiling.profiler.check_token(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+@app.get("/profiling", dependencies=[Depends(require_profile_token)])
+async def profiling_status():
+    """Profiling settings and counters, and the profiles saved by this worker."""
+    profiles = await io_executor.run(profiling.profiler.list)
+    return {**profiling.profiler.stats(), "profiles": profiles}
+
+@app.put("/profiling", dependencies=[Depends(require_profile_token)])
+async def update_profiling(settings: ProfilingSettings):
+    """Set the share of all requests that are profiled (this worker only; 0 turns sampling off)."""
+    if not 0 <= settings.sample_rate <= 1:
+        raise HTTPException(status_code=400, detail="sample_rate must be between 0 and 1")
+    profiling.profiler.sample_rate = settings.sample_rate
+    return profiling.profiler.stats()
+
+@app.get("/profiling/{profile_id}", dependencies=[Depends(require_profile_token)])
+async def get_profile(profile_id: str):
+    """Download a saved profile (collapsed stacks or speedscope JSON)."""
+    path = await io_executor.run(profiling.profiler.find, profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=path.name)
+
+@app.get("/autotune")
+async def autotune_status():
+    """The auto-tuned config in use and the latest calibration."""
+    return {
+        **autotuner.status(),
+        "batch_max_size": inference_scheduler.max_batch_size,
+        "batch_max_wait_ms": round(inference_scheduler.max_wait * 1000, 3),
+    }
+
+@app.post("/autotune", status_code=202)
+async def start_autotune():
+    """Re-calibrate in the background; the batch size and window apply when done, threads at the next start."""
+    require_model()
+    started = autotuner.start(lambda result: schedule_tuning(result["config"]))
+    if not started:
+        raise HTTPException(status_code=409, detail="A calibration is already running")
+    return autotuner.status()
+
+@app.get("/retention-stats")
+async def retention_stats():
+    """Retention policies and what the sweeper has reclaimed so far."""
+    return retention_sweeper.stats()
+
 @app.post("/verify-signature", response_model=SignatureVerificationResult)
 async def verify_single_signature(file: UploadFile = File(...)):
     """Verify a single signature image."""
-    if not model:
-        raise HTTPException(
-            status_code=500, 
-            detail="Model not loaded. Please check server logs for details."
-        )
+    require_model()
     
-    # Read file content
-    contents = await file.read()
-    
-    # Preprocess the image
-    img_array = preprocess_image(contents)
+    # Read file content and hash it in one pass
+    check_upload_size(file)
+    upload = await io_executor.run(ingest_upload, file.file, file.filename or "unknown")
     
     # Make prediction
     try:
-        prediction = model.predict(img_array)
-        
-        # Get the index of the maximum value
-        a = np.argmax(prediction, axis=1)
-        
-        # Get confidence percentage for real signature (assuming index 0 is real)
-        real_confidence = float(prediction[0][0])
+        screening = await screen_images([upload.data], [upload.digest])
+        prediction = await run_predictions([upload.data], digests=[upload.digest], screening=screening)
         
         # Apply threshold - if confidence for real signature is >= CONFIDENCE_THRESHOLD, mark as authentic
-        is_authentic = real_confidence >= CONFIDENCE_THRESHOLD
-        
-        # Use the confidence for the predicted class
-        confidence = real_confidence if is_authentic else (1.0 - real_confidence)
+        is_authentic, confidence = score_predictions(prediction)
         
         return SignatureVerificationResult(
             filename=file.filename or "unknown",
-            is_authentic=is_authentic,
-            confidence=confidence
+            is_authentic=bool(is_authentic[0]),
+            confidence=float(confidence[0]),
+            no_signature=bool(no_signature_rows(prediction)[0]),
+            duplicate_of=duplicate_matches(screening, 1)[0]
         )
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error during prediction: {e}")
         print(f"Traceback: {traceback.format_exc()}")
@@ -243,64 +727,67 @@ async def verify_single_signature(file: UploadFile = File(...)):
 @app.post("/verify-signature-set", response_model=SignatureSetResult)
 async def verify_signature_set(files: List[UploadFile] = File(...)):
     """Verify a set of signatures (7 required)."""
-    if not model:
-        raise HTTPException(
-            status_code=500, 
-            detail="Model not loaded. Please check server logs for details."
-        )
+    require_model()
     
     if len(files) != 7:
         raise HTTPException(status_code=400, detail="Exactly 7 signature files are required")
     
+    for file in files:
+        check_upload_size(file)
+    
     set_id = str(uuid.uuid4())
-    set_dir = os.path.join(UPLOAD_DIR, set_id)
-    os.makedirs(set_dir, exist_ok=True)
+    set_dir = os.path.join(UPLOAD_DIR, set_id) if PERSIST_UPLOADS else None
+    # With write-behind, files are queued with the record instead of written during ingest
+    ingest_dir = set_dir if persistence is None else None
+    if ingest_dir:
+        await io_executor.run(functools.partial(os.makedirs, ingest_dir, exist_ok=True))
     
-    results = []
-    all_authentic = True
+    filenames = [safe_filename(file.filename, f"file-{uuid.uuid4()}.jpg") for file in files]
+    # Files are ingested concurrently, so repeated names get distinct paths on disk
+    disk_names = [
+        name if name not in filenames[:i] else f"{i}_{name}"
+        for i, name in enumerate(filenames)
+    ]
     
-    for file in files:
-        # Read file content
-        contents = await file.read()
-        
-        # Save file
-        file_path = os.path.join(set_dir, file.filename or f"file-{uuid.uuid4()}.jpg")
-        with open(file_path, "wb") as f:
-            # Reset file pointer to beginning
-            await file.seek(0)
-            # Write file content
-            shutil.copyfileobj(file.file, f)
-        
-        # Preprocess the image
-        img_array = preprocess_image(contents)
-        
-        try:
-            # Make prediction
-            prediction = model.predict(img_array)
-            
-            # Get confidence percentage for real signature (assuming index 0 is real)
-            real_confidence = float(prediction[0][0])
-            
-            # Apply threshold - if confidence for real signature is >= CONFIDENCE_THRESHOLD, mark as authentic
-            is_authentic = real_confidence >= CONFIDENCE_THRESHOLD
-            
-            # Use the confidence for the predicted class
-            confidence = real_confidence if is_authentic else (1.0 - real_confidence)
-            
-            if not is_authentic:
-                all_authentic = False
-            
-            results.append(
-                SignatureVerificationResult(
-                    filename=file.filename or f"file-{uuid.uuid4()}.jpg",
-                    is_authentic=is_authentic,
-                    confidence=confidence
-                )
-            )
-        except Exception as e:
-            print(f"Error during prediction for file {file.filename}: {e}")
-            print(f"Traceback: {traceback.format_exc()}")
-            raise HTTPException(status_code=500, detail=f"Error during prediction: {str(e)}")
+    # Each file is read once: saved (if persisting), hashed and buffered for decoding
+    uploads = await asyncio.gather(*[
+        io_executor.run(ingest_upload, file.file, disk_name, ingest_dir)
+        for file, disk_name in zip(files, disk_names)
+    ], return_exceptions=True)
+    errors = [upload for upload in uploads if isinstance(upload, BaseException)]
+    if errors:
+        # Every ingest has finished, so the partial set can be removed safely
+        if ingest_dir:
+            await io_executor.run(delete_signature_set_files, set_id)
+        raise errors[0]
+    
+    try:
+        # Score the whole set with one forward pass
+        images = [upload.data for upload in uploads]
+        screening = await screen_images(images, [upload.digest for upload in uploads])
+        predictions = await run_predictions(images, digests=[upload.digest for upload in uploads], screening=screening)
+        is_authentic, confidence = score_predictions(predictions)
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error during prediction for signature set {set_id}: {e}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error during prediction: {str(e)}")
+    
+    results = [
+        SignatureVerificationResult(
+            filename=filename,
+            is_authentic=bool(authentic),
+            confidence=float(conf),
+            no_signature=bool(blank),
+            duplicate_of=duplicate
+        )
+        for filename, authentic, conf, blank, duplicate in zip(
+            filenames, is_authentic, confidence, no_signature_rows(predictions),
+            duplicate_matches(screening, len(filenames))
+        )
+    ]
+    all_authentic = bool(is_authentic.all())
     
     # Save the results
     signature_set = SignatureSetResult(
@@ -311,14 +798,62 @@ async def verify_signature_set(files: List[UploadFile] = File(...)):
     )
     
     # Save to our database
-    signature_sets_db.create(set_id, signature_set.dict())
+    set_files = None
+    if set_dir and persistence is not None:
+        set_files = {os.path.join(set_dir, upload.filename): upload.data for upload in uploads}
+    await persist_record(set_id, signature_set.dict(), set_files)
+    await index_images(screening, set_id, predictions)
     
     return signature_set
 
+def page_limit(limit: Optional[int]) -> int:
+    """Clamp a requested page size to LIST_MAX_PAGE_SIZE."""
+    if limit is None:
+        return LIST_PAGE_SIZE
+    return max(1, min(limit, LIST_MAX_PAGE_SIZE))
+
+def parse_date_param(value: Optional[str]) -> Optional[str]:
+    """Normalize an ISO date or datetime query parameter to the stored timestamp format."""
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+    if parsed.tzinfo is not None:
+        # Stored timestamps are naive local time
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+async def query_records(**filters):
+    """Run a listing query on the I/O pool, turning a bad cursor into a 400."""
+    try:
+        source = persistence if persistence is not None else signature_sets_db
+        return await io_executor.run(functools.partial(source.query, **filters))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/signature-sets", response_model=List[SignatureSetResponse])
-async def get_signature_sets():
-    """Get all signature sets."""
-    all_sets = signature_sets_db.get_all()
+async def get_signature_sets(
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+):
+    """
+    Get signature sets, newest first. Returns one page; when more remain, the
+    cursor for the next page is sent in the X-Next-Cursor header.
+    """
+    page, next_cursor = await query_records(
+        kind=KIND_SIGNATURE_SET,
+        date_from=parse_date_param(date_from),
+        date_to=parse_date_param(date_to),
+        cursor=cursor,
+        limit=page_limit(limit)
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     return [
         SignatureSetResponse(
@@ -327,13 +862,52 @@ async def get_signature_sets():
             all_authentic=set_data["all_authentic"],
             signature_count=len(set_data["signatures"])
         )
-        for set_id, set_data in all_sets.items()
+        for set_id, set_data in page
     ]
 
+@app.get("/verifications", response_model=VerificationPage)
+async def get_verifications(
+    user_id: Optional[str] = None,
+    signature_type: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+):
+    """
+    Get student portal verifications, newest first, optionally filtered by
+    user, signature type and date range (date_from inclusive, date_to exclusive).
+    """
+    page, next_cursor = await query_records(
+        kind=KIND_VERIFICATION,
+        user_id=user_id,
+        signature_type=signature_type,
+        date_from=parse_date_param(date_from),
+        date_to=parse_date_param(date_to),
+        cursor=cursor,
+        limit=page_limit(limit)
+    )
+    
+    return VerificationPage(
+        items=[
+            VerificationSummary(
+                verification_id=data.get("verification_id", item_id),
+                user_id=data.get("user_id", ""),
+                signature_type=data.get("signature_type", ""),
+                date_verified=data.get("date_verified", ""),
+                all_authentic=data.get("all_authentic", False),
+                flagged_indices=data.get("flagged_indices", []),
+                signature_count=len(data.get("results", []))
+            )
+            for item_id, data in page
+        ],
+        next_cursor=next_cursor
+    )
+
 @app.get("/signature-set/{set_id}", response_model=SignatureSetResult)
 async def get_signature_set(set_id: str):
     """Get details of a specific signature set."""
-    set_data = signature_sets_db.get(set_id)
+    set_data = get_record(set_id)
     if not set_data:
         raise HTTPException(status_code=404, detail="Signature set not found")
     
@@ -342,76 +916,65 @@ async def get_signature_set(set_id: str):
 @app.delete("/signature-set/{set_id}")
 async def delete_signature_set(set_id: str):
     """Delete a signature set."""
-    set_data = signature_sets_db.get(set_id)
+    set_data = get_record(set_id)
     if not set_data:
         raise HTTPException(status_code=404, detail="Signature set not found")
     
     # Remove from database
-    signature_sets_db.delete(set_id)
+    await io_executor.run(delete_record, set_id)
     
     # Remove files
-    set_dir = os.path.join(UPLOAD_DIR, set_id)
-    if os.path.exists(set_dir):
-        shutil.rmtree(set_dir)
+    await io_executor.run(delete_signature_set_files, set_id)
     
     return {"message": "Signature set deleted successfully"}
 
-@app.post("/verify-student-signatures", response_model=SignatureVerificationResponse)
-async def verify_student_signatures(request: Base64SignatureRequest):
-    """
-    Verify signatures from the student portal.
-    This endpoint accepts base64 encoded signatures and returns verification results.
-    """
-    if not model:
-        raise HTTPException(
-            status_code=500, 
-            detail="Model not loaded. Please check server logs for details."
-        )
-    
-    if len(request.signatures) == 0:
+def check_signature_count(count):
+    """The student portal sends between 1 and 7 signatures per request."""
+    if count == 0:
         raise HTTPException(status_code=400, detail="At least one signature is required")
     
-    if len(request.signatures) > 7:
+    if count > 7:
         raise HTTPException(status_code=400, detail="Maximum 7 signatures allowed")
-    
+
+async def verify_student_images(image_bytes, user_id, signature_type, digests=None):
+    """
+    Verify and record the decoded signatures of a student portal request,
+    however they were sent.
+    """
     verification_id = str(uuid.uuid4())
-    results = []
-    flagged_indices = []
-    all_authentic = True
     
-    for i, base64_signature in enumerate(request.signatures):
-        try:
-            # Preprocess the base64 image
-            img_array = preprocess_base64_image(base64_signature)
-            
-            # Make prediction
-            prediction = model.predict(img_array)
-            
-            # Get confidence percentage for real signature (assuming index 0 is real)
-            real_confidence = float(prediction[0][0])
-            
-            # Apply threshold - if confidence for real signature is >= CONFIDENCE_THRESHOLD, mark as authentic
-            is_authentic = real_confidence >= CONFIDENCE_THRESHOLD
-            
-            # Use the confidence for the predicted class
-            confidence = real_confidence if is_authentic else (1.0 - real_confidence)
-            
-            if not is_authentic:
-                all_authentic = False
-                flagged_indices.append(i)
-            
-            results.append(
-                SignatureVerificationResult(
-                    filename=f"signature_{i+1}",
-                    is_authentic=is_authentic,
-                    confidence=confidence
-                )
-            )
-            
-        except Exception as e:
-            print(f"Error during prediction for signature {i+1}: {e}")
-            print(f"Traceback: {traceback.format_exc()}")
-            raise HTTPException(status_code=500, detail=f"Error during prediction for signature {i+1}: {str(e)}")
+    try:
+        # Score every signature with one forward pass; for a user with enrolled
+        # references the same pass yields the embeddings to compare with them
+        screening = await screen_images(image_bytes, digests)
+        embeddings = {} if await has_references(user_id, signature_type) else None
+        predictions = await run_predictions(image_bytes, digests=digests, screening=screening, embeddings=embeddings)
+        similarity = None
+        if embeddings is not None:
+            similarity = await reference_similarity(image_bytes, user_id, signature_type, embeddings)
+        is_authentic, confidence = score_predictions(predictions, similarity=similarity)
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error during prediction for verification {verification_id}: {e}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error during prediction: {str(e)}")
+    
+    results = [
+        StudentSignatureResult(
+            filename=f"signature_{i+1}",
+            is_authentic=bool(authentic),
+            confidence=float(conf),
+            no_signature=bool(blank),
+            duplicate_of=duplicate,
+            reference_similarity=None if similarity is None else float(similarity[i])
+        )
+        for i, (authentic, conf, blank, duplicate) in enumerate(
+            zip(is_authentic, confidence, no_signature_rows(predictions), duplicate_matches(screening, len(image_bytes)))
+        )
+    ]
+    flagged_indices = np.flatnonzero(~is_authentic).tolist()
+    all_authentic = not flagged_indices
     
     # Create verification response
     verification_response = SignatureVerificationResponse(
@@ -423,8 +986,8 @@ async def verify_student_signatures(request: Base64SignatureRequest):
     
     # Store the verification result for potential future reference
     verification_data = {
-        "user_id": request.user_id,
-        "signature_type": request.signature_type,
+        "user_id": user_id,
+        "signature_type": signature_type,
         "verification_id": verification_id,
         "date_verified": datetime.now().isoformat(),
         "results": [result.dict() for result in results],
@@ -433,20 +996,171 @@ async def verify_student_signatures(request: Base64SignatureRequest):
     }
     
     # Save to our database
-    signature_sets_db.create(f"verification_{verification_id}", verification_data)
+    await persist_record(f"verification_{verification_id}", verification_data)
+    await index_images(screening, f"verification_{verification_id}", predictions)
     
     return verification_response
 
+async def ingest_signature_files(files):
+    """Read uploaded signature files (raw image parts) into memory, hashing them on the way."""
+    for file in files:
+        check_upload_size(file)
+    
+    return await asyncio.gather(*[
+        io_executor.run(ingest_upload, file.file, safe_filename(file.filename, f"signature_{i+1}"))
+        for i, file in enumerate(files)
+    ])
+
+@app.post("/verify-student-signatures", response_model=SignatureVerificationResponse)
+async def verify_student_signatures(request: Base64SignatureRequest):
+    """
+    Verify signatures from the student portal.
+    This endpoint accepts base64 encoded signatures and returns verification results.
+    """
+    require_model()
+    check_signature_count(len(request.signatures))
+    
+    image_bytes = []
+    
+    for i, base64_signature in enumerate(request.signatures):
+        try:
+            # Decode the base64 image
+            image_bytes.append(await decode_base64_signature(base64_signature))
+        except (ExecutorBusyError, ImageTooLargeError):
+            raise
+        except Exception as e:
+            print(f"Error during prediction for signature {i+1}: {e}")
+            print(f"Traceback: {traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail=f"Error during prediction for signature {i+1}: {str(e)}")
+    
+    return await verify_student_images(image_bytes, request.user_id, request.signature_type)
+
+@app.post("/verify-student-signatures/upload", response_model=SignatureVerificationResponse)
+async def verify_student_signature_files(
+    signatures: List[UploadFile] = File(...),
+    user_id: str = Form(...),
+    signature_type: str = Form(...)
+):
+    """
+    Verify signatures from the student portal sent as raw image parts of a
+    multipart form instead of base64 JSON. Results are the same as
+    /verify-student-signatures; the payload is a quarter smaller and needs no
+    JSON parsing or base64 decoding.
+    """
+    require_model()
+    check_signature_count(len(signatures))
+    
+    uploads = await ingest_signature_files(signatures)
+    return await verify_student_images(
+        [upload.data for upload in uploads],
+        user_id,
+        signature_type,
+        digests=[upload.digest for upload in uploads]
+    )
+
+
+def require_reference_store():
+    """Refuse reference requests when the loaded model produces no embeddings."""
+    require_model()
+    if not reference_store.is_open:
+        raise HTTPException(status_code=501, detail="The loaded model does not produce embeddings")
+
+async def enroll_references(image_bytes, user_id, signature_type):
+    """Embed a user's reference signatures once and store them, replacing earlier ones."""
+    embeddings = await embed_images(image_bytes)
+    block = await io_executor.run(reference_store.enroll, user_id, signature_type, embeddings)
+    return ReferenceEnrollment(
+        user_id=user_id,
+        signature_type=signature_type,
+        reference_count=block.count,
+        enrolled_at=block.enrolled_at
+    )
+
+@app.post("/references", response_model=ReferenceEnrollment)
+async def enroll_reference_signatures(request: Base64SignatureRequest):
+    """
+    Enroll a user's reference signatures, base64 encoded as for
+    /verify-student-signatures. Later verifications for the same user and
+    signature type report each signature's similarity to them.
+    """
+    require_reference_store()
+    check_signature_count(len(request.signatures))
+    
+    image_bytes = [await decode_base64_signature(signature) for signature in request.signatures]
+    return await enroll_references(image_bytes, request.user_id, request.signature_type)
+
+@app.post("/references/upload", response_model=ReferenceEnrollment)
+async def enroll_reference_signature_files(
+    signatures: List[UploadFile] = File(...),
+    user_id: str = Form(...),
+    signature_type: str = Form(...)
+):
+    """Enroll a user's reference signatures sent as raw multipart image parts."""
+    require_reference_store()
+    check_signature_count(len(signatures))
+    
+    uploads = await ingest_signature_files(signatures)
+    return await enroll_references([upload.data for upload in uploads], user_id, signature_type)
+
+@app.get("/references/{user_id}", response_model=ReferenceEnrollment)
+async def get_references(user_id: str, signature_type: str = "student"):
+    """How many reference signatures a user has enrolled, and when."""
+    block = await io_executor.run(reference_store.block, user_id, signature_type)
+    if block is None:
+        raise HTTPException(status_code=404, detail="No reference signatures enrolled")
+    
+    return ReferenceEnrollment(
+        user_id=user_id,
+        signature_type=signature_type,
+        reference_count=block.count,
+        enrolled_at=block.enrolled_at
+    )
+
+@app.delete("/references/{user_id}")
+async def delete_references(user_id: str, signature_type: str = "student"):
+    """Forget a user's reference signatures."""
+    if not await io_executor.run(reference_store.delete, user_id, signature_type):
+        raise HTTPException(status_code=404, detail="No reference signatures enrolled")
+    
+    return {"message": "Reference signatures deleted"}
+
 
 class SingleSignatureRequest(BaseModel):
     signature: str
     threshold: float = 0.9
 
+async def verify_single_image(image_bytes, threshold, digest=None):
+    """Score one decoded signature against a caller-chosen threshold."""
+    # Get prediction from model
+    prediction = await run_predictions([image_bytes], threshold, None if digest is None else [digest])
+    
+    # Extract confidence (assuming index 0 is authentic, index 1 is forge)
+    authentic_confidence = float(prediction[0][0])
+    forge_confidence = float(prediction[0][1])
+    
+    # Determine if authentic based on threshold
+    is_authentic = authentic_confidence >= threshold
+    no_signature = bool(no_signature_rows(prediction)[0])
+    metrics.count_verdicts(int(is_authentic), int(not is_authentic and not no_signature), int(no_signature))
+    
+    result = {
+        "is_authentic": is_authentic,
+        "no_signature": no_signature,
+        "confidence": authentic_confidence,
+        "threshold_used": threshold,
+        "authentic_confidence": authentic_confidence,
+        "forge_confidence": forge_confidence
+    }
+    
+    return result
+
 @app.post("/verify-single-signature")
 async def verify_single_signature(request: SingleSignatureRequest):
     """
     Verify a single signature with a specified threshold
     """
+    require_model()
+    
     try:
         signature_data = request.signature
         threshold = request.threshold
@@ -456,31 +1170,76 @@ async def verify_single_signature(request: SingleSignatureRequest):
         
         print(f"🔍 Verifying single signature with {threshold*100}% threshold...")
         
-        # Preprocess the signature
-        img_array = preprocess_base64_image(signature_data)
-        
-        # Get prediction from model
-        prediction = model.predict(img_array)
+        # Decode the signature
+        image_bytes = await decode_base64_signature(signature_data)
         
-        # Extract confidence (assuming index 0 is authentic, index 1 is forge)
-        authentic_confidence = float(prediction[0][0])
-        forge_confidence = float(prediction[0][1])
+        return await verify_single_image(image_bytes, threshold)
         
-        # Determine if authentic based on threshold
-        is_authentic = authentic_confidence >= threshold
-        
-        result = {
-            "is_authentic": is_authentic,
-            "confidence": authentic_confidence,
-            "threshold_used": threshold,
-            "authentic_confidence": authentic_confidence,
-            "forge_confidence": forge_confidence
-        }
-        
-        print(f"✅ Single signature verification result: {result}")
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        print(f"❌ Error in single signature verification: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Verification failed: {str(e)}") 
+
+@app.post("/verify-single-signature/upload")
+async def verify_single_signature_file(signature: UploadFile = File(...), threshold: float = Form(0.9)):
+    """
+    Verify a single signature sent as a raw multipart image part instead of
+    base64 JSON; results are the same as /verify-single-signature.
+    """
+    require_model()
+    
+    try:
+        print(f"🔍 Verifying single signature with {threshold*100}% threshold...")
         
-        return result
+        upload, = await ingest_signature_files([signature])
+        return await verify_single_image(upload.data, threshold, upload.digest)
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"❌ Error in single signature verification: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Verification failed: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Verification failed: {str(e)}")
+
+@app.post("/jobs", status_code=202)
+async def create_job(file: UploadFile = File(...), threshold: float = Form(CONFIDENCE_THRESHOLD)):
+    """
+    Submit a JSONL or zip archive of signatures for background verification.
+    Poll GET /jobs/{job_id} for progress and page through GET /jobs/{job_id}/results.
+    """
+    try:
+        job = await io_executor.run(job_manager.create, file.file, file.filename or "archive", threshold)
+    except JobUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job_manager.submit(job["job_id"])
+    return public_view(job)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Progress of a bulk verification job."""
+    job = await io_executor.run(job_manager.status, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str, cursor: Optional[str] = None, limit: Optional[int] = None):
+    """
+    Results of a bulk verification job, in archive order, as they are produced.
+    Pass next_cursor back as `cursor`; it is null once the job has finished and
+    every result has been read.
+    """
+    try:
+        page = await io_executor.run(job_manager.results, job_id, cursor, page_limit(limit))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return page
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Cancel a bulk verification job and delete its archive and results."""
+    if not await io_executor.run(job_manager.delete, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"message": "Job deleted successfully"}
@@ -0,0 +1,375 @@
+"""
+In-process request metrics, served in the Prometheus text format at GET /metrics.
+
+Nothing external is needed: counters and histograms live in this process and
+are rendered on each scrape. Recording one value is a bucket lookup and a few
+integer additions under an uncontended lock, so it can sit on the hot path.
+
+Per-request stage timings (signature_stage_seconds) are labelled by endpoint,
+which is only known once routing is done. MetricsMiddleware therefore gives
+every request a RequestMetrics holder (through a context variable); stage
+timings and verdicts recorded while the request runs are buffered there and
+published with the route template (e.g. /signature-set/{set_id}) when the
+request finishes. Values recorded outside a request use endpoint="none".
+
+Stages:
+- base64_decode, image_decode, resize_normalize: time spent doing the work on
+  the decode pool
+- model_predict: time a request waits for its predictions, including batching
+  (the model call alone is signature_model_predict_seconds, per batch)
+- embed: time a request waits for embeddings of its signatures (reference
+  enrollment, and signatures of users with references whose predictions were
+  cached; the others get embeddings from their model_predict pass)
+- reference_match: scoring those embeddings against the user's references
+- db_persist: time to store the record (just queueing it when WRITE_BEHIND is
+  on; the background write is signature_persist_flush_seconds)
+
+Each process keeps its own metrics; with SERVE_MODE=prefork a scrape is
+answered by whichever worker accepts it.
+"""
+
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; covers sub-millisecond decodes up to slow cold-start requests
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+# Images per model call; 1 and 7 are a single upload and a signature set
+BATCH_SIZE_BUCKETS = (1, 2, 4, 7, 8, 14, 16, 32, 64)
+
+# The response adds "; charset=utf-8"
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _check(self, labelvalues: Tuple[str, ...]) -> None:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labelvalues}")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return lines + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A value that only goes up"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            try:
+                self._values[labelvalues] += amount
+            except KeyError:
+                self._check(labelvalues)
+                self._values[labelvalues] = amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class Gauge(_Metric):
+    """A value that is set to its current level"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        self._check(labelvalues)
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues: str, amount: float = 1) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class Histogram(_Metric):
+    """Counts of observed values in fixed buckets, plus their sum"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        # bisect_left: a value equal to a bound belongs to that bucket (le)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                self._check(labelvalues)
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            snapshot = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        names = self.labelnames + ("le",)
+        lines = []
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}"
+                )
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {_format_value(total)}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics rendered by /metrics, in registration order"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "signature_stage_seconds",
+    "Time spent in each pipeline stage, per endpoint",
+    ("endpoint", "stage"),
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    "signature_request_seconds",
+    "End-to-end request latency, per endpoint",
+    ("endpoint",),
+))
+MODEL_PREDICT_SECONDS = registry.register(Histogram(
+    "signature_model_predict_seconds",
+    "Duration of each batched model.predict call",
+))
+BATCH_SIZE = registry.register(Histogram(
+    "signature_batch_size",
+    "Images per batched model.predict call",
+    buckets=BATCH_SIZE_BUCKETS,
+))
+PERSIST_FLUSH_SECONDS = registry.register(Histogram(
+    "signature_persist_flush_seconds",
+    "Duration of each background write-behind batch",
+))
+VERDICTS = registry.register(Counter(
+    "signature_verdicts_total",
+    "Signatures judged authentic, flagged or holding no signature (blank pre-check), per endpoint",
+    ("endpoint", "verdict"),
+))
+PRECHECK_REJECTED = registry.register(Counter(
+    "signature_precheck_rejected_total",
+    "Images the blank pre-check answered without the model, by the measure that failed",
+    ("reason",),
+))
+PRECHECK_THRESHOLD = registry.register(Gauge(
+    "signature_precheck_threshold",
+    "Minimum contrast, ink density and ink bounding box area (0-1) of the blank pre-check",
+    ("measure",),
+))
+IN_FLIGHT = registry.register(Gauge(
+    "signature_requests_in_flight",
+    "Requests currently being handled",
+))
+QUEUE_DEPTH = registry.register(Gauge(
+    "signature_queue_depth",
+    "Work waiting in each queue (inference: images waiting for a batch)",
+    ("queue",),
+))
+MODEL_INFO = registry.register(Gauge(
+    "signature_model_info",
+    "The inference backend and model version in use (always 1)",
+    ("backend", "version", "state", "mock"),
+))
+
+IN_FLIGHT.set(0)
+
+UNMATCHED_ENDPOINT = "unmatched"
+NO_ENDPOINT = "none"
+
+
+class RequestMetrics:
+    """Stage timings and verdicts of one request, published when it finishes"""
+
+    __slots__ = ("stages", "authentic", "flagged", "no_signature")
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+        self.authentic = 0
+        self.flagged = 0
+        self.no_signature = 0
+
+    def publish(self, endpoint: str, seconds: float) -> None:
+        REQUEST_SECONDS.observe(seconds, endpoint)
+        for stage, stage_seconds in self.stages:
+            STAGE_SECONDS.observe(stage_seconds, endpoint, stage)
+        if self.authentic:
+            VERDICTS.inc(endpoint, "authentic", amount=self.authentic)
+        if self.flagged:
+            VERDICTS.inc(endpoint, "flagged", amount=self.flagged)
+        if self.no_signature:
+            VERDICTS.inc(endpoint, "no_signature", amount=self.no_signature)
+
+
+_current: contextvars.ContextVar[Optional[RequestMetrics]] = contextvars.ContextVar(
+    "request_metrics", default=None
+)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Record time spent in a pipeline stage by the current request."""
+    current = _current.get()
+    if current is None:
+        STAGE_SECONDS.observe(seconds, NO_ENDPOINT, stage)
+    else:
+        current.stages.append((stage, seconds))
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Time a `with` block as a pipeline stage of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def count_verdicts(authentic: int, flagged: int, no_signature: int = 0) -> None:
+    """
+    Record how many signatures the current request judged authentic and
+    flagged, and how many images held no signature (also not authentic, but
+    not counted as flagged).
+    """
+    current = _current.get()
+    if current is None:
+        if authentic:
+            VERDICTS.inc(NO_ENDPOINT, "authentic", amount=authentic)
+        if flagged:
+            VERDICTS.inc(NO_ENDPOINT, "flagged", amount=flagged)
+        if no_signature:
+            VERDICTS.inc(NO_ENDPOINT, "no_signature", amount=no_signature)
+    else:
+        current.authentic += authentic
+        current.flagged += flagged
+        current.no_signature += no_signature
+
+
+def timed_call(fn, *args):
+    """
+    Run fn(*args) and return (result, seconds). Module-level so it can be sent
+    to decode worker processes, timing the work rather than the queueing.
+    """
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """ASGI middleware: end-to-end latency, in-flight count and per-request metrics"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            seconds = time.perf_counter() - started
+            IN_FLIGHT.dec()
+            _current.reset(token)
+            # The router stores the matched route in the (shared) scope
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or UNMATCHED_ENDPOINT
+            request_metrics.publish(endpoint, seconds)
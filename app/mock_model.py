@@ -1,37 +1,129 @@
 """
 Mock model for development/testing when TensorFlow can't be installed due to path length issues.
-This provides the same interface as the real model but returns random predictions.
+This provides the same interface as the real model but returns made-up predictions.
+
+Predictions are deterministic: each image's scores are derived from a hash of
+its pixels, so the same image always gets the same verdict (about 80% of
+images come out "real"), whether it is predicted alone or in a batch.
+
+To make batching and scheduling measurable without TensorFlow, predict() can
+also take as long as a real model would: MOCK_FIXED_MS per call plus
+MOCK_PER_IMAGE_MS per image. With MOCK_RELEASE_GIL the time is spent sleeping,
+like a native runtime that releases the GIL; without it the thread spins in
+Python for that much CPU time, holding the GIL, so concurrent calls run one
+after another like pure-Python compute.
+
+embed() stands in for the CNN's penultimate-layer features with a 16x16
+grayscale thumbnail of the image (centred), so the same image always embeds
+the same way and similar images come out similar.
+
+INFERENCE_BACKEND=mock selects this model even where a real runtime is
+installed.
 """
 
+import hashlib
+import time
+
 import numpy as np
-import random
+
+from app.config import MOCK_FIXED_MS, MOCK_PER_IMAGE_MS, MOCK_RELEASE_GIL
+
+# Side of the thumbnail that embed() returns (EMBEDDING_SIDE**2 values)
+EMBEDDING_SIDE = 16
 
 class MockModel:
     """Mock CNN model that simulates signature verification"""
-    
-    def __init__(self):
+
+    supports_embeddings = True
+
+    def __init__(self, fixed_ms=MOCK_FIXED_MS, per_image_ms=MOCK_PER_IMAGE_MS, release_gil=MOCK_RELEASE_GIL):
+        self.fixed_ms = max(0.0, float(fixed_ms))
+        self.per_image_ms = max(0.0, float(per_image_ms))
+        self.release_gil = release_gil
         self.loaded = True
         print("Mock model loaded successfully")
-    
+
     def predict(self, img_array):
         """
-        Mock prediction that returns random but realistic confidence scores.
-        Returns array with shape (1, 2) where:
+        Mock prediction with scores derived from the image content.
+        Returns array with shape (N, 2) for a batch of N images where:
         - index 0: confidence for "real" signature
         - index 1: confidence for "fake" signature
         """
-        # Generate realistic confidence scores
-        # Most signatures should be "real" for testing
-        real_confidence = random.uniform(0.6, 0.95)  # Usually high confidence for real
-        fake_confidence = 1.0 - real_confidence
-        
-        # Occasionally return a "fake" signature for testing
-        if random.random() < 0.2:  # 20% chance of fake
-            real_confidence = random.uniform(0.3, 0.6)  # Lower confidence for fake
-            fake_confidence = 1.0 - real_confidence
-        
-        return np.array([[real_confidence, fake_confidence]])
-    
+        images = self._batch(img_array)
+        started = (time.perf_counter(), time.thread_time())
+        predictions = self._predictions(images)
+        self._simulate_cost(len(images), started)
+        return predictions
+
+    def embed(self, img_array):
+        """Mock features: (N, 256) centred 16x16 grayscale thumbnails."""
+        images = self._batch(img_array)
+        started = (time.perf_counter(), time.thread_time())
+        features = self._features(images)
+        self._simulate_cost(len(images), started)
+        return features
+
+    def predict_and_embed(self, img_array):
+        """predict() and embed() of a batch for the cost of one pass."""
+        images = self._batch(img_array)
+        started = (time.perf_counter(), time.thread_time())
+        predictions, features = self._predictions(images), self._features(images)
+        self._simulate_cost(len(images), started)
+        return predictions, features
+
+    @staticmethod
+    def _batch(img_array):
+        images = np.asarray(img_array)
+        if images.ndim == 3:
+            images = images[np.newaxis]
+        return images
+
+    def _predictions(self, images):
+        predictions = np.empty((len(images), 2), dtype=np.float32)
+        for i, image in enumerate(images):
+            real_confidence = self._real_confidence(image)
+            predictions[i] = (real_confidence, 1.0 - real_confidence)
+        return predictions
+
+    @staticmethod
+    def _features(images):
+        count, height, width = images.shape[:3]
+        cell_h, cell_w = height // EMBEDDING_SIDE, width // EMBEDDING_SIDE
+        gray = images[:, :cell_h * EMBEDDING_SIDE, :cell_w * EMBEDDING_SIDE].mean(axis=3)
+        thumbnails = gray.reshape(count, EMBEDDING_SIDE, cell_h, EMBEDDING_SIDE, cell_w).mean(axis=(2, 4))
+        features = thumbnails.reshape(count, -1).astype(np.float32)
+        features -= features.mean(axis=1, keepdims=True)
+        return features
+
+    @staticmethod
+    def _real_confidence(image):
+        # hashlib releases the GIL while hashing large buffers
+        digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=8).digest()
+        u = int.from_bytes(digest, "little") / 2.0**64
+        # Most signatures should be "real" for testing: the first 80% of the
+        # range maps to 0.6-0.95, the rest to "fake" scores of 0.3-0.6
+        if u < 0.8:
+            return 0.6 + (u / 0.8) * 0.35
+        return 0.3 + ((u - 0.8) / 0.2) * 0.3
+
+    def _simulate_cost(self, batch_size, started):
+        """
+        Take fixed_ms + per_image_ms * batch_size in total, counting from
+        `started` (wall and thread CPU time at the start of predict).
+        """
+        cost = (self.fixed_ms + self.per_image_ms * batch_size) / 1000.0
+        wall_started, cpu_started = started
+        if self.release_gil:
+            remaining = wall_started + cost - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+        else:
+            # Counted in this thread's CPU time, so concurrent calls queue on
+            # the GIL instead of overlapping
+            while time.thread_time() < cpu_started + cost:
+                pass
+
     def summary(self):
         """Mock summary method"""
         print("Mock CNN Signature Verification Model")
@@ -39,9 +131,9 @@ class MockModel:
         print("Input shape: (None, 224, 224, 3)")
         print("Output shape: (None, 2)")
         print("Classes: [real, fake]")
+        print(f"Simulated cost: {self.fixed_ms} ms + {self.per_image_ms} ms/image ({'releases' if self.release_gil else 'holds'} the GIL)")
         print("Note: This is a mock model for development/testing")
 
 def load_mock_model():
     """Load the mock model"""
     return MockModel()
-
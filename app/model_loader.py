@@ -0,0 +1,253 @@
+"""
+Background model loading and warm-up.
+
+The inference runtime (TensorFlow, TFLite or ONNX Runtime, see app/engines.py)
+is imported only when the model is loaded, not when the app module is
+imported, so the server can accept connections (and answer /health) while the
+model loads on a background thread. /ready reports when it can serve.
+
+Loading goes through these states:
+- pending: nothing started yet
+- tuning: with AUTOTUNE=startup, finding the thread count and batch size to
+  serve with (cached per machine; see app/autotune.py)
+- loading: importing the runtime and loading the INFERENCE_BACKEND engine
+  (falling back to the mock model if that fails; INFERENCE_BACKEND=mock
+  loads the mock model directly)
+- warming: running dummy batches of each WARMUP_BATCH_SIZES size (through
+  embed() as well, when the model produces embeddings) so the first real
+  requests do not pay for graph tracing and kernel selection
+- ready: predictions can be served
+- failed: neither the engine nor the mock model could be loaded
+"""
+
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.autotune import MODE_OFF, Autotuner, autotuner, engine_options
+from app.config import INFERENCE_BACKEND, WARMUP_BATCH_SIZES
+from app.engines import ENGINES, InferenceEngine, create_engine
+from app.preprocessing import INPUT_SHAPE
+
+STATE_PENDING = "pending"
+STATE_TUNING = "tuning"
+STATE_LOADING = "loading"
+STATE_WARMING = "warming"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+# INFERENCE_BACKEND value that selects the mock model (app/mock_model.py)
+MOCK_BACKEND = "mock"
+
+# Set by app/prefork.py in the parent process before workers are forked
+_preloaded_engine: Optional[InferenceEngine] = None
+_preloaded_backend: Optional[str] = None
+_engine_options: Dict = {}
+
+
+def preload_engine(backend: str = INFERENCE_BACKEND, **options) -> Optional[InferenceEngine]:
+    """
+    Prepare the inference engine before worker processes are forked.
+    Fork-safe engines (TFLite) are loaded now and shared by every worker. For
+    the others only the runtime library is imported, since their thread pools
+    do not survive fork; each worker then loads the weights itself with the
+    same options.
+    """
+    global _preloaded_engine, _preloaded_backend, _engine_options
+    _preloaded_backend = backend
+    _engine_options = dict(options)
+    if backend == MOCK_BACKEND:
+        return None
+    engine_class = ENGINES[backend]
+    if engine_class.fork_safe:
+        _preloaded_engine = engine_class(**options)
+    else:
+        engine_class.import_runtime()
+    return _preloaded_engine
+
+
+def preloaded_engine() -> Optional[InferenceEngine]:
+    return _preloaded_engine
+
+
+class ModelNotReadyError(Exception):
+    """Raised when a prediction is requested before the model has loaded."""
+
+    def __init__(self, state: str, retry_after: int = 5):
+        super().__init__(f"The model is not ready yet (state: {state}), please retry shortly")
+        self.state = state
+        self.retry_after = retry_after
+
+
+class ModelLoader:
+    """Loads the model (real or mock) once and exposes its predict()"""
+
+    def __init__(
+        self,
+        backend: Optional[str] = None,
+        warmup_batch_sizes: List[int] = WARMUP_BATCH_SIZES,
+        on_ready: Optional[Callable[["ModelLoader"], None]] = None,
+        tuner: Autotuner = autotuner,
+    ):
+        # Workers forked by app/prefork.py serve the backend the parent prepared
+        self.backend = backend or _preloaded_backend or INFERENCE_BACKEND
+        self.tuner = tuner
+        # The calibration the engine was created with (AUTOTUNE=startup)
+        self.tuning: Optional[Dict] = None
+        self.warmup_batch_sizes = warmup_batch_sizes
+        self.on_ready = on_ready
+        self.state = STATE_PENDING
+        self.model = None
+        self.is_mock = False
+        self.version = "unknown"
+        # Size of the model's embeddings, found during warm-up (None without embed())
+        self.embedding_dim: Optional[int] = None
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == STATE_READY
+
+    @property
+    def failed(self) -> bool:
+        return self.state == STATE_FAILED
+
+    def start(self) -> None:
+        """Load the model on a background thread (no-op if already started)."""
+        with self._lock:
+            if self.state != STATE_PENDING:
+                return
+            self.state = STATE_LOADING
+        self._thread = threading.Thread(target=self._load, name="model-loader", daemon=True)
+        self._thread.start()
+
+    def load(self) -> None:
+        """Load the model on the calling thread (no-op if already started)."""
+        with self._lock:
+            if self.state != STATE_PENDING:
+                return
+            self.state = STATE_LOADING
+        self._load()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until loading finishes; returns whether the model is ready."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.ready
+
+    def predict(self, images: np.ndarray) -> np.ndarray:
+        if self.model is None:
+            raise ModelNotReadyError(self.state)
+        return self.model.predict(images)
+
+    @property
+    def supports_embeddings(self) -> bool:
+        return bool(getattr(self.model, "supports_embeddings", False))
+
+    def embed(self, images: np.ndarray) -> np.ndarray:
+        if self.model is None:
+            raise ModelNotReadyError(self.state)
+        return self.model.embed(images)
+
+    def predict_and_embed(self, images: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.model is None:
+            raise ModelNotReadyError(self.state)
+        return self.model.predict_and_embed(images)
+
+    def status(self) -> Dict:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "backend": "mock" if self.is_mock else self.backend,
+            "is_mock": self.is_mock,
+            "model_version": self.version,
+            "embedding_dim": self.embedding_dim,
+            "error": self.error,
+            "timings": dict(self.timings),
+        }
+
+    def _load(self) -> None:
+        started = time.monotonic()
+        try:
+            options = dict(_engine_options)
+            if self.tuner.mode != MODE_OFF:
+                self.state = STATE_TUNING
+                self.tuning = self.tuner.startup(options.get("num_threads"))
+                self.timings["autotune_seconds"] = round(time.monotonic() - started, 3)
+                self.state = STATE_LOADING
+                if self.tuning is not None:
+                    options.update(engine_options(self.backend, self.tuning["config"]))
+            load_started = time.monotonic()
+            try:
+                if self.backend == MOCK_BACKEND:
+                    self.model = None
+                else:
+                    if _preloaded_engine is not None and _preloaded_engine.name == self.backend:
+                        self.model = _preloaded_engine
+                    else:
+                        self.model = create_engine(self.backend, **options)
+                    self.version = self.model.version
+            except ImportError as e:
+                print(f"WARNING: {self.backend} runtime not available ({e}), using mock model for development")
+                self.model = None
+            except Exception as e:
+                print(f"ERROR loading {self.backend} model: {e}")
+                print(f"Traceback: {traceback.format_exc()}")
+                self.model = None
+            if self.model is None:
+                self._load_mock()
+            self.timings["load_seconds"] = round(time.monotonic() - load_started, 3)
+
+            self.state = STATE_WARMING
+            self._warm_up()
+        except Exception as e:
+            print(f"ERROR loading model: {e}")
+            print(f"Traceback: {traceback.format_exc()}")
+            self.model = None
+            self.error = str(e)
+            self.state = STATE_FAILED
+            return
+
+        if self.on_ready is not None:
+            try:
+                self.on_ready(self)
+            except Exception as e:
+                # The model itself is usable; do not leave the loader stuck warming
+                print(f"ERROR in model ready callback: {e}")
+                print(f"Traceback: {traceback.format_exc()}")
+        self.state = STATE_READY
+        print(f"Model ready in {time.monotonic() - started:.2f}s ({self.version})")
+
+        # e.g. exporting the traced Keras graph, which is slow
+        after_ready = getattr(self.model, "after_ready", None)
+        if after_ready is not None:
+            after_ready()
+
+    def _load_mock(self) -> None:
+        from app.mock_model import load_mock_model
+        self.model = load_mock_model()
+        self.is_mock = True
+        self.version = "mock"
+        print("SUCCESS: Mock model loaded for development/testing")
+        if self.backend != MOCK_BACKEND:
+            print("WARNING: This is not the real CNN model. Install TensorFlow for production use.")
+
+    def _warm_up(self) -> None:
+        """Run one dummy batch of each configured size through the model."""
+        started = time.monotonic()
+        sizes = list(self.warmup_batch_sizes)
+        if self.tuning is not None and self.tuning["config"]["batch_max_size"] not in sizes:
+            sizes.append(self.tuning["config"]["batch_max_size"])
+        for size in sizes:
+            self.model.predict(np.zeros((size,) + INPUT_SHAPE, dtype=np.float32))
+        if self.supports_embeddings:
+            for size in sizes or [1]:
+                _, features = self.model.predict_and_embed(np.zeros((size,) + INPUT_SHAPE, dtype=np.float32))
+                self.embedding_dim = int(np.asarray(features).reshape(size, -1).shape[1])
+        self.timings["warmup_seconds"] = round(time.monotonic() - started, 3)
@@ -0,0 +1,429 @@
+"""
+Replay and near-duplicate detection for signature images.
+
+Every image decoded for the model is also given a 256-bit perceptual hash
+(preprocessing.perceptual_hash). Re-encoding, recompressing or rescaling an
+image moves only a few of its bits (up to 8 when rescaling and recompressing
+together), while unrelated signatures differ in dozens, so an image within
+PHASH_MAX_DISTANCE bits of one seen before is probably the same signature
+uploaded again. Probably: a careful tracing of a signature lands just as
+close, so a near duplicate is only ever reported, never trusted.
+`python -m app.phash DIR` measures both distributions on a directory of real
+signature images to choose PHASH_MAX_DISTANCE.
+
+PHashIndex remembers, for every image of a stored signature set or student
+verification, its hash, the SHA-256 of its bytes and the prediction it got.
+A new image is looked up before it reaches the model:
+- by SHA-256, for byte-identical replays, which need no decoding at all;
+- by hash, for near duplicates, using multi-index hashing: the bits are dealt
+  into PHASH_MAX_DISTANCE + 1 interleaved chunks, and by the pigeonhole
+  principle any hash within that distance matches at least one chunk exactly.
+  A lookup is one dict probe per chunk plus a Hamming distance check of the
+  few candidates found, i.e. microseconds.
+A match is reported on the result (duplicate_of). Only a byte-identical
+replay reuses the stored prediction instead of running the CNN
+(PHASH_REUSE_PREDICTIONS), and only if the model that is loaded now made it.
+Lookups stat and may replay the log under a lock that writers hold across
+flock(), so callers run them on the I/O pool.
+
+The index lives in memory and is persisted next to the database as an
+append-only log (DB_DIR/phash_index.jsonl) of inserts and deletes, replayed at
+startup and compacted there once deletes outnumber live entries. Entries are
+removed when their record is deleted or expires. Appends are not fsynced: the
+index can be rebuilt from new traffic, and a lost entry only means one
+duplicate goes unnoticed. Lookups pick up entries logged by other worker
+processes by checking the log's size.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import DB_DIR, PHASH_MAX_DISTANCE, PHASH_REUSE_PREDICTIONS
+from app.filelock import FileLock
+from app import preprocessing
+from app.preprocessing import PHASH_BITS
+
+# Deletes tolerated before opening the index compacts its log
+COMPACT_MIN_DELETES = 1000
+# Chunk buckets holding more entries than this (e.g. a chunk of blank paper
+# shared by most images) are skipped while another chunk can be probed
+MAX_BUCKET_SCAN = 256
+
+
+class PHashEntry(NamedTuple):
+    record_id: str
+    position: int  # index of the image within the record
+    digest: Optional[str]  # SHA-256 of the image bytes
+    phash: Optional[int]  # None if the image was served from the result cache undecoded
+    prediction: Tuple[float, float]  # (real, fake) row the model gave
+    model_version: str
+
+
+class PHashMatch(NamedTuple):
+    record_id: str
+    position: int
+    distance: int  # differing hash bits; 0 for byte-identical images
+    identical: bool  # same SHA-256, not just a close hash
+    prediction: Optional[Tuple[float, float]]  # reusable row: identical and made by the current model
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class PHashIndex:
+    """Hashes of stored signature images, searchable by Hamming distance"""
+
+    def __init__(self, path=None, max_distance: int = PHASH_MAX_DISTANCE):
+        self.path = Path(path) if path is not None else Path(DB_DIR) / "phash_index.jsonl"
+        self.max_distance = max(0, int(max_distance))
+        self.chunks = self.max_distance + 1
+        # Set once the model has loaded; stored predictions from other weights are not reused
+        self.model_version = "unknown"
+        self._entries: Dict[int, PHashEntry] = {}
+        self._by_digest: Dict[str, Set[int]] = {}
+        self._by_record: Dict[str, List[int]] = {}
+        self._buckets: List[Dict[str, Set[int]]] = [{} for _ in range(self.chunks)]
+        self._next_id = 0
+        self._deletes = 0
+        self._log_offset = 0
+        self._log_inode = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def open(self) -> None:
+        """Load the index from its log, compacting the log if it is mostly deletes."""
+        with self._lock, self._file_lock():
+            self._reload()
+            if self._deletes >= COMPACT_MIN_DELETES and self._deletes > len(self._entries):
+                self._compact()
+        print(f"Perceptual hash index: {len(self._entries)} images")
+
+    def find(self, digest: Optional[str] = None, phash: Optional[int] = None) -> Optional[PHashMatch]:
+        """The closest earlier image: byte-identical first, else the nearest hash within max_distance."""
+        self._refresh()
+        with self._lock:
+            match = self._find(digest, phash)
+            if match is None:
+                # Digest-only lookups are followed by a hash lookup once decoded
+                if phash is not None:
+                    self.misses += 1
+            elif match.identical:
+                self.hits += 1
+            else:
+                self.near_hits += 1
+            return match
+
+    def _find(self, digest: Optional[str], phash: Optional[int]) -> Optional[PHashMatch]:
+        if digest is not None:
+            for entry_id in self._by_digest.get(digest, ()):
+                return self._match(self._entries[entry_id], 0, identical=True)
+        if phash is None:
+            return None
+
+        buckets = [
+            bucket.get(key)
+            for bucket, key in zip(self._buckets, self._chunk_keys(phash))
+        ]
+        buckets = [bucket for bucket in buckets if bucket]
+        if not buckets:
+            return None
+        # Overfull buckets are skipped while other chunks can be probed; a
+        # duplicate matches several chunks, so recall barely suffers
+        probed = [bucket for bucket in buckets if len(bucket) <= MAX_BUCKET_SCAN] or [min(buckets, key=len)]
+        best = None
+        best_distance = self.max_distance + 1
+        for bucket in probed:
+            for entry_id in bucket:
+                entry = self._entries[entry_id]
+                distance = hamming(phash, entry.phash)
+                if distance < best_distance:
+                    best, best_distance = entry, distance
+        return None if best is None else self._match(best, best_distance, identical=False)
+
+    def _match(self, entry: PHashEntry, distance: int, identical: bool) -> PHashMatch:
+        reusable = identical and entry.model_version == self.model_version
+        return PHashMatch(entry.record_id, entry.position, distance, identical, entry.prediction if reusable else None)
+
+    def add(self, record_id: str, digests: Sequence[Optional[str]], phashes: Sequence[Optional[int]], predictions) -> None:
+        """Index the images of a stored record (positions in order)."""
+        entries = [
+            PHashEntry(record_id, position, digest, phash, (float(row[0]), float(row[1])), self.model_version)
+            for position, (digest, phash, row) in enumerate(zip(digests, phashes, predictions))
+            if digest is not None or phash is not None
+        ]
+        if not entries:
+            return
+        lines = "".join(json.dumps(self._serialize(entry)) + "\n" for entry in entries)
+        with self._lock, self._file_lock():
+            self._replay()
+            self._append(lines)
+            for entry in entries:
+                self._insert(entry)
+
+    def delete_records(self, record_ids: Iterable[str]) -> int:
+        """Drop every image of these records; returns how many were indexed."""
+        with self._lock, self._file_lock():
+            self._replay()
+            record_ids = [record_id for record_id in record_ids if record_id in self._by_record]
+            if not record_ids:
+                return 0
+            self._append("".join(json.dumps({"delete": record_id}) + "\n" for record_id in record_ids))
+            return sum(self._remove(record_id) for record_id in record_ids)
+
+    def stats(self) -> Dict:
+        self._refresh()
+        with self._lock:
+            return {
+                "images": len(self._entries),
+                "records": len(self._by_record),
+                "max_distance": self.max_distance,
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+            }
+
+    def _chunk_keys(self, phash: int) -> List[str]:
+        """The hash's bits dealt into `chunks` interleaved chunks, so each spans the whole image."""
+        # Slicing the binary string is several times faster than bit twiddling or numpy here
+        bits = format(phash, f"0{PHASH_BITS}b")
+        return [bits[chunk::self.chunks] for chunk in range(self.chunks)]
+
+    def _insert(self, entry: PHashEntry) -> None:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._by_record.setdefault(entry.record_id, []).append(entry_id)
+        if entry.digest is not None:
+            self._by_digest.setdefault(entry.digest, set()).add(entry_id)
+        if entry.phash is not None:
+            for bucket, key in zip(self._buckets, self._chunk_keys(entry.phash)):
+                bucket.setdefault(key, set()).add(entry_id)
+
+    def _remove(self, record_id: str) -> int:
+        entry_ids = self._by_record.pop(record_id, [])
+        for entry_id in entry_ids:
+            entry = self._entries.pop(entry_id)
+            if entry.digest is not None:
+                _discard(self._by_digest, entry.digest, entry_id)
+            if entry.phash is not None:
+                for bucket, key in zip(self._buckets, self._chunk_keys(entry.phash)):
+                    _discard(bucket, key, entry_id)
+        self._deletes += 1
+        return len(entry_ids)
+
+    @staticmethod
+    def _serialize(entry: PHashEntry) -> Dict:
+        data = entry._asdict()
+        data["phash"] = None if entry.phash is None else format(entry.phash, "x")
+        return data
+
+    def _apply(self, data: Dict) -> None:
+        if "delete" in data:
+            self._remove(data["delete"])
+            return
+        phash = data["phash"]
+        self._insert(PHashEntry(
+            data["record_id"],
+            data["position"],
+            data["digest"],
+            None if phash is None else int(phash, 16),
+            tuple(data["prediction"]),
+            data["model_version"],
+        ))
+
+    def _reload(self) -> None:
+        self._entries.clear()
+        self._by_digest.clear()
+        self._by_record.clear()
+        self._buckets = [{} for _ in range(self.chunks)]
+        self._deletes = 0
+        self._log_offset = 0
+        self._log_inode = None
+        self._replay()
+
+    def _replay(self) -> None:
+        """Apply log lines appended since the last replay (by any process)."""
+        try:
+            with open(self.path, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if self._log_inode is not None and inode != self._log_inode:
+                    # Compacted by another process: start over from the new log
+                    self._log_inode = inode
+                    self._reload()
+                    return
+                self._log_inode = inode
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line still being written by another process is left for next time
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].splitlines():
+            self._apply(json.loads(line))
+        self._log_offset += complete
+
+    def _refresh(self) -> None:
+        """Pick up other processes' changes (one stat call when there are none)."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_size != self._log_offset or stat.st_ino != self._log_inode:
+            with self._lock:
+                self._replay()
+
+    def _append(self, lines: str) -> None:
+        data = lines.encode("utf-8")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(data)
+            if self._log_inode is None:
+                self._log_inode = os.fstat(f.fileno()).st_ino
+        self._log_offset += len(data)
+
+    def _compact(self) -> None:
+        """Rewrite the log with only the live entries."""
+        staging = self.path.with_suffix(f".tmp-{os.getpid()}")
+        with open(staging, "w") as f:
+            for entry in self._entries.values():
+                f.write(json.dumps(self._serialize(entry)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(staging, self.path)
+        self._log_inode = None
+        self._reload()
+        print(f"Compacted perceptual hash index to {len(self._entries)} images")
+
+    def _file_lock(self) -> FileLock:
+        """Exclusive lock on the log across processes."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        return FileLock(self.path.with_suffix(".lock"))
+
+
+class Screening:
+    """
+    Index lookups for one request's images: by digest before decoding, then
+    by hash once decoded. Keeps what is needed to index the record later.
+    The lookups (find_identical, find_near) run on the I/O worker pool.
+    """
+
+    def __init__(self, index: PHashIndex, digests: Sequence[Optional[str]], reuse_predictions: bool = PHASH_REUSE_PREDICTIONS):
+        self.index = index
+        self.reuse_predictions = reuse_predictions
+        self.digests = list(digests)
+        self.phashes: List[Optional[int]] = [None] * len(self.digests)
+        self.matches: List[Optional[PHashMatch]] = [None] * len(self.digests)
+
+    def find_identical(self) -> None:
+        """Look every image up by digest."""
+        self.matches = [self.index.find(digest=digest) for digest in self.digests]
+
+    def reusable(self, i: int) -> Optional[Tuple[float, float]]:
+        """The stored prediction of a byte-identical earlier image, to use instead of the model."""
+        match = self.matches[i]
+        if match is None or not self.reuse_predictions:
+            return None
+        return match.prediction
+
+    def hashed(self, i: int, phash: int) -> None:
+        """Record image i's hash once decoded."""
+        self.phashes[i] = phash
+
+    def find_near(self) -> None:
+        """Look the decoded images without an identical match up by hash."""
+        for i, phash in enumerate(self.phashes):
+            if self.matches[i] is None and phash is not None:
+                self.matches[i] = self.index.find(phash=phash)
+
+    def record(self, record_id: str, predictions) -> None:
+        """Index the images under their stored record (runs on the I/O worker pool)."""
+        self.index.add(record_id, self.digests, self.phashes, predictions)
+
+
+def _discard(index: Dict, key, entry_id: int) -> None:
+    ids = index.get(key)
+    if ids is not None:
+        ids.discard(entry_id)
+        if not ids:
+            del index[key]
+
+
+def _reencodings(image: np.ndarray) -> Dict[str, bytes]:
+    """Copies of a decoded image as a client might re-send it."""
+    half = cv2.resize(image, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+    return {
+        "jpeg70": cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 70])[1].tobytes(),
+        "half": cv2.imencode(".png", half)[1].tobytes(),
+        "half+jpeg70": cv2.imencode(".jpg", half, [cv2.IMWRITE_JPEG_QUALITY, 70])[1].tobytes(),
+    }
+
+
+def calibrate(paths: Sequence[str]) -> Dict:
+    """
+    Hash distances on real signature images: between every pair of different
+    images, and between each image and re-encoded copies of it.
+    PHASH_MAX_DISTANCE belongs above the copies and well below the pairs.
+    """
+    def phash_of(data: bytes) -> int:
+        return preprocessing.preprocess_hashed(data, measure_ink=False)[1]
+
+    hashes, copies = [], []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        phash = phash_of(data)
+        hashes.append(phash)
+        copies.extend(hamming(phash, phash_of(copy)) for copy in _reencodings(image).values())
+    pairs = np.array([hamming(a, b) for i, a in enumerate(hashes) for b in hashes[i + 1:]], dtype=np.int64)
+    copies = np.array(copies, dtype=np.int64)
+
+    def summary(distances: np.ndarray) -> Dict:
+        if not len(distances):
+            return {}
+        return {
+            "min": int(distances.min()),
+            "p1": float(np.percentile(distances, 1)),
+            "p50": float(np.percentile(distances, 50)),
+            "p99": float(np.percentile(distances, 99)),
+            "max": int(distances.max()),
+        }
+
+    return {"images": len(hashes), "different_images": summary(pairs), "reencoded_copies": summary(copies)}
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure perceptual hash distances to choose PHASH_MAX_DISTANCE.")
+    parser.add_argument("directory", help="Directory of signature images (different signatures, no copies)")
+    args = parser.parse_args(argv)
+
+    paths = sorted(
+        os.path.join(args.directory, name) for name in os.listdir(args.directory)
+        if os.path.isfile(os.path.join(args.directory, name))
+    )
+    result = calibrate(paths)
+    print(json.dumps(result, indent=2))
+    pairs, copies = result["different_images"], result["reencoded_copies"]
+    if pairs and copies:
+        print(
+            f"Copies are within {copies['max']} bits, different images at least {pairs['min']} apart; "
+            f"PHASH_MAX_DISTANCE is {PHASH_MAX_DISTANCE}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+Pre-fork serving: prepare the model once, then fork workers that share it.
+
+    SERVE_MODE=prefork WEB_WORKERS=4 python run.py
+
+The parent process opens the listening socket, prepares the inference engine
+(see model_loader.preload_engine), freezes the garbage collector so that
+reference counting does not dirty the shared pages, and forks WEB_WORKERS
+uvicorn workers that accept on the shared socket. Workers that die are
+restarted.
+
+Only the tflite engine shares the weights: it is loaded in the parent and the
+model file is memory-mapped, so every worker maps one copy. TensorFlow and
+ONNX Runtime thread pools do not survive fork, so with keras or onnx each
+worker would load its own copy of the weights. With several workers the
+server therefore serves the tflite model whenever INFERENCE_BACKEND is not
+fork-safe, and refuses to start if there is no .tflite file yet:
+
+    python -m app.convert_model --formats tflite
+
+Per-worker settings:
+- inference threads: INFERENCE_THREADS, or the CPUs divided between workers
+  (with AUTOTUNE=startup, the calibrated count within that share)
+- PREFORK_PIN_CPUS: give each worker its own slice of the CPUs
+
+Workers share no memory after the fork, so the database must be one that
+several processes can write (DB_ENGINE=sqlite).
+
+Memory actually shared per worker (from /proc/<pid>/smaps_rollup) is printed
+for every worker when the parent receives SIGUSR1, and each worker reports its
+own at GET /worker-memory.
+"""
+
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Dict, List, Optional
+
+from app.config import (
+    DB_ENGINE,
+    INFERENCE_BACKEND,
+    INFERENCE_THREADS,
+    PREFORK_PIN_CPUS,
+    TFLITE_MODEL_PATH,
+    WEB_WORKERS,
+)
+
+# Seconds to wait before replacing a worker that exited, to avoid a crash loop
+RESPAWN_DELAY = 1.0
+
+
+def memory_usage(pid: int) -> Dict[str, int]:
+    """
+    Resident memory of a process in bytes, split into pages shared with other
+    processes and private pages. `pss` charges each shared page to its sharers
+    in proportion, so summing it over workers gives the real total.
+    """
+    fields = {}
+    try:
+        path = f"/proc/{pid}/smaps_rollup"
+        if not os.path.exists(path):
+            path = f"/proc/{pid}/smaps"
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    key = parts[0].rstrip(":")
+                    fields[key] = fields.get(key, 0) + int(parts[1]) * 1024
+    except OSError:
+        return {}
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def worker_cpus(index: int, workers: int) -> Optional[List[int]]:
+    """The CPUs worker `index` is pinned to, or None when pinning is off."""
+    if not PREFORK_PIN_CPUS or not hasattr(os, "sched_getaffinity"):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    if workers >= len(cpus):
+        return [cpus[index % len(cpus)]]
+    share = len(cpus) // workers
+    return cpus[index * share:(index + 1) * share]
+
+
+def threads_per_worker(workers: int) -> int:
+    if INFERENCE_THREADS:
+        return INFERENCE_THREADS
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    return max(1, cpus // workers)
+
+
+class PreforkServer:
+    """Forks and supervises uvicorn workers sharing one listening socket"""
+
+    def __init__(self, host: str, port: int, workers: int = WEB_WORKERS):
+        self.host = host
+        self.port = port
+        self.workers = max(1, int(workers))
+        self.threads = threads_per_worker(self.workers)
+        self.children: Dict[int, int] = {}  # pid -> worker index
+        self.stopping = False
+        self.sock: Optional[socket.socket] = None
+
+    def run(self) -> None:
+        if DB_ENGINE != "sqlite" and self.workers > 1:
+            sys.exit(
+                f"SERVE_MODE=prefork with {self.workers} workers needs DB_ENGINE=sqlite; "
+                f"the {DB_ENGINE!r} engine keeps its state in a single process"
+            )
+        backend = self.select_backend()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(2048)
+        self.sock.set_inheritable(True)
+
+        from app import model_loader
+        from app.autotune import autotuner, engine_options
+        started = time.monotonic()
+        options = {"num_threads": self.threads}
+        # Calibrated once here, for each worker's share of the CPUs; workers inherit the result
+        tuning = autotuner.startup(self.threads)
+        if tuning is not None:
+            options.update(engine_options(backend, tuning["config"]))
+            self.threads = options.get("num_threads") or self.threads
+        try:
+            model_loader.preload_engine(backend, **options)
+        except Exception as e:
+            # Workers retry on their own and fall back to the mock model
+            print(f"WARNING: could not prepare the {backend} engine before forking: {e}")
+        print(
+            f"Prepared {backend} engine in {time.monotonic() - started:.2f}s; "
+            f"forking {self.workers} workers with {self.threads} inference threads each"
+        )
+
+        # Objects allocated so far are never collected, so the collector does
+        # not touch (and copy) the pages the workers share
+        gc.collect()
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGUSR1, self._handle_report)
+
+        for index in range(self.workers):
+            self._spawn(index)
+        self._supervise()
+
+    def select_backend(self) -> str:
+        """
+        The backend the workers serve: INFERENCE_BACKEND, or tflite when that
+        engine would give every worker its own copy of the weights.
+        """
+        from app.engines import ENGINES
+        from app.model_loader import MOCK_BACKEND
+        engine_class = ENGINES.get(INFERENCE_BACKEND)
+        if self.workers == 1 or INFERENCE_BACKEND == MOCK_BACKEND or engine_class is None or engine_class.fork_safe:
+            return INFERENCE_BACKEND
+        if not os.path.exists(TFLITE_MODEL_PATH):
+            sys.exit(
+                f"SERVE_MODE=prefork with {self.workers} workers cannot share the weights of the "
+                f"{INFERENCE_BACKEND!r} engine: every worker would load its own copy. Export the "
+                f"model with `python -m app.convert_model --formats tflite` (expected at "
+                f"{TFLITE_MODEL_PATH}) or set INFERENCE_BACKEND=tflite"
+            )
+        print(
+            f"WARNING: the {INFERENCE_BACKEND} engine cannot be shared between forked workers; "
+            f"serving {TFLITE_MODEL_PATH} with the tflite engine instead"
+        )
+        return "tflite"
+
+    def _spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker(index)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = index
+        print(f"Started worker {index} (pid {pid})")
+
+    def _run_worker(self, index: int) -> None:
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
+            signal.signal(signum, signal.SIG_DFL)
+
+        cpus = worker_cpus(index, self.workers)
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+        # Forked workers would otherwise produce identical random sequences
+        random.seed()
+
+        import cv2
+        cv2.setNumThreads(self.threads)
+
+        from app import model_loader
+        engine = model_loader.preloaded_engine()
+        if engine is not None:
+            engine.after_fork()
+
+        import uvicorn
+        config = uvicorn.Config("app.main:app", log_level="info")
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def _supervise(self) -> None:
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            print(f"Worker {index} (pid {pid}) exited with status {status}; restarting")
+            time.sleep(RESPAWN_DELAY)
+            if not self.stopping:
+                self._spawn(index)
+
+    def _handle_stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _handle_report(self, signum, frame) -> None:
+        self.print_memory_report()
+
+    def print_memory_report(self) -> None:
+        """Print shared and private memory of the parent and every worker."""
+        rows = [("parent", os.getpid())]
+        for pid, index in sorted(self.children.items(), key=lambda item: item[1]):
+            rows.append((f"worker {index}", pid))
+        print(f"{'process':<10} {'pid':>7} {'rss MB':>9} {'pss MB':>9} {'shared MB':>10} {'private MB':>11}")
+        total_pss = 0
+        for name, pid in rows:
+            usage = memory_usage(pid)
+            if not usage:
+                continue
+            total_pss += usage["pss"]
+            print(
+                f"{name:<10} {pid:>7} {usage['rss'] / 2**20:>9.1f} {usage['pss'] / 2**20:>9.1f} "
+                f"{usage['shared'] / 2**20:>10.1f} {usage['private'] / 2**20:>11.1f}"
+            )
+        print(f"Total (PSS): {total_pss / 2**20:.1f} MB")
+
+
+def serve(host: str, port: int, workers: int = WEB_WORKERS) -> None:
+    PreforkServer(host, port, workers).run()
@@ -0,0 +1,413 @@
+"""
+Image preprocessing for the CNN model.
+
+Images are decoded straight from the request bytes with cv2.imdecode and
+resized/normalized in place into a preallocated float32 batch (TensorArena),
+so the hot path allocates nothing per image beyond the decoded pixels.
+
+Output matches the original PIL -> cvtColor(BGR2RGB) -> resize -> /255
+pipeline, which fed the model BGR-ordered pixels:
+- PNG and other lossless formats: bit-for-bit identical.
+- JPEG: OpenCV and Pillow ship different libjpeg builds, so decoded pixels
+  may differ by a couple of levels; tensors agree within PARITY_ATOL (3/255).
+- Inputs the old pipeline rejected or mangled now work: grayscale and 16-bit
+  images are expanded to 3 channels, palette images are decoded to colour and
+  transparent pixels are composited over white.
+- Large JPEGs (e.g. phone photos) are decoded at 1/2, 1/4 or 1/8 scale when
+  DECODE_DOWNSCALE is on, so their tensors are smoother than a full decode
+  followed by resize and are not covered by the tolerance above.
+
+Uploads above MAX_IMAGE_BYTES, or whose header declares more than
+MAX_IMAGE_PIXELS, are rejected with ImageTooLargeError before decoding.
+
+preprocess_hashed also measures the ink of the decoded image, on a grid of
+cells that keeps thin strokes at full contrast (see ink_stats), so that blank
+canvases can be answered without the model (see blank_reason).
+
+These functions are plain, importable and picklable so they can run in the
+decode worker pool (threads or processes) without pulling in the model.
+"""
+
+import binascii
+import io
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, NamedTuple, Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.config import (
+    DECODE_DOWNSCALE,
+    MAX_IMAGE_BYTES,
+    MAX_IMAGE_PIXELS,
+    PRECHECK_MIN_BBOX,
+    PRECHECK_MIN_CONTRAST,
+    PRECHECK_MIN_INK,
+)
+
+IMAGE_SIZE = 224
+INPUT_SHAPE = (IMAGE_SIZE, IMAGE_SIZE, 3)
+
+# Perceptual hashes are PHASH_SIDE x PHASH_SIDE bits (see perceptual_hash)
+PHASH_SIDE = 16
+PHASH_BITS = PHASH_SIDE * PHASH_SIDE
+
+# Ink is measured on a grid of at most PRECHECK_SIDE cells along the longer
+# side of the decoded image (see ink_stats)
+PRECHECK_SIDE = IMAGE_SIZE
+
+# Max absolute difference from the original pipeline on JPEG input
+PARITY_ATOL = 3.0 / 255.0
+
+# Per-thread uint8 buffer that cv2.resize writes into
+_scratch = threading.local()
+
+# JPEG DCT-domain downscaling; ignore EXIF orientation like the full decode does
+_REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2 | cv2.IMREAD_IGNORE_ORIENTATION,
+    4: cv2.IMREAD_REDUCED_COLOR_4 | cv2.IMREAD_IGNORE_ORIENTATION,
+    8: cv2.IMREAD_REDUCED_COLOR_8 | cv2.IMREAD_IGNORE_ORIENTATION,
+}
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an upload exceeds MAX_IMAGE_BYTES or MAX_IMAGE_PIXELS."""
+
+
+def _check_pixel_count(width: int, height: int) -> None:
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(
+            f"Image is {width}x{height} pixels; the limit is {MAX_IMAGE_PIXELS} pixels"
+        )
+
+
+def inspect_image(image_bytes):
+    """
+    Enforce the upload limits using only the image header.
+    Returns (format, width, height), or None if PIL does not recognise the header.
+    """
+    if len(image_bytes) > MAX_IMAGE_BYTES:
+        raise ImageTooLargeError(
+            f"Image is {len(image_bytes)} bytes; the limit is {MAX_IMAGE_BYTES} bytes"
+        )
+
+    try:
+        # Image.open only parses the header; pixels are not decoded here
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            image_format = img.format
+            width, height = img.size
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    except Exception:
+        return None
+
+    _check_pixel_count(width, height)
+    return image_format, width, height
+
+
+def reduction_factor(width: int, height: int) -> int:
+    """Largest decode scale-down (8, 4 or 2) that keeps both sides >= 224 px."""
+    for factor in (8, 4, 2):
+        if width // factor >= IMAGE_SIZE and height // factor >= IMAGE_SIZE:
+            return factor
+    return 1
+
+
+def _resize_buffer() -> np.ndarray:
+    buf = getattr(_scratch, "resized", None)
+    if buf is None:
+        buf = np.empty(INPUT_SHAPE, dtype=np.uint8)
+        _scratch.resized = buf
+    return buf
+
+
+def _decode_with_pil(image_bytes, factor: int = 1) -> np.ndarray:
+    """Fallback for formats OpenCV cannot decode (e.g. GIF)."""
+    img = Image.open(io.BytesIO(image_bytes))
+    if factor > 1:
+        # Draft mode lets decoders that support it (JPEG) decode at reduced size
+        img.draft("RGB", (img.width // factor, img.height // factor))
+    img = img.convert("RGB")
+    return cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+
+
+def _to_bgr(img: np.ndarray) -> np.ndarray:
+    """Normalize a decoded image of any depth/channel count to 8-bit BGR."""
+    if img.dtype != np.uint8:
+        # 16-bit PNG/TIFF: scale down to 8 bits
+        img = cv2.convertScaleAbs(img, alpha=255.0 / np.iinfo(img.dtype).max)
+
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+    channels = img.shape[2]
+    if channels == 3:
+        return img
+    if channels == 1:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    if channels == 4:
+        alpha = img[:, :, 3]
+        if alpha.min() == 255:
+            return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+        # Composite transparent areas (e.g. signature pad background) over white
+        weight = alpha[:, :, np.newaxis].astype(np.float32) / 255.0
+        blended = img[:, :, :3] * weight + 255.0 * (1.0 - weight)
+        return blended.round().astype(np.uint8)
+
+    raise ValueError(f"Unsupported number of image channels: {channels}")
+
+
+def decode_image(image_bytes) -> np.ndarray:
+    """Decode encoded image bytes into an 8-bit, 3-channel BGR array."""
+    header = inspect_image(image_bytes)
+
+    # Zero-copy view over the request bytes
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    if buffer.size == 0:
+        raise ValueError("Empty image data")
+
+    factor = 1
+    if DECODE_DOWNSCALE and header is not None:
+        image_format, width, height = header
+        factor = reduction_factor(width, height)
+        if image_format == "JPEG" and factor > 1:
+            img = cv2.imdecode(buffer, _REDUCED_DECODE_FLAGS[factor])
+            if img is not None:
+                return img
+
+    # IMREAD_UNCHANGED keeps alpha and, like PIL, ignores EXIF orientation
+    img = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        img = _decode_with_pil(image_bytes, factor)
+    if header is None:
+        # Header was unreadable up front, so check the decoded size instead
+        _check_pixel_count(img.shape[1], img.shape[0])
+    return _to_bgr(img)
+
+
+def preprocess_into(image_bytes, out: np.ndarray) -> np.ndarray:
+    """
+    Decode image bytes and write the normalized (224, 224, 3) float32 tensor
+    into `out` in place. Returns `out`.
+    """
+    return _resize_into(decode_image(image_bytes), out)
+
+
+def _resize_into(img: np.ndarray, out: np.ndarray) -> np.ndarray:
+    resized = cv2.resize(img, (IMAGE_SIZE, IMAGE_SIZE), dst=_resize_buffer())
+    np.divide(resized, np.float32(255.0), out=out, dtype=np.float32)
+    return out
+
+
+def preprocess_timed(image_bytes, out: Optional[np.ndarray] = None):
+    """
+    preprocess_into that also times its two steps. Returns (out,
+    decode_seconds, resize_seconds); `out` is allocated when not given (e.g.
+    in decode worker processes, which cannot write into the caller's arena).
+    """
+    if out is None:
+        out = np.empty(INPUT_SHAPE, dtype=np.float32)
+    started = time.perf_counter()
+    img = decode_image(image_bytes)
+    decoded = time.perf_counter()
+    _resize_into(img, out)
+    return out, decoded - started, time.perf_counter() - decoded
+
+
+def perceptual_hash(resized: np.ndarray) -> int:
+    """
+    256-bit difference hash (dHash) of an 8-bit BGR image: shrunk to 17x16
+    grayscale, with one bit per pixel (row-major) set when it is brighter than
+    its left neighbour. Re-encoding or rescaling an image flips only a few bits.
+    """
+    return _gray_hash(cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY))
+
+
+def _gray_hash(gray: np.ndarray) -> int:
+    small = cv2.resize(gray, (PHASH_SIDE + 1, PHASH_SIDE), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class InkStats(NamedTuple):
+    """How much of an image could be a signature, each as a 0-1 fraction"""
+
+    contrast: float  # Darkest to lightest level of the image
+    ink_density: float  # Share of grid cells standing out from the background
+    bbox_area: float  # Share of the image covered by the box around them
+
+
+def _cell_extremes(gray: np.ndarray, cell: int):
+    """
+    Darkest and lightest level of each cell x cell block of a grayscale image.
+    Blocks along the bottom and right edges cover whatever is left, so every
+    pixel belongs to a block even when a side is shorter than a cell.
+    """
+    height, width = gray.shape
+    rows = height // cell
+    # Rows of a band are contiguous, so numpy reduces them cheaply; the
+    # narrower band images are then reduced along each row by erode/dilate
+    bands = gray[:rows * cell].reshape(rows, cell, width)
+    darkest, lightest = bands.min(axis=1), bands.max(axis=1)
+    if height % cell:
+        darkest = np.vstack([darkest, gray[rows * cell:].min(axis=0, keepdims=True)])
+        lightest = np.vstack([lightest, gray[rows * cell:].max(axis=0, keepdims=True)])
+    return _column_blocks(darkest, cell, cv2.erode, np.min), _column_blocks(lightest, cell, cv2.dilate, np.max)
+
+
+def _column_blocks(bands: np.ndarray, cell: int, morph, reduce) -> np.ndarray:
+    """Reduce each row of `bands` over blocks of `cell` columns (the last one possibly narrower)."""
+    cols = bands.shape[1] // cell
+    # Sampling the pixel whose window is exactly its block
+    blocks = morph(bands, np.ones((1, cell), np.uint8))[:, cell // 2:cols * cell:cell] if cols else bands[:, :0]
+    if bands.shape[1] % cell:
+        blocks = np.hstack([blocks, reduce(bands[:, cols * cell:], axis=1, keepdims=True)])
+    return blocks
+
+
+def ink_stats(gray: np.ndarray, ink_level: float = PRECHECK_MIN_CONTRAST) -> InkStats:
+    """
+    Measure an 8-bit grayscale image at its decoded resolution, on a grid of
+    at most PRECHECK_SIDE cells per side. Each cell keeps the darkest and the
+    lightest level under it, so a pen stroke thinner than a cell keeps its
+    full contrast (averaging would fade a 1px line on a large image into the
+    paper). The background is the median level, so dark ink on paper and
+    light strokes on a dark pad count alike; a cell is ink when either
+    extreme is at least `ink_level` away from it.
+    """
+    cell = -(-max(gray.shape) // PRECHECK_SIDE)
+    if cell > 1:
+        darkest, lightest = _cell_extremes(gray, cell)
+        # One pixel per cell is plenty to find the paper level (the first
+        # one clamped to the image, for sides shorter than half a cell)
+        sample = gray[min(cell // 2, gray.shape[0] - 1)::cell, min(cell // 2, gray.shape[1] - 1)::cell]
+    else:
+        darkest = lightest = sample = gray
+    low, high = int(darkest.min()), int(lightest.max())
+    if high - low < ink_level * 255:
+        # Nothing can stand out from the background by ink_level
+        return InkStats((high - low) / 255.0, 0.0, 0.0)
+    background = np.median(sample)
+    level = ink_level * 255
+    ink = (background - darkest.astype(np.int16) >= level) | (lightest.astype(np.int16) - background >= level)
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    bbox = (rows[-1] - rows[0] + 1) * (cols[-1] - cols[0] + 1) if len(rows) else 0
+    return InkStats(
+        (high - low) / 255.0,
+        float(np.count_nonzero(ink)) / ink.size,
+        float(bbox) / ink.size,
+    )
+
+
+def blank_reason(
+    stats: InkStats,
+    min_contrast: float = PRECHECK_MIN_CONTRAST,
+    min_ink: float = PRECHECK_MIN_INK,
+    min_bbox: float = PRECHECK_MIN_BBOX,
+) -> Optional[str]:
+    """Why an image clearly holds no signature ("contrast", "ink" or "bbox"), or None."""
+    if stats.contrast < min_contrast:
+        return "contrast"
+    if stats.ink_density < min_ink:
+        return "ink"
+    if stats.bbox_area < min_bbox:
+        return "bbox"
+    return None
+
+
+def preprocess_hashed(image_bytes, out: Optional[np.ndarray] = None, measure_ink: bool = True):
+    """
+    preprocess_timed that also hashes the image and measures its ink from the
+    same decode. Returns (out, perceptual_hash, ink_stats, decode_seconds,
+    resize_seconds), the hash and ink being counted in the resize step;
+    ink_stats is None without `measure_ink`.
+    """
+    if out is None:
+        out = np.empty(INPUT_SHAPE, dtype=np.float32)
+    started = time.perf_counter()
+    img = decode_image(image_bytes)
+    decoded = time.perf_counter()
+    _resize_into(img, out)
+    # This thread's resize buffer still holds the 224x224 pixels
+    phash = _gray_hash(cv2.cvtColor(_resize_buffer(), cv2.COLOR_BGR2GRAY))
+    # Ink from the decoded pixels: thin strokes do not survive the resize
+    ink = ink_stats(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)) if measure_ink else None
+    return out, phash, ink, decoded - started, time.perf_counter() - decoded
+
+
+def preprocess_image(image_bytes):
+    """
+    Preprocess the image for the CNN model into a new (1, 224, 224, 3) array.
+    Used where an arena slot cannot be shared (e.g. decode worker processes).
+    """
+    out = np.empty((1,) + INPUT_SHAPE, dtype=np.float32)
+    preprocess_into(image_bytes, out[0])
+    return out
+
+
+def decode_base64_image(base64_string):
+    """Decode a base64 string or bytes (optionally a data URL) to raw image bytes."""
+    # One ASCII copy of the payload (none for bytes); the data URL prefix is
+    # then skipped through a view instead of splitting off a copy of the rest
+    data = base64_string.encode("ascii") if isinstance(base64_string, str) else base64_string
+    payload = memoryview(data)
+    comma = data.find(b",")
+    if comma >= 0:
+        end = data.find(b",", comma + 1)
+        payload = payload[comma + 1:end if end >= 0 else len(data)]
+
+    # Reject oversized payloads before decoding them
+    decoded_size = len(payload) // 4 * 3
+    if decoded_size > MAX_IMAGE_BYTES:
+        raise ImageTooLargeError(
+            f"Image is about {decoded_size} bytes; the limit is {MAX_IMAGE_BYTES} bytes"
+        )
+
+    return binascii.a2b_base64(payload)
+
+
+def preprocess_base64_image(base64_string):
+    """
+    Preprocess a base64 encoded image for the CNN model.
+    """
+    return preprocess_image(decode_base64_image(base64_string))
+
+
+class TensorArena:
+    """Preallocated float32 buffer for a batch of model inputs"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.batch = np.empty((capacity,) + INPUT_SHAPE, dtype=np.float32)
+
+
+class ArenaPool:
+    """Recycles TensorArenas so batches are not reallocated per request"""
+
+    def __init__(self, capacity: int, max_free: int = 8):
+        self.capacity = max(1, int(capacity))
+        self.max_free = max_free
+        self._free: List[TensorArena] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lease(self):
+        """
+        Borrow an arena for the duration of a `with` block. If the block exits
+        with an error (including cancellation) the arena is dropped instead of
+        recycled, since a model call may still be reading from it.
+        """
+        with self._lock:
+            arena = self._free.pop() if self._free else None
+        if arena is None:
+            arena = TensorArena(self.capacity)
+
+        yield arena
+
+        with self._lock:
+            if len(self._free) < self.max_free:
+                self._free.append(arena)
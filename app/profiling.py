@@ -0,0 +1,406 @@
+"""
+Opt-in per-request profiling, saved as collapsed stacks or speedscope files.
+
+A request is profiled when it carries `X-Profile-Token: <PROFILE_TOKEN>`, or
+when it is picked by the sampled share set with PROFILE_SAMPLE_RATE (or at
+runtime through PUT /profiling). At most PROFILE_MAX_ACTIVE requests are
+profiled at a time. Other requests pay for one header scan and a comparison.
+
+While a profiled request runs, a sampler thread takes the Python stack of
+every thread working for it every PROFILE_INTERVAL_MS:
+- the event loop thread, whenever the request's own task is the one running
+- decode and I/O pool threads, while they run a job the request submitted
+  (BoundedExecutor binds jobs to the submitting request's profile)
+- inference threads, while they run a batch holding the request's images
+  (the batch is shared, so concurrent requests' profiles all include it)
+The sampler thread exists only while some request is being profiled.
+
+When the request finishes, the samples are written to PROFILE_DIR as
+<profile id>.collapsed (one `thread;frame;frame count` line per stack, for
+flamegraph.pl or speedscope) or <profile id>.speedscope.json (one profile per
+thread, for https://www.speedscope.app), and the id is returned in the
+X-Profile-Id response header. The newest PROFILE_KEEP files are kept.
+
+Not covered: decoding in worker processes (DECODE_USE_PROCESSES) and
+write-behind flushes, which run after the response has been sent.
+"""
+
+import asyncio
+import functools
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.config import (
+    PROFILE_DIR,
+    PROFILE_FORMAT,
+    PROFILE_INTERVAL_MS,
+    PROFILE_KEEP,
+    PROFILE_MAX_ACTIVE,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_TOKEN,
+)
+
+FORMAT_COLLAPSED = "collapsed"
+FORMAT_SPEEDSCOPE = "speedscope"
+FILE_SUFFIXES = {FORMAT_COLLAPSED: ".collapsed", FORMAT_SPEEDSCOPE: ".speedscope.json"}
+
+TOKEN_HEADER = b"x-profile-token"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+EVENT_LOOP_THREAD = "event-loop"
+
+# (function name, file, first line) of one frame
+Frame = Tuple[str, str, int]
+
+
+class Profile:
+    """The stack samples of one request, per thread"""
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.reason = reason  # "token" or "sampled"
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        # (thread name, outermost-first frames) -> samples
+        self.samples: Counter = Counter()
+        self.loop_thread: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def add(self, thread_name: str, stack: Tuple[Frame, ...]) -> None:
+        self.samples[(thread_name, stack)] += 1
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed-stack format, rooted at the thread."""
+        lines = []
+        for (thread_name, stack), count in sorted(self.samples.items()):
+            frames = ";".join(_frame_label(frame) for frame in stack)
+            lines.append(f"{thread_name};{frames} {count}" if frames else f"{thread_name} {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, interval_ms: float) -> Dict:
+        """A speedscope file with one sampled profile per thread."""
+        frame_ids: Dict[Frame, int] = {}
+        frames = []
+        by_thread: Dict[str, Tuple[list, list]] = {}
+        for (thread_name, stack), count in sorted(self.samples.items()):
+            indices = []
+            for frame in stack:
+                if frame not in frame_ids:
+                    frame_ids[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indices.append(frame_ids[frame])
+            samples, weights = by_thread.setdefault(thread_name, ([], []))
+            samples.append(indices)
+            weights.append(count * interval_ms)
+        profiles = [
+            {
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+            for thread_name, (samples, weights) in by_thread.items()
+        ]
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.method} {self.path} ({self.duration * 1000:.1f} ms)",
+            "exporter": "signature-verification-api",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+def _frame_label(frame: Frame) -> str:
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+_current: ContextVar[Optional[Profile]] = ContextVar("request_profile", default=None)
+
+
+def current() -> Optional[Profile]:
+    """The profile of the request being handled, if it is profiled."""
+    return _current.get()
+
+
+def bind(fn, profiles: Optional[Iterable[Profile]] = None):
+    """
+    fn, made to register the worker thread that runs it with `profiles` (by
+    default the current request's). Returns fn itself when nothing is profiled.
+    """
+    if profiles is None:
+        profile = _current.get()
+        if profile is None:
+            return fn
+        profiles = (profile,)
+    else:
+        profiles = tuple(profiles)
+        if not profiles:
+            return fn
+    return functools.partial(_run_bound, profiles, fn)
+
+
+def _run_bound(profiles, fn, *args, **kwargs):
+    thread_id = threading.get_ident()
+    profiler.attach(thread_id, profiles)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.detach(thread_id, profiles)
+
+
+class Profiler:
+    """Decides which requests to profile and samples their threads"""
+
+    def __init__(
+        self,
+        token: str = PROFILE_TOKEN,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        interval_ms: float = PROFILE_INTERVAL_MS,
+        output_format: str = PROFILE_FORMAT,
+        directory=PROFILE_DIR,
+        max_active: int = PROFILE_MAX_ACTIVE,
+        keep: int = PROFILE_KEEP,
+    ):
+        if output_format not in FILE_SUFFIXES:
+            raise ValueError(f"Unknown PROFILE_FORMAT {output_format!r}; expected one of {', '.join(FILE_SUFFIXES)}")
+        self.token = token
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self.interval = max(0.1, float(interval_ms)) / 1000.0
+        self.output_format = output_format
+        self.directory = Path(directory)
+        self.max_active = max(1, int(max_active))
+        self.keep = max(1, int(keep))
+        self._active: Set[Profile] = set()
+        # Worker thread id -> profiles it is working for
+        self._threads: Dict[int, List[Profile]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._code_labels: Dict[object, Frame] = {}
+        self.profiled = 0
+        self.skipped_busy = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token) or self.sample_rate > 0
+
+    def check_token(self, token: Optional[str]) -> bool:
+        return bool(self.token) and token is not None and hmac.compare_digest(token, self.token)
+
+    def reason(self, scope) -> Optional[str]:
+        """Why this request should be profiled ("token" or "sampled"), or None."""
+        if self.token:
+            for name, value in scope.get("headers", ()):
+                if name == TOKEN_HEADER:
+                    if self.check_token(value.decode("latin-1")):
+                        return "token"
+                    break
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def start(self, profile: Profile) -> bool:
+        """Begin sampling for a request; False when PROFILE_MAX_ACTIVE are already running."""
+        with self._lock:
+            if len(self._active) >= self.max_active:
+                self.skipped_busy += 1
+                return False
+            self._active.add(profile)
+            self.profiled += 1
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+                self._sampler.start()
+        self._wake.set()
+        return True
+
+    def finish(self, profile: Profile) -> None:
+        with self._lock:
+            self._active.discard(profile)
+        profile.duration = time.perf_counter() - profile.started
+
+    def attach(self, thread_id: int, profiles: Tuple[Profile, ...]) -> None:
+        with self._lock:
+            self._threads.setdefault(thread_id, []).extend(profiles)
+
+    def detach(self, thread_id: int, profiles: Tuple[Profile, ...]) -> None:
+        with self._lock:
+            attached = self._threads.get(thread_id, [])
+            for profile in profiles:
+                attached.remove(profile)
+            if not attached:
+                self._threads.pop(thread_id, None)
+
+    def save(self, profile: Profile) -> Path:
+        """Write a finished profile to PROFILE_DIR, dropping the oldest files beyond PROFILE_KEEP."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{profile.id}{FILE_SUFFIXES[self.output_format]}"
+        if self.output_format == FORMAT_SPEEDSCOPE:
+            content = json.dumps(profile.speedscope(self.interval * 1000))
+        else:
+            content = profile.collapsed()
+        with open(path, "w") as f:
+            f.write(content)
+        saved = sorted(self.directory.glob("*-*"), key=lambda p: p.stat().st_mtime)
+        for old in saved[:-self.keep]:
+            try:
+                old.unlink()
+            except FileNotFoundError:
+                pass
+        return path
+
+    def find(self, profile_id: str) -> Optional[Path]:
+        """The saved file of a profile, if it is still kept."""
+        for suffix in FILE_SUFFIXES.values():
+            path = self.directory / f"{profile_id}{suffix}"
+            # The id is client input: only plain names inside PROFILE_DIR
+            if path.parent == self.directory and path.is_file():
+                return path
+        return None
+
+    def list(self) -> List[Dict]:
+        """Saved profiles, newest first."""
+        if not self.directory.is_dir():
+            return []
+        paths = sorted(self.directory.glob("*-*"), key=lambda p: p.stat().st_mtime, reverse=True)
+        return [
+            {"profile_id": path.name.split(".", 1)[0], "file": path.name, "bytes": path.stat().st_size}
+            for path in paths
+        ]
+
+    def stats(self) -> Dict:
+        return {
+            "token_enabled": bool(self.token),
+            "sample_rate": self.sample_rate,
+            "interval_ms": self.interval * 1000,
+            "format": self.output_format,
+            "active": len(self._active),
+            "max_active": self.max_active,
+            "profiled": self.profiled,
+            "skipped_busy": self.skipped_busy,
+        }
+
+    def _sample_loop(self) -> None:
+        """Sample while any request is profiled; exit when none has been for a second."""
+        idle_since = None
+        while True:
+            with self._lock:
+                active = list(self._active)
+                threads = [(thread_id, list(profiles)) for thread_id, profiles in self._threads.items()]
+            if not active:
+                idle_since = idle_since or time.monotonic()
+                if time.monotonic() - idle_since > 1.0:
+                    with self._lock:
+                        if not self._active:
+                            self._sampler = None
+                            return
+                self._wake.clear()
+                self._wake.wait(0.1)
+                continue
+            idle_since = None
+            self._sample(active, threads)
+            time.sleep(self.interval)
+
+    def _sample(self, active: List[Profile], threads: List[Tuple[int, List[Profile]]]) -> None:
+        frames = sys._current_frames()
+        names = {thread.ident: _thread_role(thread.name) for thread in threading.enumerate()}
+        taken = []
+        for thread_id, profiles in threads:
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            stack = self._stack(frame)
+            for profile in profiles:
+                taken.append((profile, names.get(thread_id, "thread"), stack))
+        for profile in active:
+            frame = frames.get(profile.loop_thread)
+            # The loop thread is shared: count it only while this request's task runs
+            if frame is None or profile.task is None or asyncio.current_task(profile.task.get_loop()) is not profile.task:
+                continue
+            taken.append((profile, EVENT_LOOP_THREAD, self._stack(frame)))
+        with self._lock:
+            # Skips requests finished meanwhile, whose samples may be being saved
+            for profile, thread_name, stack in taken:
+                if profile in self._active:
+                    profile.add(thread_name, stack)
+
+    def _stack(self, frame) -> Tuple[Frame, ...]:
+        stack = []
+        labels = self._code_labels
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = (code.co_name, code.co_filename, code.co_firstlineno)
+            stack.append(label)
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+
+def _thread_role(name: str) -> str:
+    """decode_0 -> decode; pool threads of one kind are merged in the output."""
+    prefix, _, suffix = name.rpartition("_")
+    return prefix if prefix and suffix.isdigit() else name
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: profiles opted-in requests and returns X-Profile-Id"""
+
+    def __init__(self, app, profiler: Profiler = profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+        reason = self.profiler.reason(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope.get("method", ""), scope.get("path", ""), reason)
+        profile.loop_thread = threading.get_ident()
+        profile.task = asyncio.current_task()
+        if not self.profiler.start(profile):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_ID_HEADER, profile.id.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        token = _current.set(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current.reset(token)
+            self.profiler.finish(profile)
+            try:
+                # Default thread pool: the bounded pools are for request work
+                await asyncio.get_running_loop().run_in_executor(None, self.profiler.save, profile)
+            except Exception as e:
+                print(f"WARNING: could not save profile {profile.id}: {e}")
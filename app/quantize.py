@@ -0,0 +1,211 @@
+"""
+Post-training quantization of the Keras model to int8 and float16 TFLite.
+
+    python -m app.quantize                           # both variants
+    python -m app.quantize --variants int8 --max-disagreement 0.005
+
+The int8 variant is calibrated on stored uploads (UPLOAD_DIR). Up to
+--eval-count of the uploads not used for calibration form the evaluation set,
+on which every variant is compared with the float Keras model. They are
+decoded EVAL_BATCH_SIZE at a time, so memory does not grow with the set:
+
+- decision disagreement: share of images where is_authentic at
+  CONFIDENCE_THRESHOLD differs from the float model's decision
+- max absolute difference in the real-signature confidence
+- model size and median latency for a single image and a full signature set
+
+A variant whose disagreement exceeds QUANTIZATION_MAX_DISAGREEMENT (or
+--max-disagreement) is not published. A published variant is written to
+cnn_sign_model.<variant>.tflite and served with INFERENCE_BACKEND=tflite and
+TFLITE_VARIANT=<variant>. Every run writes its report next to it as
+cnn_sign_model.<variant>.json, whether or not the variant was published.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from app.config import (
+    BASE_DIR,
+    CONFIDENCE_THRESHOLD,
+    MODEL_PATH,
+    QUANTIZATION_MAX_DISAGREEMENT,
+    UPLOAD_DIR,
+)
+from app.convert_model import list_images, load_batch
+
+VARIANTS = ("int8", "float16")
+
+# Batch sizes timed for the report: one upload, and one signature set
+LATENCY_BATCH_SIZES = (1, 7)
+
+# Evaluation images decoded and predicted at a time
+EVAL_BATCH_SIZE = 64
+
+
+def variant_path(variant: str, extension: str = "tflite") -> str:
+    return str(BASE_DIR / f"cnn_sign_model.{variant}.{extension}")
+
+
+def quantize(keras_model, variant: str, calibration: np.ndarray) -> bytes:
+    """Convert keras_model to a quantized TFLite flatbuffer."""
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+        if len(calibration) == 0:
+            raise ValueError("int8 quantization needs calibration images; none were found")
+
+        def representative_dataset():
+            for image in calibration:
+                yield [image[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+        # Integer kernels throughout; inputs and outputs stay float32 so the
+        # TFLite engine feeds it exactly like the float model
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError(f"Unknown variant {variant!r}; expected one of {', '.join(VARIANTS)}")
+    return converter.convert()
+
+
+def median_latency_ms(engine, images: np.ndarray, repeats: int) -> Dict[str, float]:
+    """Median wall time of engine.predict for each LATENCY_BATCH_SIZES size."""
+    latencies = {}
+    for size in LATENCY_BATCH_SIZES:
+        # Repeat the evaluation images to fill the batch
+        batch = np.resize(images, (size,) + images.shape[1:])
+        engine.predict(batch)  # warm-up
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            engine.predict(batch)
+            timings.append((time.perf_counter() - started) * 1000)
+        latencies[f"batch_{size}"] = round(float(np.median(timings)), 3)
+    return latencies
+
+
+def compare(reference_predictions: np.ndarray, predictions: np.ndarray, threshold: float) -> Dict[str, float]:
+    """Decision disagreement and confidence drift versus the float model."""
+    expected = reference_predictions[:, 0] >= threshold
+    actual = predictions[:, 0] >= threshold
+    return {
+        "images": int(len(predictions)),
+        "disagreements": int(np.count_nonzero(expected != actual)),
+        "disagreement_rate": float(np.mean(expected != actual)) if len(predictions) else 0.0,
+        "max_abs_difference": float(np.max(np.abs(predictions[:, 0] - reference_predictions[:, 0]))) if len(predictions) else 0.0,
+    }
+
+
+def predict_paths(engine, paths: List[str]) -> np.ndarray:
+    """engine.predict over the images at `paths`, decoding EVAL_BATCH_SIZE of them at a time."""
+    predictions = []
+    for start in range(0, len(paths), EVAL_BATCH_SIZE):
+        batch = load_batch(paths[start:start + EVAL_BATCH_SIZE])
+        if len(batch):
+            predictions.append(np.asarray(engine.predict(batch)))
+    return np.concatenate(predictions) if predictions else np.empty((0, 2), dtype=np.float32)
+
+
+def split_uploads(image_dir: str, calibration_count: int, seed: int, evaluation_count: int):
+    """Shuffle stored uploads into calibration and evaluation path lists."""
+    paths = list_images(image_dir)
+    np.random.default_rng(seed).shuffle(paths)
+    calibration = paths[:calibration_count]
+    evaluation = paths[calibration_count:calibration_count + evaluation_count]
+    if not evaluation:
+        # Too few uploads to hold any out; evaluating on seen images is better than nothing
+        print("WARNING: no uploads left for evaluation; evaluating on the calibration images")
+        evaluation = calibration
+    return calibration, evaluation
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=MODEL_PATH, help="Float Keras .h5 model")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--images", default=str(UPLOAD_DIR), help="Directory of stored uploads")
+    parser.add_argument("--calibration-count", type=int, default=200)
+    parser.add_argument("--eval-count", type=int, default=500, help="Held-out uploads to compare the variants on")
+    parser.add_argument("--max-disagreement", type=float, default=QUANTIZATION_MAX_DISAGREEMENT)
+    parser.add_argument("--threshold", type=float, default=CONFIDENCE_THRESHOLD)
+    parser.add_argument("--repeats", type=int, default=20, help="Timed runs per latency measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from app.engines import KerasEngine, TFLiteEngine
+
+    reference = KerasEngine(args.model, cache_dir="")
+    calibration_paths, evaluation_paths = split_uploads(
+        args.images, args.calibration_count, args.seed, args.eval_count
+    )
+    calibration = load_batch(calibration_paths)
+    reference_predictions = predict_paths(reference, evaluation_paths)
+    # Latency is timed on the first few evaluation images
+    latency_images = load_batch(evaluation_paths[:EVAL_BATCH_SIZE])
+    if len(reference_predictions) == 0 or len(latency_images) == 0:
+        print(f"No readable images in {args.images}; cannot run the accuracy gate")
+        return 1
+    print(f"Calibration images: {len(calibration)}, evaluation images: {len(reference_predictions)}")
+
+    float_report = {
+        "size_bytes": os.path.getsize(args.model),
+        "latency_ms": median_latency_ms(reference, latency_images, args.repeats),
+    }
+    print(f"float: {float_report['size_bytes']} bytes, latency {float_report['latency_ms']}")
+
+    all_published = True
+    for variant in args.variants:
+        path = variant_path(variant)
+        staging = f"{path}.tmp-{os.getpid()}"
+        with open(staging, "wb") as f:
+            f.write(quantize(reference.keras_model, variant, calibration))
+
+        try:
+            engine = TFLiteEngine(staging)
+            predictions = predict_paths(engine, evaluation_paths)
+            report = {
+                "variant": variant,
+                "created_at": datetime.now().isoformat(),
+                "source_model": os.path.basename(args.model),
+                "threshold": args.threshold,
+                "max_disagreement": args.max_disagreement,
+                "calibration_images": int(len(calibration)),
+                "size_bytes": os.path.getsize(staging),
+                "latency_ms": median_latency_ms(engine, latency_images, args.repeats),
+                "float": float_report,
+                **compare(reference_predictions, predictions, args.threshold),
+            }
+            report["published"] = report["disagreement_rate"] <= args.max_disagreement
+            if report["published"]:
+                os.replace(staging, path)
+        finally:
+            if os.path.exists(staging):
+                os.remove(staging)
+
+        with open(variant_path(variant, "json"), "w") as f:
+            json.dump(report, f, indent=2)
+
+        verdict = f"published to {path}" if report["published"] else "NOT published (over the disagreement budget)"
+        print(
+            f"{variant}: {report['size_bytes']} bytes, latency {report['latency_ms']}, "
+            f"disagreement {report['disagreements']}/{report['images']} "
+            f"({report['disagreement_rate']:.2%}, budget {args.max_disagreement:.2%}), "
+            f"max confidence drift {report['max_abs_difference']:.4f}: {verdict}"
+        )
+        all_published = all_published and report["published"]
+
+    return 0 if all_published else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Content-addressed cache of model predictions.
+
+Entries are keyed by the SHA-256 of the decoded image bytes together with the
+model version and the decision threshold, hold the raw (real, fake) prediction
+row and expire by LRU order (RESULT_CACHE_SIZE) and age (RESULT_CACHE_TTL_SECONDS).
+Because results are rebuilt from the stored row with the same scoring code, a
+hit yields exactly the fields a fresh prediction would.
+
+Identical images that are already being predicted by another request are not
+predicted again: the later request waits for the first one (single-flight).
+
+The cache is only touched from the event loop thread, so it needs no locking.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.config import RESULT_CACHE_SIZE, RESULT_CACHE_TTL_SECONDS
+
+
+def image_digest(image_bytes) -> str:
+    """SHA-256 of raw image bytes (runs on the decode pool for large uploads)."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def model_version_from_file(model_path: str) -> str:
+    """Derive a model version from the weights file name, size and mtime."""
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return "unknown"
+    return f"{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+class PredictionCache:
+    """LRU + TTL cache of prediction rows with request coalescing"""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl_seconds: float = RESULT_CACHE_TTL_SECONDS):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.model_version = "unknown"
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def make_key(self, digest: str, threshold: float) -> str:
+        return f"{digest}:{self.model_version}:{threshold!r}"
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return a cached prediction row, or None if absent or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, row = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return row
+
+    def put(self, key: str, row: np.ndarray) -> None:
+        if not self.enabled:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, np.array(row, copy=True))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "model_version": self.model_version,
+        }
+
+    async def resolve(
+        self,
+        keys: Sequence[Optional[str]],
+        compute: Callable[[List[int]], Awaitable[np.ndarray]],
+    ) -> np.ndarray:
+        """
+        Return the (N, 2) prediction rows for `keys`. Hits are served from the
+        cache, keys already in flight are awaited, and compute(indices) is called
+        once with the indices of everything else. A None key is never cached.
+        """
+        loop = asyncio.get_running_loop()
+        rows: List[Optional[np.ndarray]] = [None] * len(keys)
+        waiting: Dict[int, asyncio.Future] = {}
+        owned: Dict[str, asyncio.Future] = {}
+        missing: List[int] = []
+
+        for i, key in enumerate(keys):
+            if key is None:
+                missing.append(i)
+                continue
+            row = self.get(key)
+            if row is not None:
+                self.hits += 1
+                rows[i] = row
+            elif key in owned:
+                # Same image twice in one request
+                waiting[i] = owned[key]
+            elif key in self._inflight:
+                self.coalesced += 1
+                waiting[i] = self._inflight[key]
+            else:
+                self.misses += 1
+                future = loop.create_future()
+                self._inflight[key] = future
+                owned[key] = future
+                missing.append(i)
+
+        if missing:
+            try:
+                predictions = await compute(missing)
+            except BaseException as e:
+                self._fail(owned, e)
+                raise
+            for i, row in zip(missing, predictions):
+                rows[i] = row
+                key = keys[i]
+                if key is not None:
+                    self.put(key, row)
+                    self._inflight.pop(key, None)
+                    if not owned[key].done():
+                        owned[key].set_result(row)
+
+        for i, future in waiting.items():
+            # Shield so our cancellation does not cancel another request's future
+            rows[i] = await asyncio.shield(future)
+
+        return np.stack(rows) if rows else np.empty((0, 2), dtype=np.float32)
+
+    def _fail(self, owned: Dict[str, asyncio.Future], error: BaseException) -> None:
+        """Propagate a failed computation to requests coalesced onto it."""
+        if isinstance(error, asyncio.CancelledError):
+            error = RuntimeError("The request computing this image was cancelled")
+        for key, future in owned.items():
+            self._inflight.pop(key, None)
+            if not future.done():
+                future.set_exception(error)
+                # Mark as retrieved so unobserved failures are not logged
+                future.exception()
@@ -0,0 +1,239 @@
+"""
+Background retention for uploaded files and stored records.
+
+Each collection has a policy with a maximum age (TTL, in days) and a maximum
+count; 0 disables either limit. The collections are:
+
+- uploads: the per-set directories under UPLOAD_DIR
+- signature sets: records from /verify-signature-set (their upload directory
+  is removed with them)
+- verifications: records from /verify-student-signatures
+
+A daemon thread sweeps every RETENTION_INTERVAL_SECONDS. Expired records are
+found in one scan per collection and deleted in small chunks (in one batch on
+the json engine, which rewrites its whole file on every write). After
+RETENTION_SLICE_MS of work the sweeper pauses for RETENTION_PAUSE_MS, so it
+never holds the GIL or the database locks long enough to be noticed by
+requests. Counters for bytes reclaimed and records
+evicted are available from stats().
+"""
+
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from app.config import (
+    RETENTION_INTERVAL_SECONDS,
+    RETENTION_PAUSE_MS,
+    RETENTION_SETS_MAX_COUNT,
+    RETENTION_SETS_TTL_DAYS,
+    RETENTION_SLICE_MS,
+    RETENTION_UPLOADS_MAX_COUNT,
+    RETENTION_UPLOADS_TTL_DAYS,
+    RETENTION_VERIFICATIONS_MAX_COUNT,
+    RETENTION_VERIFICATIONS_TTL_DAYS,
+    UPLOAD_DIR,
+)
+from app.database import KIND_SIGNATURE_SET, KIND_VERIFICATION
+
+# Records or directories handled between time-budget checks
+CHUNK_SIZE = 20
+
+
+class RetentionPolicy(NamedTuple):
+    ttl_days: float = 0
+    max_count: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_days > 0 or self.max_count > 0
+
+
+def directory_size(path: str) -> int:
+    """Total size in bytes of the files under a directory."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class RetentionSweeper:
+    """Deletes expired uploads and records in small, time-bounded slices"""
+
+    def __init__(
+        self,
+        db,
+        upload_dir=UPLOAD_DIR,
+        uploads_policy: RetentionPolicy = RetentionPolicy(RETENTION_UPLOADS_TTL_DAYS, RETENTION_UPLOADS_MAX_COUNT),
+        record_policies: Dict[str, RetentionPolicy] = None,
+        interval_seconds: float = RETENTION_INTERVAL_SECONDS,
+        slice_ms: float = RETENTION_SLICE_MS,
+        pause_ms: float = RETENTION_PAUSE_MS,
+        on_evict: Optional[Callable[[List[str]], object]] = None,
+    ):
+        self.db = db
+        # Called with the ids of evicted records (e.g. to drop them from an index)
+        self.on_evict = on_evict
+        self.upload_dir = str(upload_dir)
+        self.uploads_policy = uploads_policy
+        if record_policies is None:
+            record_policies = {
+                KIND_SIGNATURE_SET: RetentionPolicy(RETENTION_SETS_TTL_DAYS, RETENTION_SETS_MAX_COUNT),
+                KIND_VERIFICATION: RetentionPolicy(RETENTION_VERIFICATIONS_TTL_DAYS, RETENTION_VERIFICATIONS_MAX_COUNT),
+            }
+        self.record_policies = record_policies
+        self.interval = interval_seconds
+        self.slice_budget = slice_ms / 1000.0
+        self.pause = pause_ms / 1000.0
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "sweeps": 0,
+            "records_evicted": {kind: 0 for kind in self.record_policies},
+            "upload_dirs_removed": 0,
+            "bytes_reclaimed": 0,
+            "last_sweep_seconds": 0.0,
+            "last_sweep_at": None,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.uploads_policy.enabled or any(p.enabled for p in self.record_policies.values())
+
+    def start(self) -> None:
+        """Start the background sweeper thread (no-op if no policy is enabled)."""
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["records_evicted"] = dict(self._stats["records_evicted"])
+        stats["policies"] = {
+            "uploads": self.uploads_policy._asdict(),
+            **{kind: policy._asdict() for kind, policy in self.record_policies.items()},
+        }
+        return stats
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.sweep_once()
+            except Exception as e:
+                print(f"ERROR during retention sweep: {e}")
+            self._stop.wait(self.interval)
+
+    def sweep_once(self) -> None:
+        """Run one full pass over every enabled policy."""
+        started = time.monotonic()
+        slice_started = started
+        for _ in self._work():
+            if self._stop.is_set():
+                break
+            if time.monotonic() - slice_started >= self.slice_budget:
+                # Yield to request handling before the next slice
+                self._stop.wait(self.pause)
+                slice_started = time.monotonic()
+
+        with self._stats_lock:
+            self._stats["sweeps"] += 1
+            self._stats["last_sweep_seconds"] = round(time.monotonic() - started, 3)
+            self._stats["last_sweep_at"] = datetime.now().isoformat()
+
+    def _work(self) -> Iterator[None]:
+        """Yields after each chunk of deletions so the caller can enforce the time budget."""
+        for kind, policy in self.record_policies.items():
+            if policy.enabled:
+                yield from self._expire_records(kind, policy)
+        if self.uploads_policy.enabled:
+            yield from self._expire_uploads(self.uploads_policy)
+
+    def _expire_records(self, kind: str, policy: RetentionPolicy) -> Iterator[None]:
+        # Collect everything that has to go in one scan, then delete it in batches
+        total = self.db.count(kind)
+        if total == 0:
+            return
+        expired = []
+        if policy.ttl_days > 0:
+            cutoff = (datetime.now() - timedelta(days=policy.ttl_days)).isoformat()
+            page, _ = self.db.query(kind=kind, date_to=cutoff, limit=total, oldest_first=True)
+            expired = [item_id for item_id, _ in page]
+        if policy.max_count > 0 and total - len(expired) > policy.max_count:
+            # Oldest records beyond the cap, on top of those already expired
+            page, _ = self.db.query(kind=kind, limit=total - policy.max_count, oldest_first=True)
+            expired = [item_id for item_id, _ in page]
+        if not expired:
+            return
+        yield
+
+        # The json engine rewrites its whole file per delete: one batch only
+        batch = len(expired) if getattr(self.db, "full_rewrite", False) else CHUNK_SIZE
+        for start in range(0, len(expired), batch):
+            if self._stop.is_set():
+                return
+            yield from self._evict(kind, expired[start:start + batch])
+
+    def _evict(self, kind: str, item_ids: List[str]) -> Iterator[None]:
+        evicted = self.db.delete_many(item_ids)
+        with self._stats_lock:
+            self._stats["records_evicted"][kind] += evicted
+        if self.on_evict is not None:
+            self.on_evict(item_ids)
+        yield
+        if kind == KIND_SIGNATURE_SET:
+            for start in range(0, len(item_ids), CHUNK_SIZE):
+                for item_id in item_ids[start:start + CHUNK_SIZE]:
+                    self._remove_upload_dir(os.path.join(self.upload_dir, item_id))
+                yield
+
+    def _remove_upload_dir(self, path: str) -> None:
+        if not os.path.isdir(path):
+            return
+        size = directory_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+        with self._stats_lock:
+            self._stats["upload_dirs_removed"] += 1
+            self._stats["bytes_reclaimed"] += size
+
+    def _expire_uploads(self, policy: RetentionPolicy) -> Iterator[None]:
+        try:
+            entries = [
+                (entry.stat().st_mtime, entry.path)
+                for entry in os.scandir(self.upload_dir)
+                if entry.is_dir(follow_symlinks=False)
+            ]
+        except FileNotFoundError:
+            return
+        entries.sort()
+
+        expired = []
+        if policy.ttl_days > 0:
+            cutoff = time.time() - policy.ttl_days * 86400
+            expired = [path for mtime, path in entries if mtime < cutoff]
+        if policy.max_count > 0 and len(entries) - len(expired) > policy.max_count:
+            # Oldest directories beyond the cap, on top of those already expired
+            expired = [path for _, path in entries[:len(entries) - policy.max_count]]
+
+        for start in range(0, len(expired), CHUNK_SIZE):
+            if self._stop.is_set():
+                return
+            for path in expired[start:start + CHUNK_SIZE]:
+                self._remove_upload_dir(path)
+            yield
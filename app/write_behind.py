@@ -0,0 +1,233 @@
+"""
+Write-behind persistence for verification records and uploaded files.
+
+Request handlers hand records and file contents to a WriteBehindQueue and
+return without waiting for the disk. A background writer thread collects
+them and flushes a batch when WRITE_BEHIND_BATCH_SIZE items are pending or
+the oldest has waited WRITE_BEHIND_FLUSH_MS. Records in a batch are written
+with one database call (create_many).
+
+- Read-your-writes: get() answers from the pending records first, and
+  query() merges them into the database's listing page, so a record is
+  visible as soon as it is queued.
+- Overload: once WRITE_BEHIND_MAX_PENDING items (records plus files) are
+  queued, new ones are refused with ExecutorBusyError (503 + Retry-After) instead of growing
+  memory without bound.
+- Failures: a batch that fails to write stays queued and is retried.
+- Shutdown: close() flushes everything still queued before returning.
+
+Queued items are lost if the process is killed before they are flushed, so
+write-behind is off by default (WRITE_BEHIND=True turns it on).
+"""
+
+import os
+import threading
+import time
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import metrics
+from app.config import WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_MS, WRITE_BEHIND_MAX_PENDING
+from app.database import decode_cursor, encode_cursor, record_date, record_matches
+from app.executors import ExecutorBusyError
+
+# Seconds to wait before retrying a batch that failed to write
+RETRY_DELAY = 1.0
+
+
+class WriteBehindQueue:
+    """Queues database records and files and writes them in background batches"""
+
+    def __init__(
+        self,
+        db,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        flush_ms: float = WRITE_BEHIND_FLUSH_MS,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+    ):
+        self.db = db
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_ms)) / 1000.0
+        self.max_pending = max(1, int(max_pending))
+
+        # _lock guards the pending items; _flush_lock makes a batch write and a
+        # delete of the same item mutually exclusive
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._records: Dict[str, Dict[str, Any]] = {}
+        # Records of the batch being written, still served by get()
+        self._flushing: Dict[str, Dict[str, Any]] = {}
+        self._files: Dict[str, bytes] = {}
+        self._oldest: Optional[float] = None
+        self._closing = False
+
+        self.stats = {
+            "flushed_records": 0,
+            "flushed_files": 0,
+            "batches": 0,
+            "rejected": 0,
+            "errors": 0,
+            "last_flush_ms": 0.0,
+        }
+        self._writer = threading.Thread(target=self._writer_loop, name="write-behind", daemon=True)
+        self._writer.start()
+
+    @property
+    def pending(self) -> int:
+        return len(self._records) + len(self._files)
+
+    def create(
+        self,
+        item_id: str,
+        item_data: Dict[str, Any],
+        files: Optional[Dict[str, bytes]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Queue a record, and optionally the files that belong to it ({path:
+        contents}; parent directories are created), for writing. All of them
+        are accepted or refused together. The record is visible through get()
+        immediately.
+        """
+        files = {str(path): data for path, data in (files or {}).items()}
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("The write-behind queue is closed")
+            if self.pending + 1 + len(files) > self.max_pending:
+                self.stats["rejected"] += 1
+                raise ExecutorBusyError("persistence")
+            self._files.update(files)
+            self._records[item_id] = item_data
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._cond.notify()
+        return item_data
+
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        """Get a record, including one that is queued but not yet written."""
+        with self._lock:
+            item_data = self._records.get(item_id) or self._flushing.get(item_id)
+        if item_data is not None:
+            return item_data
+        return self.db.get(item_id)
+
+    def query(self, limit: int = 100, cursor: Optional[str] = None, oldest_first: bool = False, **filters):
+        """
+        The database's query() page with matching queued records merged in,
+        in the same order and with a cursor that stays valid across flushes.
+        """
+        after = decode_cursor(cursor) if cursor else None
+        with self._lock:
+            queued = {**self._flushing, **self._records}
+        queued = {
+            item_id: item_data
+            for item_id, item_data in queued.items()
+            if record_matches(item_id, item_data, after=after, oldest_first=oldest_first, **filters)
+        }
+        page, next_cursor = self.db.query(limit=limit, cursor=cursor, oldest_first=oldest_first, **filters)
+        if not queued:
+            return page, next_cursor
+
+        merged = {item_id: item_data for item_id, item_data in page}
+        merged.update(queued)
+        rows = sorted(merged.items(), key=lambda row: (record_date(row[1]), row[0]), reverse=not oldest_first)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(record_date(rows[-1][1]), rows[-1][0])
+        return rows, next_cursor
+
+    def delete(self, item_id: str) -> bool:
+        """Delete a record whether or not it has been written yet."""
+        with self._flush_lock:
+            with self._lock:
+                was_pending = self._records.pop(item_id, None) is not None
+            return self.db.delete(item_id) or was_pending
+
+    def discard_files(self, directory: str) -> int:
+        """Drop queued files under a directory (e.g. a deleted set). Returns how many."""
+        prefix = os.path.join(str(directory), "")
+        with self._flush_lock:
+            with self._lock:
+                paths = [path for path in self._files if path.startswith(prefix)]
+                for path in paths:
+                    del self._files[path]
+        return len(paths)
+
+    def close(self) -> None:
+        """Flush everything still queued and stop the writer thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._writer.join()
+
+    def _writer_loop(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._closing or self.pending >= self.batch_size:
+                        break
+                    if self._oldest is not None:
+                        remaining = self._oldest + self.flush_interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closing and not self.pending:
+                    return
+
+            if not self._flush():
+                if self._closing:
+                    # Do not retry forever on shutdown
+                    print(f"ERROR: dropping {self.pending} queued writes on shutdown")
+                    return
+                time.sleep(RETRY_DELAY)
+
+    def _flush(self) -> bool:
+        """Write one batch. Returns False if it failed (the items stay queued)."""
+        started = time.monotonic()
+        with self._flush_lock:
+            with self._lock:
+                records = self._take(self._records)
+                files = self._take(self._files)
+                self._flushing = dict(records)
+                self._oldest = time.monotonic() if self.pending else None
+
+            try:
+                for path, data in files:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, "wb") as f:
+                        f.write(data)
+                if records:
+                    self.db.create_many(self._flushing)
+            except Exception as e:
+                print(f"ERROR flushing write-behind batch: {e}")
+                with self._lock:
+                    self._flushing = {}
+                    self.stats["errors"] += 1
+                    # Requeue unless a newer write replaced the item meanwhile
+                    for item_id, item_data in records:
+                        self._records.setdefault(item_id, item_data)
+                    for path, data in files:
+                        self._files.setdefault(path, data)
+                    if self._oldest is None:
+                        self._oldest = time.monotonic()
+                return False
+
+            with self._lock:
+                self._flushing = {}
+
+        with self._lock:
+            self.stats["flushed_records"] += len(records)
+            self.stats["flushed_files"] += len(files)
+            self.stats["batches"] += 1
+            self.stats["last_flush_ms"] = round((time.monotonic() - started) * 1000, 3)
+        metrics.PERSIST_FLUSH_SECONDS.observe(time.monotonic() - started)
+        return True
+
+    def _take(self, table: Dict) -> List[Tuple[str, Any]]:
+        """Remove and return up to batch_size items, oldest first (caller holds _lock)."""
+        items = []
+        for key in list(islice(table, self.batch_size)):
+            items.append((key, table.pop(key)))
+        return items
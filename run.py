@@ -1,9 +1,14 @@
 import uvicorn
 import os
-from app.config import API_HOST, DEBUG
+from app.config import API_HOST, DEBUG, SERVE_MODE, WEB_WORKERS
 
 if __name__ == "__main__":
     # Railway sets PORT environment variable, use it if available
     port = int(os.environ.get("PORT", 8000))
-    print(f"Starting server on port {port}")
-    uvicorn.run("app.main:app", host=API_HOST, port=port, reload=DEBUG) 
\ No newline at end of file
+    if SERVE_MODE == "prefork":
+        from app.prefork import serve
+        print(f"Starting {WEB_WORKERS} prefork workers on port {port}")
+        serve(API_HOST, port, WEB_WORKERS)
+    else:
+        print(f"Starting server on port {port}")
+        uvicorn.run("app.main:app", host=API_HOST, port=port, reload=DEBUG)
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# app.config creates its data directories on import: keep them out of the tree
+_data_dir = Path(tempfile.mkdtemp(prefix="signature-tests-"))
+for name in ("UPLOAD_DIR", "DB_DIR", "JOBS_DIR", "EMBEDDINGS_DIR", "PROFILE_DIR"):
+    os.environ.setdefault(name, str(_data_dir / name.lower()))
+os.environ.setdefault("INFERENCE_BACKEND", "mock")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(scope="session")
+def client():
+    """
+    The API with its model loaded (the mock model unless INFERENCE_BACKEND
+    says otherwise). Shared by the whole session, because shutting the app
+    down also shuts down the executors that other tests use.
+    """
+    from fastapi.testclient import TestClient
+
+    from app.main import app, model_loader
+
+    with TestClient(app) as client:
+        assert model_loader.wait(30)
+        yield client
@@ -0,0 +1,30 @@
+"""Synthetic signature images for the tests."""
+
+import cv2
+import numpy as np
+
+
+def signature(seed: int, width: int = 600, height: int = 250, thickness: int = None, jitter: float = 0.0) -> np.ndarray:
+    """
+    A pen stroke wandering across white paper (BGR). The same seed draws the
+    same path; `jitter` moves every point by that many pixels (std dev), like
+    a careful tracing of it.
+    """
+    path_rng = np.random.default_rng(seed)
+    jitter_rng = np.random.default_rng(seed + 1_000_000)
+    image = np.full((height, width), 255, np.uint8)
+    x, y = path_rng.uniform(0.05, 0.2) * width, height / 2
+    points = []
+    for _ in range(path_rng.integers(25, 60)):
+        x += path_rng.uniform(2, 18) * width / 600
+        y = float(np.clip(y + path_rng.normal(0, 25) * height / 250, 0.15 * height, 0.85 * height))
+        points.append((x + jitter_rng.normal(0, jitter), y + jitter_rng.normal(0, jitter)))
+    if thickness is None:
+        thickness = int(path_rng.integers(2, 5))
+    cv2.polylines(image, [np.array(points, np.int32)], False, 0, thickness, cv2.LINE_AA)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+
+def encode(image: np.ndarray, ext: str = ".png", quality: int = 95) -> bytes:
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if ext == ".jpg" else []
+    return cv2.imencode(ext, image, params)[1].tobytes()
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from app.batching import BatchScheduler
+from app.executors import ExecutorBusyError
+from signatures import encode, signature
+
+
+class RecordingModel:
+    """Predicts each image's id (its first pixel) and records the batches it saw."""
+
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def predict(self, images):
+        ids = images[:, 0, 0, 0].astype(np.float32)
+        with self.lock:
+            self.batches.append(ids.astype(int).tolist())
+        return np.stack([ids, -ids], axis=1)
+
+
+def images(*ids) -> np.ndarray:
+    batch = np.zeros((len(ids), 224, 224, 3), np.float32)
+    batch[:, 0, 0, 0] = ids
+    return batch
+
+
+def test_background_work_is_queued_in_batch_sized_chunks():
+    model = RecordingModel()
+    scheduler = BatchScheduler(model, max_batch_size=4, max_wait_ms=5)
+
+    async def scenario():
+        job = asyncio.create_task(scheduler.predict(images(*range(100, 110)), background=True))
+        await asyncio.sleep(0)
+        interactive = await scheduler.predict(images(1))
+        return await job, interactive
+
+    job, interactive = asyncio.run(scenario())
+
+    assert job[:, 0].tolist() == list(range(100, 110))
+    assert interactive[:, 0].tolist() == [1]
+    assert all(len(batch) <= 4 for batch in model.batches)
+    # The interactive image went in right after the first background chunk
+    assert model.batches.index([1]) <= 1
+
+
+def test_concurrent_requests_share_a_batch_and_get_their_own_rows():
+    model = RecordingModel()
+    scheduler = BatchScheduler(model, max_batch_size=8, max_wait_ms=50)
+
+    async def scenario():
+        return await asyncio.gather(
+            scheduler.predict(images(1, 2, 3)),
+            scheduler.predict(images(4)),
+            scheduler.predict(images(5, 6)),
+        )
+
+    results = asyncio.run(scenario())
+
+    assert [result[:, 0].tolist() for result in results] == [[1, 2, 3], [4], [5, 6]]
+    assert [result[:, 1].tolist() for result in results] == [[-1, -2, -3], [-4], [-5, -6]]
+    assert model.batches == [[1, 2, 3, 4, 5, 6]]
+
+
+def test_request_that_does_not_fit_opens_the_next_batch():
+    model = RecordingModel()
+    scheduler = BatchScheduler(model, max_batch_size=4, max_wait_ms=50)
+
+    async def scenario():
+        return await asyncio.gather(
+            scheduler.predict(images(1, 2, 3)),
+            scheduler.predict(images(4, 5)),
+            scheduler.predict(images(6)),
+        )
+
+    results = asyncio.run(scenario())
+
+    assert [result[:, 0].tolist() for result in results] == [[1, 2, 3], [4, 5], [6]]
+    assert all(len(batch) <= 4 for batch in model.batches)
+    assert sorted(sum(model.batches, [])) == [1, 2, 3, 4, 5, 6]
+
+
+def test_model_failure_reaches_every_caller_of_the_batch():
+    class FailingModel:
+        def predict(self, images):
+            raise RuntimeError("out of memory")
+
+    scheduler = BatchScheduler(FailingModel(), max_batch_size=8, max_wait_ms=20)
+
+    async def scenario():
+        return await asyncio.gather(
+            scheduler.predict(images(1)), scheduler.predict(images(2)), return_exceptions=True
+        )
+
+    assert [str(error) for error in asyncio.run(scenario())] == ["out of memory", "out of memory"]
+
+
+def test_full_queue_is_refused():
+    release = threading.Event()
+
+    class BlockingModel(RecordingModel):
+        def predict(self, images):
+            release.wait(5)
+            return super().predict(images)
+
+    scheduler = BatchScheduler(BlockingModel(), max_batch_size=2, max_wait_ms=0, max_queue=4)
+
+    async def scenario():
+        running = asyncio.create_task(scheduler.predict(images(1, 2)))
+        await asyncio.sleep(0.05)  # picked up: the model is busy with it
+        queued = asyncio.create_task(scheduler.predict(images(3, 4, 5, 6)))
+        await asyncio.sleep(0)
+        with pytest.raises(ExecutorBusyError):
+            await scheduler.predict(images(7))
+        # Background work is not counted against the queue
+        background = asyncio.create_task(scheduler.predict(images(8), background=True))
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(running, queued, background)
+
+    results = asyncio.run(scenario())
+
+    assert [result[:, 0].tolist() for result in results] == [[1, 2], [3, 4, 5, 6], [8]]
+
+
+def test_busy_inference_answers_503_with_retry_after(client, monkeypatch):
+    from app import main
+
+    async def busy(images, background=False):
+        raise ExecutorBusyError("inference", retry_after=3)
+
+    monkeypatch.setattr(main.inference_scheduler, "predict", busy)
+
+    response = client.post(
+        "/verify-single-signature/upload", files={"signature": ("signature.png", encode(signature(1)), "image/png")}
+    )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
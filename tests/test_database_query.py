@@ -0,0 +1,119 @@
+import pytest
+
+from app import database
+from app.database import DATABASE_ENGINES, KIND_SIGNATURE_SET, KIND_VERIFICATION, SqliteDatabase
+
+
+def signature_set(n: int, user_id: str = "alice", signature_type: str = "student") -> dict:
+    # Several records share each timestamp, so pages must break ties by id
+    return {
+        "date_uploaded": f"2026-03-{1 + n // 4:02d}T10:00:00",
+        "user_id": user_id,
+        "signature_type": signature_type,
+    }
+
+
+def verification(n: int) -> dict:
+    return {"date_verified": f"2026-03-{1 + n // 4:02d}T12:00:00", "user_id": "bob"}
+
+
+@pytest.fixture(params=sorted(DATABASE_ENGINES))
+def db(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_DIR", tmp_path)
+    db = DATABASE_ENGINES[request.param]("records")
+    items = {f"set-{n:02d}": signature_set(n, user_id=("alice", "carol")[n % 2]) for n in range(30)}
+    items.update({f"verification_{n:02d}": verification(n) for n in range(10)})
+    db.create_many(items)
+    yield db
+    db.close()
+
+
+def pages(db, limit: int, **filters):
+    ids, cursor = [], None
+    while True:
+        page, cursor = db.query(cursor=cursor, limit=limit, **filters)
+        assert len(page) <= limit
+        ids.append([item_id for item_id, _ in page])
+        if cursor is None:
+            return ids
+
+
+def pages_from(db, cursor, **filters):
+    ids = []
+    while cursor is not None:
+        page, cursor = db.query(cursor=cursor, limit=5, **filters)
+        ids.append([item_id for item_id, _ in page])
+    return ids
+
+
+def ordered(db, reverse: bool = True, **filters):
+    items = [
+        (database.record_date(data), item_id)
+        for item_id, data in db.get_all().items()
+        if database.record_matches(item_id, data, **filters)
+    ]
+    return [item_id for _, item_id in sorted(items, reverse=reverse)]
+
+
+@pytest.mark.parametrize("limit", [1, 7, 10, 100])
+def test_pages_cover_every_record_once_newest_first(db, limit):
+    result = pages(db, limit)
+
+    assert sum(result, []) == ordered(db)
+    assert all(len(page) == limit for page in result[:-1])
+
+
+def test_oldest_first_pages(db):
+    assert sum(pages(db, 6, oldest_first=True), []) == ordered(db, reverse=False)
+
+
+@pytest.mark.parametrize("filters", [
+    {"kind": KIND_SIGNATURE_SET},
+    {"kind": KIND_VERIFICATION},
+    {"user_id": "carol"},
+    {"kind": KIND_SIGNATURE_SET, "user_id": "alice", "signature_type": "student"},
+    {"date_from": "2026-03-03", "date_to": "2026-03-06"},
+    {"user_id": "nobody"},
+], ids=["sets", "verifications", "user", "combined", "date-range", "no-match"])
+def test_filtered_pages(db, filters):
+    result = sum(pages(db, 4, **filters), [])
+
+    assert result == ordered(db, **filters)
+    assert all(database.record_matches(item_id, db.get(item_id), **filters) for item_id in result)
+
+
+def test_records_written_between_pages_do_not_shift_the_cursor(db):
+    first, cursor = db.query(kind=KIND_SIGNATURE_SET, limit=5)
+    db.create("set-new", signature_set(100))
+    db.delete(first[0][0])
+
+    rest = sum(pages_from(db, cursor, kind=KIND_SIGNATURE_SET), [])
+
+    expected = [item_id for item_id in ordered(db, kind=KIND_SIGNATURE_SET) if item_id != "set-new"]
+    assert [item_id for item_id, _ in first[1:]] + rest == expected
+
+
+def test_count_by_kind(db):
+    assert db.count() == 40
+    assert db.count(KIND_SIGNATURE_SET) == 30
+    assert db.count(KIND_VERIFICATION) == 10
+
+
+def test_invalid_cursor_is_rejected(db):
+    with pytest.raises(ValueError):
+        db.query(cursor="not-a-cursor")
+
+
+def test_sqlite_pages_use_an_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_DIR", tmp_path)
+    db = SqliteDatabase("records")
+    statements = []
+    db._conn.set_trace_callback(statements.append)
+    cursor = database.encode_cursor("2026-03-05T10:00:00", "set-10")
+
+    db.query(kind=KIND_SIGNATURE_SET, user_id="alice", cursor=cursor, limit=10)
+
+    sql = next(statement for statement in statements if statement.startswith("SELECT"))
+    plan = " ".join(row[-1] for row in db._conn.execute("EXPLAIN QUERY PLAN " + sql))
+    db.close()
+    assert "idx_records_user_date" in plan and "TEMP B-TREE" not in plan
@@ -0,0 +1,135 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from app import embeddings
+from app.embeddings import EmbeddingStore, normalize
+from signatures import encode, signature
+
+DIM = 16
+
+
+def vectors(seed: int, count: int = 3) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = EmbeddingStore(tmp_path, dtype="float16")
+    store.open("v1", DIM)
+    return store
+
+
+def test_enrolled_references_are_the_normalised_embeddings(store):
+    references = vectors(1)
+    block = store.enroll("alice", "student", references)
+
+    assert block.count == 3
+    stored = store.references("alice", "student")
+    np.testing.assert_allclose(stored, normalize(references), atol=1e-3)
+    assert store.references("alice", "staff") is None and store.references("bob", "student") is None
+
+
+def test_similarity_is_to_the_closest_reference(store):
+    references = vectors(2)
+    store.enroll("alice", "student", references)
+    other = vectors(3, count=1)
+
+    scores = store.similarity("alice", "student", np.vstack([references[1] * 5, other[0]]))
+
+    assert scores.shape == (2,)
+    assert scores[0] == pytest.approx(1.0, abs=1e-3)
+    assert scores[1] == pytest.approx((normalize(other) @ normalize(references).T).max(), abs=1e-3)
+    assert store.similarity("bob", "student", other) is None
+
+
+def test_reenrolling_replaces_and_delete_forgets(store):
+    store.enroll("alice", "student", vectors(4))
+    store.enroll("alice", "student", vectors(5, count=2))
+
+    assert store.block("alice", "student").count == 2
+    np.testing.assert_allclose(store.references("alice", "student"), normalize(vectors(5, count=2)), atol=1e-3)
+    assert store.stats()["dead_rows"] == 3
+
+    assert store.delete("alice", "student")
+    assert store.references("alice", "student") is None
+    assert not store.delete("alice", "student")
+
+
+def test_enrollments_survive_a_restart_and_reach_other_processes(tmp_path, store):
+    other = EmbeddingStore(tmp_path, dtype="float16")
+    other.open("v1", DIM)
+    store.enroll("alice", "student", vectors(6))
+
+    # The other store (another worker process) sees it without reopening
+    assert other.block("alice", "student").count == 3
+
+    reopened = EmbeddingStore(tmp_path, dtype="float16")
+    reopened.open("v1", DIM)
+    np.testing.assert_allclose(reopened.references("alice", "student"), normalize(vectors(6)), atol=1e-3)
+
+
+def test_store_of_other_weights_is_discarded(tmp_path, store):
+    store.enroll("alice", "student", vectors(7))
+
+    reopened = EmbeddingStore(tmp_path, dtype="float16")
+    reopened.open("v2", DIM)
+
+    assert reopened.references("alice", "student") is None
+    assert reopened.stats()["enrolled"] == 0
+
+
+def test_embeddings_of_the_wrong_size_are_refused(store):
+    with pytest.raises(ValueError):
+        store.enroll("alice", "student", np.ones((2, DIM + 1), np.float32))
+    with pytest.raises(ValueError):
+        store.enroll("alice", "student", np.ones((0, DIM), np.float32))
+
+
+def test_dead_rows_are_compacted_on_open(tmp_path, store, monkeypatch):
+    monkeypatch.setattr(embeddings, "COMPACT_MIN_DEAD_ROWS", 4)
+    for seed in range(5):
+        store.enroll("alice", "student", vectors(seed))
+    store.enroll("bob", "student", vectors(99, count=1))
+
+    reopened = EmbeddingStore(tmp_path, dtype="float16")
+    reopened.open("v1", DIM)
+
+    assert reopened.generation == store.generation + 1
+    assert reopened.stats()["dead_rows"] == 0 and reopened.stats()["rows"] == 4
+    np.testing.assert_allclose(reopened.references("alice", "student"), normalize(vectors(4)), atol=1e-3)
+    # The first store follows the new generation
+    np.testing.assert_allclose(store.references("bob", "student"), normalize(vectors(99, count=1)), atol=1e-3)
+
+
+def enroll(client, user_id: str, seeds) -> dict:
+    files = [("signatures", (f"{seed}.png", encode(signature(seed)), "image/png")) for seed in seeds]
+    response = client.post("/references/upload", files=files, data={"user_id": user_id, "signature_type": "student"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def verify(client, user_id: str, seeds) -> list:
+    files = [("signatures", (f"{seed}.png", encode(signature(seed)), "image/png")) for seed in seeds]
+    response = client.post(
+        "/verify-student-signatures/upload", files=files, data={"user_id": user_id, "signature_type": "student"}
+    )
+    assert response.status_code == 200, response.text
+    return [result["reference_similarity"] for result in response.json()["results"]]
+
+
+def test_verification_reports_similarity_to_enrolled_references(client):
+    user_id = f"student-{uuid.uuid4()}"
+
+    assert verify(client, user_id, [10]) == [None]
+    assert enroll(client, user_id, [10, 11])["reference_count"] == 2
+    assert client.get(f"/references/{user_id}").json()["reference_count"] == 2
+
+    same, different = verify(client, user_id, [10, 50])
+    assert same == pytest.approx(1.0, abs=1e-2)
+    assert different < same
+
+    assert client.delete(f"/references/{user_id}").status_code == 200
+    assert client.get(f"/references/{user_id}").status_code == 404
+    assert verify(client, user_id, [10]) == [None]
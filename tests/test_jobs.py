@@ -0,0 +1,163 @@
+import asyncio
+import base64
+import io
+import json
+import zipfile
+
+import numpy as np
+import pytest
+
+from app.jobs import JOB_COMPLETED, JOB_RUNNING, JobManager, JobUploadError
+from signatures import encode, signature
+
+
+class ReadyModel:
+    ready = True
+    failed = False
+
+
+class Scheduler:
+    """Background predictions for jobs; can be held after a number of calls."""
+
+    def __init__(self, hold_after=None):
+        self.hold_after = hold_after
+        self.calls = []
+        self.held = asyncio.Event()
+
+    async def predict(self, images, background=False):
+        assert background
+        if self.hold_after is not None and len(self.calls) >= self.hold_after:
+            self.held.set()
+            await asyncio.Event().wait()
+        self.calls.append(len(images))
+        return np.tile(np.array([[0.95, 0.05]], np.float32), (len(images), 1))
+
+
+def jsonl_archive(count: int) -> io.BytesIO:
+    lines = []
+    for n in range(count):
+        images = [base64.b64encode(encode(signature(n * 2 + i))).decode() for i in range(2)]
+        lines.append(json.dumps({"id": f"item-{n}", "signatures": images, "user_id": f"user-{n}"}))
+    lines.insert(3, "not json")
+    return io.BytesIO("\n".join(lines).encode())
+
+
+async def wait_for(manager: JobManager, job_id: str, condition, timeout: float = 30.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        job = manager.status(job_id)
+        if condition(job):
+            return job
+        assert asyncio.get_running_loop().time() < deadline, job
+        await asyncio.sleep(0.02)
+
+
+def all_results(manager: JobManager, job_id: str, limit: int):
+    items, cursor, pages = [], None, 0
+    while True:
+        page = manager.results(job_id, cursor, limit)
+        items.extend(page["items"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items, pages
+
+
+def test_job_runs_to_completion_and_pages_through_results(tmp_path):
+    scheduler = Scheduler()
+    manager = JobManager(scheduler, ReadyModel(), jobs_dir=tmp_path, batch_size=4)
+
+    async def scenario():
+        manager.start()
+        job = manager.create(jsonl_archive(6), "archive.jsonl")
+        manager.submit(job["job_id"])
+        job = await wait_for(manager, job["job_id"], lambda job: job["status"] == JOB_COMPLETED)
+        await manager.stop()
+        return job
+
+    job = asyncio.run(scenario())
+
+    assert (job["items_done"], job["item_errors"], job["images_done"], job["authentic"]) == (7, 1, 12, 12)
+    assert all(size <= 4 for size in scheduler.calls)
+    items, pages = all_results(manager, job["job_id"], limit=3)
+    assert pages == 3
+    assert [item["id"] for item in items] == ["item-0", "item-1", "item-2", "line-4", "item-3", "item-4", "item-5"]
+    assert "error" in items[3]
+    assert items[0]["user_id"] == "user-0" and items[0]["all_authentic"]
+    assert [result["filename"] for result in items[0]["results"]] == ["signature_1", "signature_2"]
+
+
+def test_interrupted_job_resumes_where_it_stopped(tmp_path):
+    async def first_run():
+        scheduler = Scheduler(hold_after=1)
+        manager = JobManager(scheduler, ReadyModel(), jobs_dir=tmp_path, batch_size=4)
+        manager.start()
+        job = manager.create(jsonl_archive(6), "archive.jsonl")
+        manager.submit(job["job_id"])
+        await asyncio.wait_for(scheduler.held.wait(), 30)
+        await manager.stop()
+        return job["job_id"]
+
+    job_id = asyncio.run(first_run())
+
+    job = json.loads((tmp_path / job_id / "job.json").read_text())
+    assert job["status"] == JOB_RUNNING and job["items_done"] == 2
+    # A step that was being written when the process died
+    with open(tmp_path / job_id / "results.jsonl", "ab") as f:
+        f.write(b'{"id": "item-2", "resu')
+
+    async def restart():
+        scheduler = Scheduler()
+        manager = JobManager(scheduler, ReadyModel(), jobs_dir=tmp_path, batch_size=4)
+        manager.start()
+        job = await wait_for(manager, job_id, lambda job: job["status"] == JOB_COMPLETED)
+        await manager.stop()
+        return manager, job
+
+    manager, job = asyncio.run(restart())
+
+    assert (job["items_done"], job["images_done"]) == (7, 12)
+    items, _ = all_results(manager, job_id, limit=100)
+    assert [item["id"] for item in items] == ["item-0", "item-1", "item-2", "line-4", "item-3", "item-4", "item-5"]
+
+
+def test_zip_archive_items_are_single_images(tmp_path):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        for n in range(3):
+            z.writestr(f"scans/{n}.png", encode(signature(n)))
+        z.writestr("notes.txt", "ignored")
+    manager = JobManager(Scheduler(), ReadyModel(), jobs_dir=tmp_path, batch_size=2)
+
+    async def scenario():
+        manager.start()
+        job = manager.create(archive, "scans.zip")
+        manager.submit(job["job_id"])
+        job = await wait_for(manager, job["job_id"], lambda job: job["status"] == JOB_COMPLETED)
+        await manager.stop()
+        return job
+
+    job = asyncio.run(scenario())
+
+    assert (job["total_items"], job["items_done"], job["images_done"]) == (3, 3, 3)
+    items, _ = all_results(manager, job["job_id"], limit=10)
+    assert [item["id"] for item in items] == ["scans/0.png", "scans/1.png", "scans/2.png"]
+
+
+def test_results_reject_invalid_cursors(tmp_path):
+    manager = JobManager(Scheduler(), ReadyModel(), jobs_dir=tmp_path)
+    job = manager.create(jsonl_archive(1), "archive.jsonl")
+
+    assert manager.results(job["job_id"], None, 10)["next_cursor"] == "0"
+    for cursor in ("abc", "-1", "5"):
+        with pytest.raises(ValueError):
+            manager.results(job["job_id"], cursor, 10)
+    assert manager.results("00000000-0000-0000-0000-000000000000", None, 10) is None
+
+
+def test_empty_upload_is_refused(tmp_path):
+    manager = JobManager(Scheduler(), ReadyModel(), jobs_dir=tmp_path)
+
+    with pytest.raises(JobUploadError):
+        manager.create(io.BytesIO(b""), "archive.jsonl")
+    assert list(tmp_path.iterdir()) == []
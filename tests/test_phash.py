@@ -0,0 +1,112 @@
+import hashlib
+
+import cv2
+import pytest
+
+from app.phash import PHashIndex, Screening, hamming
+from app.preprocessing import preprocess_hashed
+from signatures import encode, signature
+
+PREDICTION = (0.9, 0.1)
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def phash(data: bytes) -> int:
+    return preprocess_hashed(data, measure_ink=False)[1]
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = PHashIndex(tmp_path / "phash_index.jsonl")
+    index.model_version = "v1"
+    index.open()
+    return index
+
+
+def stored(index, data: bytes, record_id: str = "set-1") -> None:
+    index.add(record_id, [digest(data)], [phash(data)], [PREDICTION])
+
+
+def screen(index, data: bytes) -> Screening:
+    screening = Screening(index, [digest(data)], reuse_predictions=True)
+    screening.find_identical()
+    if screening.reusable(0) is None:
+        screening.hashed(0, phash(data))
+        screening.find_near()
+    return screening
+
+
+def test_byte_identical_replay_reuses_the_prediction(index):
+    data = encode(signature(1))
+    stored(index, data)
+
+    screening = screen(index, data)
+
+    match = screening.matches[0]
+    assert match.identical and match.distance == 0 and match.record_id == "set-1"
+    assert screening.reusable(0) == PREDICTION
+
+
+def test_reencoded_copy_is_reported_but_predicted_again(index):
+    image = signature(2)
+    stored(index, encode(image))
+    copy = encode(cv2.resize(image, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA), ".jpg", 70)
+
+    screening = screen(index, copy)
+
+    match = screening.matches[0]
+    assert match is not None and not match.identical
+    assert match.distance <= index.max_distance
+    assert screening.reusable(0) is None
+
+
+def test_traced_signature_never_gets_the_stored_verdict(index):
+    stored(index, encode(signature(3)))
+    tracing = encode(signature(3, jitter=1.5))
+
+    screening = screen(index, tracing)
+
+    # A tracing hashes as close as a copy: at most reported, never reused
+    assert screening.reusable(0) is None
+
+
+def test_different_signatures_do_not_match(index):
+    for seed in range(40):
+        stored(index, encode(signature(seed)), record_id=f"set-{seed}")
+
+    for seed in range(100, 140):
+        screening = screen(index, encode(signature(seed)))
+        assert screening.matches[0] is None
+        assert screening.reusable(0) is None
+
+
+def test_default_distance_separates_copies_from_different_signatures(index):
+    hashes = [phash(encode(signature(seed))) for seed in range(60)]
+    closest_different = min(hamming(a, b) for i, a in enumerate(hashes) for b in hashes[i + 1:])
+    farthest_copy = max(
+        hamming(phash(encode(signature(seed))), phash(encode(signature(seed), ".jpg", 70)))
+        for seed in range(20)
+    )
+    assert farthest_copy <= index.max_distance < closest_different
+
+
+def test_prediction_of_other_weights_is_not_reused(index):
+    data = encode(signature(4))
+    stored(index, data)
+    index.model_version = "v2"
+
+    screening = screen(index, data)
+
+    assert screening.matches[0].identical
+    assert screening.reusable(0) is None
+
+
+def test_deleted_records_are_forgotten(index):
+    data = encode(signature(5))
+    stored(index, data)
+    index.delete_records(["set-1"])
+
+    assert screen(index, data).matches[0] is None
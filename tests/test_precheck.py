@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.preprocessing import blank_reason, ink_stats, preprocess_hashed
+from signatures import encode, signature
+
+
+def verdict(data: bytes):
+    return blank_reason(preprocess_hashed(data)[2])
+
+
+def canvas(width: int, height: int, level=255) -> np.ndarray:
+    return np.full((height, width, 3), level, np.uint8)
+
+
+def thin_stroke(width: int, height: int, thickness: int) -> np.ndarray:
+    """A wavy line across the middle fifth of a white canvas."""
+    image = canvas(width, height)
+    xs = np.linspace(0.4, 0.6, 200)
+    points = np.stack([xs * width, height * (0.5 + 0.1 * np.sin(xs * 60))], axis=1).astype(np.int32)
+    cv2.polylines(image, [points], False, (0, 0, 0), thickness)
+    return image
+
+
+def noisy_paper(width: int, height: int, sigma: float) -> np.ndarray:
+    noise = np.random.default_rng(0).normal(0, sigma, (height, width, 1))
+    return np.clip(250 - np.abs(noise), 0, 255).astype(np.uint8).repeat(3, axis=2)
+
+
+@pytest.mark.parametrize("image, ext", [
+    (canvas(600, 250), ".png"),
+    (canvas(600, 250), ".jpg"),
+    (canvas(800, 300, level=40), ".png"),  # dark signature pad
+    (canvas(4000, 2000, level=245), ".jpg"),
+    (noisy_paper(2000, 1000, sigma=3), ".jpg"),
+], ids=["white-png", "white-jpeg", "dark-pad", "large-jpeg", "noisy-scan"])
+def test_blank_canvas_is_caught(image, ext):
+    assert verdict(encode(image, ext, quality=60)) is not None
+
+
+def test_a_speck_is_not_a_signature():
+    image = canvas(600, 250)
+    cv2.circle(image, (300, 120), 1, (0, 0, 0), -1)
+    assert verdict(encode(image)) is not None
+
+
+@pytest.mark.parametrize("width, height, thickness", [
+    (4000, 2000, 2),
+    (3000, 2000, 2),
+    (2000, 1000, 1),
+    (600, 250, 1),
+])
+@pytest.mark.parametrize("ext", [".png", ".jpg"])
+def test_thin_stroke_on_large_image_is_not_blank(width, height, thickness, ext):
+    assert verdict(encode(thin_stroke(width, height, thickness), ext)) is None
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_signatures_are_not_blank(seed):
+    assert verdict(encode(signature(seed), ".jpg", quality=70)) is None
+
+
+def test_light_ink_on_dark_pad_is_not_blank():
+    image = canvas(800, 300, level=30)
+    cv2.polylines(image, [np.array([(100, 150), (300, 90), (500, 200), (700, 120)], np.int32)], False, (230, 230, 230), 1)
+    assert verdict(encode(image)) is None
+
+
+@pytest.mark.parametrize("width, height", [(4000, 5), (5, 4000), (3000, 1)])
+def test_thin_strips_are_measured(width, height):
+    blank = canvas(width, height)
+    signed = blank.copy()
+    cv2.line(signed, (width // 4, height // 2), (3 * width // 4, height // 2), (0, 0, 0), 1)
+    cv2.line(signed, (width // 2, height // 4), (width // 2, 3 * height // 4), (0, 0, 0), 1)
+
+    assert verdict(encode(blank)) is not None
+    assert verdict(encode(signed)) is None
+
+
+def test_ink_in_the_partial_last_cell_counts():
+    # 4000 px at 18 px per cell leaves a 4 px column and a 2 px row at the edges
+    gray = np.full((2000, 4000), 255, np.uint8)
+    gray[:, -2] = 0
+    gray[-1, :] = 0
+
+    stats = ink_stats(gray)
+
+    # The last column and the last row of a 112 x 223 grid
+    assert stats.ink_density * 112 * 223 == pytest.approx(112 + 223 - 1)
+    assert stats.bbox_area == 1.0
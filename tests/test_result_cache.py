@@ -0,0 +1,138 @@
+import asyncio
+
+import numpy as np
+
+from app import result_cache
+from app.result_cache import PredictionCache
+
+
+def rows_for(keys, indices):
+    return np.array([[float(keys[i][-1]), 0.0] for i in indices], np.float32)
+
+
+class Predictor:
+    """compute() for PredictionCache.resolve that records what it was asked for."""
+
+    def __init__(self, keys, delay: float = 0.0):
+        self.keys = keys
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, indices):
+        self.calls.append(list(indices))
+        await asyncio.sleep(self.delay)
+        return rows_for(self.keys, indices)
+
+
+def test_second_lookup_is_a_hit():
+    cache = PredictionCache(max_entries=10, ttl_seconds=60)
+    keys = ["a:1", "b:2"]
+
+    async def scenario():
+        first = Predictor(keys)
+        await cache.resolve(keys, first)
+        second = Predictor(keys)
+        rows = await cache.resolve(keys, second)
+        return first, second, rows
+
+    first, second, rows = asyncio.run(scenario())
+
+    assert first.calls == [[0, 1]] and second.calls == []
+    assert rows[:, 0].tolist() == [1.0, 2.0]
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_only_misses_are_computed():
+    cache = PredictionCache(max_entries=10, ttl_seconds=60)
+    cache.put("a:1", np.array([1.0, 0.0]))
+    keys = ["a:1", "b:2", None]
+
+    predictor = Predictor(["a:1", "b:2", "c:3"])
+    rows = asyncio.run(cache.resolve(keys, predictor))
+
+    assert predictor.calls == [[1, 2]]
+    assert rows[:, 0].tolist() == [1.0, 2.0, 3.0]
+    # A None key is never cached
+    assert cache.stats()["entries"] == 2
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "monotonic", lambda: now[0])
+    cache = PredictionCache(max_entries=10, ttl_seconds=30)
+    cache.put("a:1", np.array([1.0, 0.0]))
+
+    now[0] += 29
+    assert cache.get("a:1") is not None
+    now[0] += 2
+    assert cache.get("a:1") is None
+    assert cache.evictions == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PredictionCache(max_entries=2, ttl_seconds=60)
+    cache.put("a:1", np.array([1.0, 0.0]))
+    cache.put("b:2", np.array([2.0, 0.0]))
+    cache.get("a:1")
+    cache.put("c:3", np.array([3.0, 0.0]))
+
+    assert cache.get("b:2") is None
+    assert cache.get("a:1") is not None and cache.get("c:3") is not None
+
+
+def test_key_includes_model_version_and_threshold():
+    cache = PredictionCache()
+    key = cache.make_key("digest", 0.9)
+    cache.model_version = "v2"
+
+    assert cache.make_key("digest", 0.9) != key
+    assert cache.make_key("digest", 0.8) != cache.make_key("digest", 0.9)
+
+
+def test_concurrent_requests_for_the_same_image_predict_it_once():
+    cache = PredictionCache(max_entries=10, ttl_seconds=60)
+    keys = ["a:1"]
+
+    async def scenario():
+        predictors = [Predictor(keys, delay=0.05) for _ in range(3)]
+        results = await asyncio.gather(*(cache.resolve(keys, predictor) for predictor in predictors))
+        return predictors, results
+
+    predictors, results = asyncio.run(scenario())
+
+    assert sum(len(predictor.calls) for predictor in predictors) == 1
+    assert [result[:, 0].tolist() for result in results] == [[1.0]] * 3
+    assert (cache.misses, cache.coalesced) == (1, 2)
+
+
+def test_failed_prediction_reaches_coalesced_requests_and_is_not_cached():
+    cache = PredictionCache(max_entries=10, ttl_seconds=60)
+
+    async def failing(indices):
+        await asyncio.sleep(0.05)
+        raise RuntimeError("model crashed")
+
+    async def scenario():
+        return await asyncio.gather(
+            cache.resolve(["a:1"], failing), cache.resolve(["a:1"], failing), return_exceptions=True
+        )
+
+    errors = asyncio.run(scenario())
+
+    assert [str(error) for error in errors] == ["model crashed", "model crashed"]
+    assert cache.get("a:1") is None
+
+    predictor = Predictor(["a:1"])
+    assert asyncio.run(cache.resolve(["a:1"], predictor))[:, 0].tolist() == [1.0]
+    assert predictor.calls == [[0]]
+
+
+def test_disabled_cache_stores_nothing():
+    cache = PredictionCache(max_entries=0)
+    predictor = Predictor(["a:1"])
+
+    asyncio.run(cache.resolve(["a:1"], predictor))
+    asyncio.run(cache.resolve(["a:1"], predictor))
+
+    assert not cache.enabled
+    assert predictor.calls == [[0], [0]]
@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+
+from app import database, write_behind
+from app.database import SqliteDatabase
+from app.executors import ExecutorBusyError
+from app.write_behind import WriteBehindQueue
+
+
+class GatedDatabase(SqliteDatabase):
+    """Holds batch writes until the test opens the gate; can fail them on demand."""
+
+    def __init__(self, collection_name: str):
+        super().__init__(collection_name)
+        self.gate = threading.Event()
+        self.failures = 0
+        self.batches = []
+
+    def create_many(self, items):
+        self.gate.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise IOError("disk full")
+        self.batches.append(sorted(items))
+        super().create_many(items)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_DIR", tmp_path)
+    db = GatedDatabase("records")
+    yield db
+    db.gate.set()
+    db.close()
+
+
+def record(n: int, user_id: str = "alice") -> dict:
+    return {"date_verified": f"2026-03-01T10:00:{n:02d}", "user_id": user_id}
+
+
+def ids(page):
+    return [item_id for item_id, _ in page]
+
+
+def test_queued_record_is_readable_before_it_is_written(db):
+    queue = WriteBehindQueue(db, batch_size=10, flush_ms=1)
+    queue.create("verification_1", record(1))
+
+    assert db.get("verification_1") is None
+    assert queue.get("verification_1") == record(1)
+
+    db.gate.set()
+    queue.close()
+    assert db.get("verification_1") == record(1)
+
+
+def test_query_merges_queued_records_in_order(db):
+    db.gate.set()
+    for n in (1, 3, 5):
+        db.create(f"verification_{n}", record(n))
+    db.gate.clear()
+    queue = WriteBehindQueue(db, batch_size=10, flush_ms=1)
+    for n in (2, 4, 6):
+        queue.create(f"verification_{n}", record(n))
+    queue.create("verification_7", record(7, user_id="bob"))
+
+    page, cursor = queue.query(limit=4, user_id="alice")
+    rest, last = queue.query(limit=4, cursor=cursor, user_id="alice")
+
+    assert ids(page) == ["verification_6", "verification_5", "verification_4", "verification_3"]
+    assert ids(rest) == ["verification_2", "verification_1"] and last is None
+    oldest, _ = queue.query(limit=2, oldest_first=True)
+    assert ids(oldest) == ["verification_1", "verification_2"]
+    db.gate.set()
+    queue.close()
+
+
+def test_cursor_stays_valid_across_a_flush(db):
+    queue = WriteBehindQueue(db, batch_size=10, flush_ms=1)
+    for n in range(1, 7):
+        queue.create(f"verification_{n}", record(n))
+    page, cursor = queue.query(limit=3)
+
+    db.gate.set()
+    queue.close()
+    rest, _ = queue.query(limit=3, cursor=cursor)
+
+    assert ids(page) + ids(rest) == [f"verification_{n}" for n in range(6, 0, -1)]
+
+
+def test_queued_record_can_be_deleted(db):
+    queue = WriteBehindQueue(db, batch_size=10, flush_ms=1000)
+    queue.create("verification_1", record(1))
+
+    assert queue.delete("verification_1")
+    assert queue.get("verification_1") is None
+
+    db.gate.set()
+    queue.close()
+    assert db.get("verification_1") is None
+
+
+def test_full_queue_is_refused(db):
+    queue = WriteBehindQueue(db, batch_size=100, flush_ms=1000, max_pending=3)
+    queue.create("verification_1", record(1), files={"/nonexistent/a.png": b"a"})
+    queue.create("verification_2", record(2))
+
+    with pytest.raises(ExecutorBusyError):
+        queue.create("verification_3", record(3), files={"/nonexistent/b.png": b"b"})
+
+    # Refused as a whole: neither the record nor its file was queued
+    assert queue.get("verification_3") is None
+    assert queue.pending == 3
+    assert queue.stats["rejected"] == 1
+    queue.discard_files("/nonexistent")
+    db.gate.set()
+    queue.close()
+
+
+def test_failed_batch_is_retried(db, monkeypatch):
+    monkeypatch.setattr(write_behind, "RETRY_DELAY", 0.01)
+    db.failures = 2
+    db.gate.set()
+    queue = WriteBehindQueue(db, batch_size=10, flush_ms=1)
+
+    queue.create("verification_1", record(1))
+    deadline = time.monotonic() + 5
+    while queue.stats["flushed_records"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    queue.close()
+
+    assert db.get("verification_1") == record(1)
+    assert queue.stats["errors"] == 2 and queue.stats["flushed_records"] == 1
+
+
+def test_files_are_written_and_close_flushes_everything(db, tmp_path):
+    db.gate.set()
+    queue = WriteBehindQueue(db, batch_size=2, flush_ms=10_000)
+    for n in range(5):
+        queue.create(f"verification_{n}", record(n), files={tmp_path / "uploads" / f"{n}.png": bytes([n])})
+
+    queue.close()
+
+    assert db.count() == 5
+    assert [(tmp_path / "uploads" / f"{n}.png").read_bytes() for n in range(5)] == [bytes([n]) for n in range(5)]
+    assert all(len(batch) <= 2 for batch in db.batches)